@@ -262,14 +262,64 @@ def api_bucket_query():
 		"results": buckets
 	}
 
+def can_use_sketches(name, query_params):
+	"""
+	Whether a dynamic index query only asks for the top nodes or ports by
+	a single counter, which the heavy-hitter sketches can answer.
+	"""
+	sketch_size = getattr(config, "pre_sketch_size", 0)
+	sort = query_params["sort"]
+	if sketch_size <= 0 or not name in [ "nodes", "ports" ]:
+		return False
+	if not sort or len(sort) != 1 or sort[0][1] != -1 or not sort[0][0] in config.flow_aggr_sums + [ common.COL_FLOWS ]:
+		return False
+	if query_params["limit"] <= 0 or query_params["limit"] > sketch_size:
+		return False
+	for param in [ "aggregate", "include_ports", "exclude_ports", "include_ips", "exclude_ips", "include_protos", "exclude_protos" ]:
+		if len(query_params[param]) > 0:
+			return False
+	return True
+
 @get("/api/dynamic/index/:name")
 def api_dynamic_index(name):
 	query_params = extract_mongo_query_params()
-	(results, total) = db.dynamic_index_query(name, query_params)
+	result = None
+	if can_use_sketches(name, query_params):
+		result = db.topk_query(name, query_params)
+	if result != None:
+		(results, total) = result
+	else:
+		(results, total) = db.dynamic_index_query(name, query_params)
 
 	return { "totalCounter" : total, "results": results }
 
 	
+@get("/api/fanout/:name")
+def api_fanout(name):
+	query_params = extract_mongo_query_params()
+	if name == common.DB_FANOUT:
+		fields = [ common.COL_DST_IP, common.COL_DST_PORT ]
+	elif name == common.DB_FANIN:
+		fields = [ common.COL_SRC_IP ]
+	else:
+		raise HTTPError(404, "Fan-out name not known.")
+	field = request.GET.get("field", fields[0])
+	if not field in fields:
+		raise HTTPError(output="Param field has to be one of " + ", ".join(fields) + ".")
+
+	ids = None
+	if len(query_params["include_ips"]) > 0:
+		ids = query_params["include_ips"]
+	counts = db.fanout_query(name, field, query_params["bucket_size"], query_params["start_bucket"], query_params["end_bucket"], ids)
+	if counts == None:
+		raise HTTPError(404, "The database has no fan-out counters.")
+
+	results = [ { "id": host, "count": int(round(count)) } for (host, count) in counts.iteritems() ]
+	results.sort(key=lambda row: row["count"], reverse=True)
+	if query_params["limit"] > 0:
+		results = results[:query_params["limit"]]
+	return { "results": results }
+
 @get("/api/index/:name")
 @get("/api/index/:name/")
 def api_index(name):
@@ -3,11 +3,30 @@ from analysis_base import AnalysisBase
 import config
 import common
 
+# number of distinct destination addresses or ports of a scanner
+SCAN_THRESHOLD = 50
+
 class NetworkScanDetector(AnalysisBase):
 	def __init__(self, flowbackend, databackend):
 		AnalysisBase.__init__(self, flowbackend, databackend)
 
 
 	def analyze(self, startBucket, endBucket):
-		tableName = common.DB_FLOW_PREFIX + str(self.flowBackend.getBucketSize(startBucket, endBucket, 1000))
-		#print  self.flowBackend.run_query(tableName, "SELECT proto, srcIP, dstIP, dstPort, COUNT(DISTINCT dstIP) AS di from %s WHERE pkts <= 3 AND (proto != 1 OR dstPort = 2048) GROUP BY proto, srcIP, dstPort HAVING di >= 50 ORDER BY di DESC");
+		"""
+		Reports the sources that contacted at least SCAN_THRESHOLD distinct
+		destination addresses (horizontal scan) or ports (vertical scan).
+		Uses the fan-out counters of the preprocessor (pre_fanout_precision).
+		"""
+		bucketSize = self.flowBackend.getBucketSize(startBucket, endBucket, 1000)
+		scanners = []
+		for field in [ common.COL_DST_IP, common.COL_DST_PORT ]:
+			fanout = self.flowBackend.fanout_query(common.DB_FANOUT, field, bucketSize, startBucket, endBucket)
+			if fanout == None:
+				# the backend has no fan-out counters
+				return []
+			for host, count in sorted(fanout.iteritems(), key=lambda item: item[1], reverse=True):
+				if count < SCAN_THRESHOLD:
+					break
+				print "Possible scan from %s: ~%i distinct %s" % (host, count, field)
+				scanners.append((host, field, count))
+		return scanners
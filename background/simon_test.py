@@ -9,5 +9,14 @@ class SimonTest(AnalysisBase):
 
 
 	def analyze(self, startBucket, endBucket):
-		tableName = common.DB_FLOW_PREFIX + str(self.flowBackend.getBucketSize(startBucket, endBucket, 1000))
+		bucketSize = self.flowBackend.getBucketSize(startBucket, endBucket, 1000)
+		# estimate the number of distinct destinations from the fan-out 
+		# counters of the preprocessor instead of grouping all flows.
+		# the estimates include all packets and protocols
+		fanout = self.flowBackend.fanout_query(common.DB_FANOUT, common.COL_DST_IP, bucketSize, startBucket, endBucket)
+		if fanout != None:
+			print sorted([ (host, count) for (host, count) in fanout.iteritems() if count >= 50 ], key=lambda item: item[1], reverse=True)
+			return
+
+		tableName = common.DB_FLOW_PREFIX + str(bucketSize)
 		print  self.flowBackend.run_query(tableName, "SELECT proto, srcIP, dstIP, dstPort, COUNT(DISTINCT dstIP) AS di from %s WHERE pkts <= 3 AND (proto != 1 OR dstPort = 2048) GROUP BY proto, srcIP, dstPort HAVING di >= 50 ORDER BY di DESC");
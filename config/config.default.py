@@ -18,6 +18,10 @@ flowDBName="flows"
 
 # Destination Flow Backend (Default: MongoDB)
 #----------------------------------------------------------------
+# The mongo backend keys the flow documents by packed binary ids.
+# Databases that were written by versions with string ids have to be
+# imported again with --clear-database. Otherwise the flows of a
+# bucket that was written before the upgrade end up in two documents.
 db_backend = "mongo"
 db_host = "127.0.0.1"
 db_port = 27017
@@ -59,10 +63,55 @@ flow_filter_unknown_ports = False
 pre_cache_size = 10000
 # cache size for aggregated collections per bucket size
 pre_cache_size_aggr = 5
+# eviction policy of the caches: "fifo", "lru", "lfu" or "bucket"
+# (evict the keys of the oldest bucket first)
+pre_cache_policy = "lru"
 # Defines whether this is a live or offline data import.
 # The preprocessor will periodically try to flush its 
 # cache in case of a live import. 
 live_import=True
+# Live import: buckets are written to the database once the latest
+# flow end seen is this many seconds past the end of the bucket.
+# Flows that arrive later are merged into a small reopen buffer.
+pre_allowed_lateness = 300
+
+# Encoding of the flows in the Redis queue: "binary" packs many flows
+# into one queue entry (see lib/flowrecord.py), "json" writes one JSON
+# object per flow. The preprocessor reads both.
+queue_format = "binary"
+
+# Only slice the flows into the smallest bucket size and merge the 
+# documents of the larger bucket sizes from the smaller ones. Bucket 
+# sizes that are not a multiple of a smaller size are still sliced.
+pre_rollup = False
+
+# Sample the flows with deterministic hash based sampling while the 
+# preprocessor cannot keep up with the queue (see lib/loadshedder.py 
+# and the --overload-* options of preprocess.py). The counters of the
+# sampled flows are scaled up, so that the totals stay unbiased.
+pre_overload = False
+# Keep a heavy-hitter sketch with this many nodes and ports per bucket
+# (see lib/sketch.py). The web interface answers top-N node and port
+# queries from the sketches instead of grouping the complete indexes.
+# Requires the mongo backend. 0 disables the sketches.
+pre_sketch_size = 0
+# Count the distinct destination addresses and ports of every source and
+# the distinct sources of every destination per bucket with HyperLogLogs
+# of this precision (see lib/hyperloglog.py). 10 gives about 3% error.
+# Used by the scan detectors. Requires the mongo backend and the
+# addresses and ports in flow_aggr_values. 0 disables the counters.
+pre_fanout_precision = 0
+# Record the first and last bucket and the number of rows of every
+# bucket size in a small catalog collection (see lib/bucketcatalog.py).
+# The web interface picks the bucket size and the time range of a query
+# from an in-memory copy of the catalog instead of probing the flow
+# collections. The preprocessor completes the catalog of a database
+# that was filled without it from the aggregated flow collections when
+# it starts; until then the web interface keeps probing.
+bucket_catalog = True
+# Seconds after which the web interface reads the newest catalog
+# entries again.
+bucket_catalog_refresh = 10
 
 
 
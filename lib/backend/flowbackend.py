@@ -6,6 +6,7 @@ Currently supported backends:
 	- mongodb
 	- mysql
 	- oracle
+	- memory (no database, for benchmarks)
 
 Author: Lothar Braun 
 """
@@ -151,6 +152,12 @@ class Backend:
 		self.insertMode = insertMode
 		self.index_cache = {}
 
+		# the first/last buckets of every bucket size (see bucketcatalog.py)
+		self.catalog = None
+		if getattr(config, "bucket_catalog", False):
+			import bucketcatalog
+			self.catalog = bucketcatalog.BucketCatalog(self, getattr(config, "bucket_catalog_refresh", 10))
+
 	def connect(self):
 		pass
 
@@ -176,17 +183,26 @@ class Backend:
 	def getMinBucket(self, bucketSize = None):
 		"""
 		Gets the earliest bucket that is stored in the database for the given 
-		bucket size. 
+		bucket size. Uses the bucket catalog if it is complete.
 		"""
-		pass
+		if not bucketSize:
+			# use minimal bucket size
+			bucketSize = config.flow_bucket_sizes[0]
+		if self.catalog != None and self.catalog.is_complete():
+			return self.catalog.get_min_bucket(bucketSize)
+		return self.probeMinBucket(bucketSize)
 
 	def getMaxBucket(self, bucketSize = None):
 		"""
 		Gets the latest bucket that is stored in the database for the given 
-		bucket size. 
+		bucket size. Uses the bucket catalog if it is complete.
 		"""
-		pass
-
+		if not bucketSize:
+			# use minimal bucket size
+			bucketSize = config.flow_bucket_sizes[0]
+		if self.catalog != None and self.catalog.is_complete():
+			return self.catalog.get_max_bucket(bucketSize)
+		return self.probeMaxBucket(bucketSize)
 
 	def getBucketSize(self, startTime, endTime, resolution):
 		"""
@@ -196,8 +212,40 @@ class Backend:
 		The bucket sizes are defined in config.py, and must not necessarily
 		match to the requested resolution.
 		"""
+		if self.catalog != None and self.catalog.is_complete():
+			return self.catalog.get_bucket_size(startTime, endTime, resolution, config.flow_bucket_sizes)
+		return self.probeBucketSize(startTime, endTime, resolution)
+
+	def probeMinBucket(self, bucketSize):
+		"""
+		Queries the flow collection of bucketSize for its earliest bucket.
+		Used if there is no complete bucket catalog.
+		"""
+		pass
+
+	def probeMaxBucket(self, bucketSize):
+		"""
+		Queries the flow collection of bucketSize for its latest bucket.
+		Used if there is no complete bucket catalog.
+		"""
+		pass
+
+	def probeBucketSize(self, startTime, endTime, resolution):
+		"""
+		Implements getBucketSize() with queries on the flow collections.
+		Used if there is no complete bucket catalog.
+		"""
 		pass
 
+	def bucket_catalog_query(self, startBucket=None):
+		"""
+		Reads the bucket catalog (see bucketcatalog.py). Returns a list of
+		(bucket size, bucket, rows, flows) for all buckets from startBucket
+		on (all buckets if startBucket is None) or None if the backend has
+		no catalog.
+		"""
+		return None
+
 	def clearDatabase(self):
 		"""
 		Removes all data from the backend
@@ -280,6 +328,29 @@ class Backend:
 
 	def dynamic_index_query(self, name, query_params):
 		pass 
+
+	def topk_query(self, name, query_params):
+		"""
+		Answers a top-N query on the dynamic index name (nodes or ports)
+		with the heavy-hitter sketches (see sketch.py). Only the sort field
+		(the first entry of sort) is used to select the top entries. Returns
+		the same as dynamic_index_query() or None if the backend has no 
+		sketches for the query.
+		"""
+		return None
+
+	def fanout_query(self, name, field, bucket_size, start_bucket, end_bucket, ids=None):
+		"""
+		Estimates the number of distinct values of field per host from the
+		HyperLogLog counters (see hyperloglog.py).
+		- name - common.DB_FANOUT (field is the destination address or port
+		  of the sources) or common.DB_FANIN (field is the source address of
+		  the destinations)
+		- ids - optional list of hosts. None returns all hosts
+		Returns a dictionary of host and estimate or None if the backend
+		has no counters.
+		"""
+		return None
 	
 	def find_one(self, collectionName, spec, fields, sort):
 		pass
@@ -356,5 +427,8 @@ def getBackendObject(backend, host, port, user, password, databaseName, insertMo
 	elif backend == "oracle":
 		from oraclebackend import OracleBackend
 		return OracleBackend(host, port, user, password, databaseName, insertMode)
+	elif backend == "memory":
+		from memorybackend import MemoryBackend
+		return MemoryBackend(host, port, user, password, databaseName, insertMode)
 	else:
 		raise Exception("Backend " + backend + " is not a supported backend")
@@ -0,0 +1,136 @@
+from flowbackend import Backend
+
+import sys
+import config
+import common
+
+class MemoryBackend(Backend):
+	"""
+	Keeps all collections in dictionaries. There is no database and
+	nothing is persisted. Used to run the preprocessor in benchmarks.
+	Counts the upserts that reach the backend per collection.
+	"""
+	def __init__(self, host, port, user, password, databaseName, insertMode="UPDATE"):
+		Backend.__init__(self, host, port, user, password, databaseName, insertMode)
+		self.collections = {}
+		self.upserts = {}
+
+	def connect(self):
+		pass
+
+	def clearDatabase(self):
+		self.collections = {}
+		self.upserts = {}
+		self.index_cache = {}
+
+	def getCollectionList(self):
+		return self.collections.keys()
+
+	def count(self, collectionName):
+		return len(self.collections.get(collectionName, {}))
+
+	def min(self, collectionName, field):
+		values = [ doc[field] for doc in self.collections.get(collectionName, {}).itervalues() if field in doc ]
+		if len(values) == 0:
+			return None
+		return min(values)
+
+	def max(self, collectionName, field):
+		values = [ doc[field] for doc in self.collections.get(collectionName, {}).itervalues() if field in doc ]
+		if len(values) == 0:
+			return None
+		return max(values)
+
+	def update(self, collectionName, statement, document, insertIfNotExists, comes_from_cache = False):
+		if collectionName.startswith("index") and not comes_from_cache:
+			self.handle_index_update(collectionName, statement, document, insertIfNotExists)
+			return
+
+		self.upserts[collectionName] = self.upserts.get(collectionName, 0) + 1
+		collection = self.collections.setdefault(collectionName, {})
+		key = frozenset(statement.items())
+		doc = collection.get(key, None)
+		if doc == None:
+			if not insertIfNotExists:
+				return
+			doc = dict(statement)
+			collection[key] = doc
+		doc.update(document.get("$set", {}))
+		for field, value in document.get("$inc", {}).iteritems():
+			doc[field] = doc.get(field, 0) + value
+
+	def flushCache(self, collectionName=None):
+		if collectionName == None or collectionName in self.index_cache:
+			self.flush_index_cache(collectionName)
+
+	def find(self, collectionName, spec={}, fields=None, sort=None, limit=None):
+		result = [ doc for doc in self.collections.get(collectionName, {}).itervalues() if all([ doc.get(k, None) == v for (k, v) in spec.items() ]) ]
+		if limit:
+			result = result[:limit]
+		return result
+
+	def find_one(self, collectionName, spec, fields=None, sort=None):
+		result = self.find(collectionName, spec, fields, sort, 1)
+		if len(result) == 0:
+			return None
+		return result[0]
+
+	def bucket_catalog_query(self, startBucket=None):
+		entries = []
+		for doc in self.collections.get(common.DB_BUCKET_CATALOG, {}).itervalues():
+			if startBucket == None or doc[common.COL_BUCKET] >= startBucket:
+				entries.append((doc[common.COL_BUCKET_SIZE], doc[common.COL_BUCKET], doc.get(common.COL_ROWS, 0), doc.get(common.COL_FLOWS, 0)))
+		return entries
+
+	def get_table_sizes(self):
+		return dict([ (name, len(collection)) for (name, collection) in self.collections.iteritems() ])
+
+	def topk_query(self, name, query_params):
+		"""
+		Merges the sketches and sums the index entries of the top ids.
+		Protocol specific counters are returned as flat "proto.field" keys.
+		"""
+		import sketch
+
+		if name == "nodes":
+			(prefix, index) = (common.DB_SKETCH_NODES, common.DB_INDEX_NODES)
+		elif name == "ports":
+			(prefix, index) = (common.DB_SKETCH_PORTS, common.DB_INDEX_PORTS)
+		else:
+			raise Exception("Unknown dynamic index specified")
+		suffix = "_" + str(query_params["bucket_size"])
+		field = query_params["sort"][0][0]
+		start_bucket = query_params["start_bucket"]
+		end_bucket = query_params["end_bucket"]
+
+		def in_range(doc):
+			return start_bucket <= doc[common.COL_BUCKET] <= end_bucket
+
+		docs = [ doc for doc in self.collections.get(prefix + suffix, {}).itervalues() if in_range(doc) ]
+		merged = sketch.merge_docs(docs, field)
+		if merged == None:
+			return None
+		ids = set([ key for (key, count, error) in merged.top(query_params["limit"]) ] + [ "total" ])
+
+		rows = dict()
+		for doc in self.collections.get(index + suffix, {}).itervalues():
+			if not doc[common.COL_ID] in ids or not in_range(doc):
+				continue
+			row = rows.setdefault(doc[common.COL_ID], { "id": doc[common.COL_ID] })
+			for (key, value) in doc.iteritems():
+				if not key in [ common.COL_ID, common.COL_BUCKET ]:
+					row[key] = row.get(key, 0) + value
+		total = rows.pop("total", None)
+		results = sorted(rows.values(), key=lambda row: row.get(field, 0), reverse=True)
+		return (results[:query_params["limit"]], total)
+
+	def fanout_query(self, name, field, bucket_size, start_bucket, end_bucket, ids=None):
+		import hyperloglog
+
+		if getattr(config, "pre_fanout_precision", 0) <= 0:
+			return None
+
+		docs = [ doc for doc in self.collections.get(name + "_" + str(bucket_size), {}).itervalues()
+			if start_bucket <= doc[common.COL_BUCKET] <= end_bucket and (ids == None or doc[common.COL_ID] in ids) ]
+		counters = hyperloglog.merge_docs(docs, field)
+		return dict([ (host, hll.count()) for (host, hll) in counters.iteritems() ])
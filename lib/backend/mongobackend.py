@@ -69,22 +69,16 @@ class MongoBackend(Backend):
 		self.dst_db = self.conn[self.databaseName]
 	
 
-	def getMinBucket(self, bucketSize = None):
+	def probeMinBucket(self, bucketSize):
 		import pymongo
-		if not bucketSize:
-			# use minimal bucket size
-			bucketSize = config.flow_bucket_sizes[0]
 		coll = self.dst_db[common.DB_FLOW_PREFIX + str(bucketSize)]
 		min_bucket = coll.find_one(
 			fields={ common.COL_BUCKET: 1, "_id": 0 }, 
 			sort=[(common.COL_BUCKET, pymongo.ASCENDING)])
 		return min_bucket[common.COL_BUCKET]
 
-	def getMaxBucket(self, bucketSize = None):
+	def probeMaxBucket(self, bucketSize):
 		import pymongo
-		if not bucketSize:
-			# use minimal bucket size
-			bucketSize = config.flow_bucket_sizes[0]
 		coll = self.dst_db[common.DB_FLOW_PREFIX + str(bucketSize)]
 		max_bucket = coll.find_one(
 			fields={ common.COL_BUCKET: 1, "_id": 0 }, 
@@ -92,7 +86,7 @@ class MongoBackend(Backend):
 		return max_bucket[common.COL_BUCKET]
 
 
-	def getBucketSize(self, start_time, end_time, resolution):
+	def probeBucketSize(self, start_time, end_time, resolution):
 		import pymongo
 		for i,s in enumerate(config.flow_bucket_sizes):
 			if i == len(config.flow_bucket_sizes)-1:
@@ -115,11 +109,26 @@ class MongoBackend(Backend):
 			if num_slots <= resolution:
 				return s
 
-	
+	def bucket_catalog_query(self, startBucket=None):
+		spec = {}
+		if startBucket != None:
+			spec[common.COL_BUCKET] = { "$gte": startBucket }
+		fields = { common.COL_BUCKET_SIZE: 1, common.COL_BUCKET: 1, common.COL_ROWS: 1, common.COL_FLOWS: 1, "_id": 0 }
+		return [ (doc[common.COL_BUCKET_SIZE], doc[common.COL_BUCKET], doc.get(common.COL_ROWS, 0), doc.get(common.COL_FLOWS, 0)) for doc in self.dst_db[common.DB_BUCKET_CATALOG].find(spec, fields=fields) ]
+
 	def clearDatabase(self):
 		self.conn.drop_database(self.databaseName)
 
 
+	def prepareCollections(self):
+		# the flow documents are keyed by packed binary ids (see
+		# FlowHandler.get_id()). databases written by older versions
+		# have string ids, which new flows do not match anymore
+		for s in config.flow_bucket_sizes:
+			if self.dst_db[common.DB_FLOW_PREFIX + str(s)].find_one({ "_id": { "$type": 2 } }, fields={ "_id": 1 }) != None:
+				print >> sys.stderr, "Warning: %s contains flows of an older version. New flows of the same buckets are stored in separate documents. Import the flows again with --clear-database." % (common.DB_FLOW_PREFIX + str(s))
+				break
+
 	def createIndex(self, collectionName, fieldName):
 		collection = self.dst_db[collectionName]
 		collection.create_index(fieldName)
@@ -129,6 +138,21 @@ class MongoBackend(Backend):
 			self.handle_index_update(collectionName, statement, document, insertIfNotExists)
 			return 
 
+		if collectionName.startswith("flows_") and "_id" in statement and type(statement["_id"]) == str:
+			# the preprocessor uses packed binary ids. store them as bindata 
+			# instead of strings, which reduces the id size by 50%
+			import bson
+			statement = { "_id": bson.binary.Binary(statement["_id"]) }
+
+		if collectionName.startswith(("sketch_", common.DB_FANOUT + "_", common.DB_FANIN + "_")) and "$set" in document:
+			# sketches are binary blobs
+			import bson
+			values = dict(document["$set"])
+			for field, value in values.items():
+				if type(value) == str:
+					values[field] = bson.binary.Binary(value)
+			document = { "$set": values }
+
 		collection = self.dst_db[collectionName]
 		collection.update(statement, document, insertIfNotExists)
 
@@ -226,7 +250,47 @@ class MongoBackend(Backend):
 
 		return self.run_query(collection, query_params, originalFlowDb, calculateTotals = True)
 
-	def run_query(self, collection, query_params, originalFlowDb, calculateTotals):
+	def topk_query(self, name, query_params):
+		import sketch
+
+		if name == "nodes":
+			prefix = common.DB_SKETCH_NODES
+			index = common.DB_INDEX_NODES
+		elif name == "ports":
+			prefix = common.DB_SKETCH_PORTS
+			index = common.DB_INDEX_PORTS
+		else:
+			raise Exception("Unknown dynamic index specified")
+		suffix = "_" + str(query_params["bucket_size"])
+		field = query_params["sort"][0][0]
+
+		# merge the sketches of all buckets in the interval and look up
+		# the candidates in the index
+		docs = self.dst_db[prefix + suffix].find(
+			{ common.COL_BUCKET: { "$gte": query_params["start_bucket"], "$lte": query_params["end_bucket"] } },
+			fields={ field: 1, "_id": 0 })
+		merged = sketch.merge_docs(docs, field)
+		if merged == None:
+			return None
+		ids = [ key for (key, count, error) in merged.top(query_params["limit"]) ]
+
+		query_params["aggregate"] = [ common.COL_ID ]
+		return self.run_query(self.dst_db[index + suffix], query_params, False, calculateTotals = True, ids = ids)
+
+	def fanout_query(self, name, field, bucket_size, start_bucket, end_bucket, ids=None):
+		import hyperloglog
+
+		if getattr(config, "pre_fanout_precision", 0) <= 0:
+			return None
+
+		spec = { common.COL_BUCKET: { "$gte": start_bucket, "$lte": end_bucket } }
+		if ids != None:
+			spec[common.COL_ID] = { "$in": ids }
+		docs = self.dst_db[name + "_" + str(bucket_size)].find(spec, fields={ common.COL_ID: 1, field: 1, "_id": 0 })
+		counters = hyperloglog.merge_docs(docs, field)
+		return dict([ (host, hll.count()) for (host, hll) in counters.iteritems() ])
+
+	def run_query(self, collection, query_params, originalFlowDb, calculateTotals, ids = None):
 		import pymongo
 
 		spec = self.build_spec(query_params)
@@ -332,6 +396,11 @@ class MongoBackend(Backend):
 			# use pre-calculated indexes
 			totalPipeline = [ commonFilter,  matchTotalGroup, aggregateGroup ]
 			othersPipeline = [ commonFilter, matchOthers, aggregateGroup, sort, limit ]
+			if ids != None:
+				# only read the entries of these ids. match the ids first,
+				# so that the query uses the index on the id
+				totalPipeline = [ matchTotalGroup, commonFilter, aggregateGroup ]
+				othersPipeline = [ { "$match": { common.COL_ID: { "$in": ids } } }, commonFilter, aggregateGroup, sort, limit ]
 	
 			aggResult =  collection.aggregate(totalPipeline)
 			total = aggResult["result"]
@@ -33,7 +33,7 @@ class SQLBaseBackend(Backend):
 		self.executeManyTimes = 0
 		self.executeManyObjects = 0
 		self.last_query = ""
-		self.tableNames = [ common.DB_INDEX_NODES, common.DB_INDEX_PORTS ]
+		self.tableNames = [ common.DB_INDEX_NODES, common.DB_INDEX_PORTS, common.DB_BUCKET_CATALOG ]
 		for s in config.flow_bucket_sizes:
 			self.tableNames.append(common.DB_FLOW_PREFIX + str(s))
 			self.tableNames.append(common.DB_FLOW_AGGR_PREFIX + str(s))
@@ -265,10 +265,7 @@ class SQLBaseBackend(Backend):
 				collection = self.tableInsertCache.keys()[0]
 				self.flushCache(collection)
 
-	def getMinBucket(self, bucketSize = None):
-		if not bucketSize:
-			# use minimal bucket size
-			bucketSize = config.flow_bucket_sizes[0]
+	def probeMinBucket(self, bucketSize):
 		tableName = common.DB_FLOW_PREFIX + str(bucketSize)
 		self.execute("SELECT MIN(" + common.COL_BUCKET + ") as " + common.COL_BUCKET + " FROM %s" % (tableName))
 		result =  self.cursor.fetchall()
@@ -278,10 +275,7 @@ class SQLBaseBackend(Backend):
 			return result[0][0]
 
 		
-	def getMaxBucket(self, bucketSize = None):
-		if not bucketSize:
-			# use minimal bucket size
-			bucketSize = config.flow_bucket_sizes[0]
+	def probeMaxBucket(self, bucketSize):
 		tableName = common.DB_FLOW_PREFIX + str(bucketSize)
 		self.execute("SELECT MAX(" + common.COL_BUCKET + ") as " + common.COL_BUCKET + " FROM %s" % (tableName))
 		result =  self.cursor.fetchall()
@@ -294,7 +288,7 @@ class SQLBaseBackend(Backend):
 	def add_limit_to_string(self, string, limit):
 		pass
 
-	def getBucketSize(self, startTime, endTime, resolution):
+	def probeBucketSize(self, startTime, endTime, resolution):
 		for i,s in enumerate(config.flow_bucket_sizes):
 			if i == len(config.flow_bucket_sizes)-1:
 				return s
@@ -325,6 +319,13 @@ class SQLBaseBackend(Backend):
 			if numSlots <= resolution:
 				return s
 
+	def bucket_catalog_query(self, startBucket=None):
+		queryString = "SELECT %s, %s, %s, %s FROM %s" % (common.COL_BUCKET_SIZE, common.COL_BUCKET, common.COL_ROWS, common.COL_FLOWS, common.DB_BUCKET_CATALOG)
+		if startBucket != None:
+			queryString += " WHERE %s >= %d" % (common.COL_BUCKET, startBucket)
+		self.execute(queryString)
+		return [ tuple(row) for row in self.cursor.fetchall() ]
+
 	def bucket_query(self, collectionName,  query_params):
 		print "SQL: Constructing query ... "
 		min_bucket = self.getMinBucket();
@@ -692,6 +693,14 @@ class SQLBaseBackend(Backend):
 			createString += ", PRIMARY KEY(" + common.COL_BUCKET + "))"
 			self.execute(createString)
 		
+		# table for the first/last buckets and the number of rows of 
+		# every bucket size (see bucketcatalog.py)
+		createString = "CREATE TABLE %s (%s %s NOT NULL, %s %s NOT NULL" % (common.DB_BUCKET_CATALOG, common.COL_BUCKET_SIZE, self.type_map[common.COL_BUCKET], common.COL_BUCKET, self.type_map[common.COL_BUCKET])
+		for column in [ common.COL_ROWS, common.COL_FLOWS ]:
+			createString += ", %s %s DEFAULT 0" % (column, self.type_map[common.COL_FLOWS])
+		createString += ", PRIMARY KEY(%s,%s))" % (common.COL_BUCKET_SIZE, common.COL_BUCKET)
+		self.execute(createString)
+
 		# create precomputed index that describe the whole data set
 		for table in [ common.DB_INDEX_NODES, common.DB_INDEX_PORTS ]:
 			createString = "CREATE TABLE %s (%s %s NOT NULL" % (table, common.COL_ID, self.type_map[common.COL_ID])
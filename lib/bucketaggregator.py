@@ -0,0 +1,78 @@
+"""
+Base class of the aggregators that write one document per bucket and
+key when their buckets are closed (see sketch.py and hyperloglog.py).
+
+The preprocessor flushes its aggregators whenever the watermark closes
+buckets (see FlowHandler.flushClosed()). The states of open buckets are
+kept until the buckets are closed, so a preprocessor writes a single
+document per bucket and key:
+
+	_id: bucket:key...:instance
+
+instance is unique per aggregator. Flows that arrive after their
+bucket has been written (late flows) and several preprocessors write
+more documents, which are merged at query time. The ids of the
+documents of late flows end with the number of the flush.
+"""
+
+import uuid
+
+class BucketAggregator:
+	def __init__(self, collection):
+		"""
+		:Parameters:
+		 - `collection`: The collection of the documents.
+		"""
+		self.collection = collection
+		# (bucket, ...) -> state
+		self.states = dict()
+		self.instance = uuid.uuid4().hex
+		self.seq = 0
+		# buckets before closed_before have been written
+		self.closed_before = None
+
+	def get_state(self, key):
+		"""
+		Returns the state of key (bucket, ...) and creates it if
+		necessary.
+		"""
+		state = self.states.get(key, None)
+		if state == None:
+			state = self.create_state()
+			self.states[key] = state
+		return state
+
+	def create_state(self):
+		raise Exception("Derived class did not implement create_state!")
+
+	def get_values(self, key, state):
+		"""
+		Returns the fields of the document of key and state.
+		"""
+		raise Exception("Derived class did not implement get_values!")
+
+	def flush(self, closed_before=None):
+		"""
+		Writes one document per key of the closed buckets.
+
+		:Parameters:
+		 - `closed_before`: Only write the buckets before this bucket
+		                    and keep the open ones (see
+		                    FlowHandler.flushClosed()). None writes all.
+		"""
+		self.seq += 1
+		for key in self.states.keys():
+			bucket = key[0]
+			if closed_before != None and bucket >= closed_before:
+				continue
+			state = self.states.pop(key)
+			_id = ":".join([ "%i" % (bucket) ] + [ str(k) for k in key[1:] ] + [ self.instance ])
+			if self.closed_before != None and bucket < self.closed_before:
+				# late flows of a bucket that has been written
+				_id += ":%i" % (self.seq)
+			self.collection.update({ "_id": _id }, { "$set": self.get_values(key, state) }, True)
+		if closed_before == None:
+			# every later document is late
+			self.closed_before = float("inf")
+		else:
+			self.closed_before = max(self.closed_before, closed_before)
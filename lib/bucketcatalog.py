@@ -0,0 +1,216 @@
+"""
+Catalog of the buckets that are stored in the flow collections.
+
+The web interface needs the first and the last bucket of the database
+and, to pick a bucket size for a query, the first and the last bucket
+of every bucket size in the queried interval. Probing the flow
+collections with MIN/MAX or ORDER BY ... LIMIT 1 queries for every
+request is expensive on large tables. The preprocessor therefore
+writes one small catalog document per bucket size and bucket when it
+flushes the aggregated flow collections (flows_aggr_<size>), the same
+collections the probes read:
+
+	bucket_size, bucket, num_rows, flows
+
+num_rows is the number of aggregated documents written into the bucket
+and flows the number of (partial) flows they aggregate. Both are added
+up by every flush. A document that is written more than once (e.g. for
+flows that arrive after the bucket has been flushed) is counted again,
+so num_rows is an upper bound of the rows of the bucket.
+
+A catalog only replaces the probes if it lists every bucket of the
+database. seed() completes the catalog of a database that was filled
+without it from the aggregated flow collections, which hold a single
+document per bucket, and writes an entry with the bucket size COMPLETE
+that marks the catalog as complete. Until that entry exists, the
+backends keep probing the flow collections.
+
+The backends keep a copy of the catalog in memory (BucketCatalog) that
+only reads the catalog entries of the newest buckets on a refresh and
+the complete catalog every full_refresh_interval seconds.
+"""
+
+import bisect
+import time
+
+import common
+
+# bucket size of the entry that marks a complete catalog
+COMPLETE = 0
+
+def seed(backend, bucket_sizes):
+	"""
+	Completes the catalog from the aggregated flow collections unless it
+	is marked as complete. Entries that a flush has already written are
+	replaced, so a partial catalog is not counted twice. Returns whether
+	the catalog had to be seeded.
+
+	:Parameters:
+	 - `backend`: The flow backend.
+	 - `bucket_sizes`: The bucket sizes of the database.
+	"""
+	entries = backend.bucket_catalog_query()
+	if entries == None or any([ int(entry[0]) == COMPLETE for entry in entries ]):
+		return False
+	for bucket_size in bucket_sizes:
+		counts = dict()
+		fields = { common.COL_BUCKET: 1, common.COL_FLOWS: 1 }
+		for doc in backend.find(common.DB_FLOW_AGGR_PREFIX + str(bucket_size), {}, fields):
+			counts.setdefault(int(doc[common.COL_BUCKET]), []).append(doc.get(common.COL_FLOWS, 0) or 0)
+		for bucket, flows in counts.iteritems():
+			statement = { common.COL_BUCKET_SIZE: bucket_size, common.COL_BUCKET: bucket }
+			backend.update(common.DB_BUCKET_CATALOG, statement, { "$set": { common.COL_ROWS: len(flows), common.COL_FLOWS: sum(flows) } }, True)
+	backend.update(common.DB_BUCKET_CATALOG, { common.COL_BUCKET_SIZE: COMPLETE, common.COL_BUCKET: 0 }, { "$set": { common.COL_ROWS: 0 } }, True)
+	backend.flushCache()
+	return True
+
+class CatalogAggregator:
+	def __init__(self, collection, bucket_size):
+		"""
+		Counts the documents and flows per bucket until flush() is
+		called. Fed with the documents of a flow handler (see
+		FlowHandler.addSketch()).
+
+		:Parameters:
+		 - `collection`: The catalog collection.
+		 - `bucket_size`: The bucket size of the flow handler.
+		"""
+		self.collection = collection
+		self.bucket_size = bucket_size
+		self.counts = dict()
+
+	def add_flow(self, obj):
+		counts = self.counts.get(obj[common.COL_BUCKET], None)
+		if counts == None:
+			counts = [ 0, 0 ]
+			self.counts[obj[common.COL_BUCKET]] = counts
+		counts[0] += 1
+		counts[1] += obj.get(common.COL_FLOWS, 0)
+
+	def flush(self, closed_before=None):
+		"""
+		Adds the counts to the catalog entry of every bucket. The counts
+		are added up, so the open buckets (closed_before, see
+		FlowHandler.flushClosed()) are written as well.
+		"""
+		for bucket, (rows, flows) in self.counts.iteritems():
+			statement = { common.COL_BUCKET_SIZE: self.bucket_size, common.COL_BUCKET: bucket }
+			self.collection.update(statement, { "$inc": { common.COL_ROWS: rows, common.COL_FLOWS: flows } }, True)
+		self.counts = dict()
+
+
+class BucketCatalog:
+	def __init__(self, backend, refresh_interval=10, full_refresh_interval=600):
+		"""
+		In-memory copy of the catalog.
+
+		:Parameters:
+		 - `backend`: The flow backend. Its bucket_catalog_query()
+		              reads the catalog.
+		 - `refresh_interval`: Seconds after which the newest buckets
+		                       are read again.
+		 - `full_refresh_interval`: Seconds after which the complete
+		                            catalog is read again.
+		"""
+		self.backend = backend
+		self.refresh_interval = refresh_interval
+		self.full_refresh_interval = full_refresh_interval
+		self.last_refresh = 0
+		self.last_full_refresh = 0
+		self.clear()
+
+	def clear(self):
+		# bucket size -> sorted list of buckets
+		self.buckets = dict()
+		# (bucket size, bucket) -> (rows, flows)
+		self.counts = dict()
+		# whether the catalog lists all buckets (see seed())
+		self.complete = False
+
+	def refresh(self, force=False):
+		now = time.time()
+		if not force and now - self.last_refresh < self.refresh_interval:
+			return
+		full = force or now - self.last_full_refresh >= self.full_refresh_interval or len(self.buckets) == 0
+		start_bucket = None
+		if not full:
+			# the newest bucket of every bucket size can still grow
+			start_bucket = min([ buckets[-1] for buckets in self.buckets.itervalues() ])
+		entries = self.backend.bucket_catalog_query(start_bucket)
+		self.last_refresh = now
+		if entries == None:
+			return
+		if full:
+			self.clear()
+			self.last_full_refresh = now
+		for (bucket_size, bucket, rows, flows) in entries:
+			key = (int(bucket_size), int(bucket))
+			if key[0] == COMPLETE:
+				self.complete = True
+				continue
+			if not key in self.counts:
+				bisect.insort(self.buckets.setdefault(key[0], []), key[1])
+			self.counts[key] = (rows, flows)
+
+	def is_complete(self):
+		"""
+		Returns whether the catalog can replace the probes.
+		"""
+		self.refresh()
+		return self.complete
+
+	def get_min_bucket(self, bucket_size):
+		"""
+		Returns the first bucket of bucket_size or None.
+		"""
+		self.refresh()
+		buckets = self.buckets.get(bucket_size, None)
+		if not buckets:
+			return None
+		return buckets[0]
+
+	def get_max_bucket(self, bucket_size):
+		"""
+		Returns the last bucket of bucket_size or None.
+		"""
+		self.refresh()
+		buckets = self.buckets.get(bucket_size, None)
+		if not buckets:
+			return None
+		return buckets[-1]
+
+	def get_range(self, bucket_size, start_bucket, end_bucket):
+		"""
+		Returns the sorted buckets of bucket_size between start_bucket
+		and end_bucket (both included).
+		"""
+		self.refresh()
+		buckets = self.buckets.get(bucket_size, [])
+		return buckets[bisect.bisect_left(buckets, start_bucket):bisect.bisect_right(buckets, end_bucket)]
+
+	def get_counts(self, bucket_size, start_bucket, end_bucket):
+		"""
+		Returns the number of rows and flows of bucket_size between
+		start_bucket and end_bucket (both included).
+		"""
+		rows = 0
+		flows = 0
+		for bucket in self.get_range(bucket_size, start_bucket, end_bucket):
+			(r, f) = self.counts[(bucket_size, bucket)]
+			rows += r
+			flows += f
+		return (rows, flows)
+
+	def get_bucket_size(self, start_bucket, end_bucket, resolution, bucket_sizes):
+		"""
+		Returns the smallest bucket size whose buckets in the interval
+		fit into resolution slots (see Backend.getBucketSize()).
+		"""
+		for i, s in enumerate(bucket_sizes):
+			if i == len(bucket_sizes) - 1:
+				return s
+			buckets = self.get_range(s, start_bucket, end_bucket)
+			if len(buckets) == 0:
+				return s
+			if (buckets[-1] - buckets[0]) / s + 1 <= resolution:
+				return s
@@ -0,0 +1,45 @@
+"""
+Checkpoints of the SQL importers.
+
+A checkpoint records the import state of every table in a Redis hash
+next to the flow queue: {"done": true} for tables that have been
+imported completely and {"key": k, "count": n} for the table that is
+still being written by the collector. k is the value of the ordering
+column of the last imported row and n the number of imported rows with
+that value. A new run skips the done tables and streams the rows of
+the others from k on, skipping the first n rows with the value k.
+
+The checkpoint is written with the same pipeline as the flows it
+covers, so that an interrupted import resumes after the last block
+that reached the queue.
+"""
+
+import json
+
+KEY_PREFIX = "import:checkpoint:"
+
+class CheckpointStore:
+	def __init__(self, r, name):
+		"""
+		:Parameters:
+		 - `r`: The Redis connection of the flow queue.
+		 - `name`: Name of the checkpoint (e.g. one per cron job).
+		"""
+		self.r = r
+		self.key = KEY_PREFIX + name
+
+	def load(self):
+		"""
+		Returns a dictionary of table and state.
+		"""
+		return dict([ (table, json.loads(value)) for (table, value) in self.r.hgetall(self.key).iteritems() ])
+
+	def save(self, pipe, states):
+		"""
+		Adds the states (dictionary of table and state) to the pipeline
+		pipe.
+		"""
+		pipe.hmset(self.key, dict([ (table, json.dumps(state)) for (table, state) in states.iteritems() ]))
+
+	def clear(self):
+		self.r.delete(self.key)
@@ -26,6 +26,20 @@ COL_BYTES = "octetDeltaCount"
 COL_PKTS = "packetDeltaCount"
 COL_FLOWS = "flows"
 COL_ID = "id"
+# column names of the bucket catalog (see bucketcatalog.py)
+COL_BUCKET_SIZE = "bucket_size"
+COL_ROWS = "num_rows"
+
+# struct formats of the columns that can be part of a binary
+# aggregation key
+KEY_FORMATS = {
+	COL_BUCKET   : "I",
+	COL_SRC_IP   : "I",
+	COL_DST_IP   : "I",
+	COL_SRC_PORT : "H",
+	COL_DST_PORT : "H",
+	COL_PROTO    : "B",
+}
 
 COL_PROTO_TCP = "tcp"
 COL_PROTO_UDP = "udp"
@@ -42,6 +56,16 @@ DB_FLOW_AGGR_PREFIX = "flows_aggr_"
 DB_INDEX_NODES = "index_nodes"
 # the collection to use for the port index
 DB_INDEX_PORTS = "index_ports"
+# the collections to use for the heavy-hitter sketches (see sketch.py)
+DB_SKETCH_NODES = "sketch_nodes"
+DB_SKETCH_PORTS = "sketch_ports"
+# the collections to use for the distinct destinations per source and 
+# the distinct sources per destination (see hyperloglog.py)
+DB_FANOUT = "fanout"
+DB_FANIN = "fanin"
+# the collection to use for the first/last bucket and the number of rows
+# of every bucket size (see bucketcatalog.py)
+DB_BUCKET_CATALOG = "bucket_catalog"
 
 IGNORE_COLUMNS = ["firstSwitchedMillis", "lastSwitchedMillis"]
 
@@ -50,6 +74,8 @@ OUTPUT_INTERVAL = 10
 
 # the xml file containing known port numbers
 PORTS_FILE = os.path.join(os.path.dirname(__file__), '..', 'config', 'service-names-port-numbers.xml')
+# the compiled registry of the known ports. built from PORTS_FILE on demand
+PORTS_REGISTRY_FILE = os.path.join(os.path.dirname(__file__), '..', 'config', 'service-names-port-numbers.bin')
 
 REDIS_QUEUE_KEY = "entry:queue"
 
@@ -152,211 +178,14 @@ def getValueFromProto(proto):
 	
 # read ports for special filtering
 def getKnownPorts(flow_filter_unknown_ports):
-	known_ports = None
-	if flow_filter_unknown_ports:
-		f = open(PORTS_FILE, "r")
-		dom = xml.dom.minidom.parse(f)
-		f.close()
-	
-		def getDomText(node):
-			rc = []
-			for n in node.childNodes:
-				if n.nodeType == node.TEXT_NODE:
-					rc.append(n.data)
-			return ''.join(rc)
-
-		known_ports = dict()
-		records = dom.getElementsByTagName("record")
-		for record in records:
-			description = getDomText(record.getElementsByTagName("description")[0])
-			number = record.getElementsByTagName("number")
-			if description != "Unassigned" and len(number) > 0:
-				numbers = getDomText(number[0]).split('-')
-				number = int(numbers[0])
-				number_to = int(numbers[len(numbers)-1])
-				
-				protocol = record.getElementsByTagName("protocol")
-				if len(protocol) > 0:
-					protocol = getDomText(protocol[0])
-					if protocol == "tcp":
-						protocol = 6
-					elif protocol == "udp":
-						protocol = 17
-					else:
-						protocol = 0
-				else:
-					protocol = 0
-				
-				while number <= number_to:
-					if number in known_ports:
-						known_ports[number].append(protocol)
-					else:
-						known_ports[number] = [protocol]
-					number += 1
-
-
-def update_node_index(obj, collection, aggr_sum):
-	"""Update the node index collection in MongoDB with the current flow.
-	
-	:Parameters:
-	 - `obj`: A dictionary containing a flow.
-	 - `collection`: A pymongo collection to insert the documents.
-	 - `aggr_sum`: A list of keys which will be sliced and summed up.
 	"""
-
-	# update source node
-	doc = { "$inc": {} }
-	
-
-	proto = getProto(obj)
-
-	for s in aggr_sum:
-		doc["$inc"][s] = obj.get(s, 0)
-		doc["$inc"][proto + "." + s] = obj.get(s,0)
-		doc["$inc"]["src." + s] = obj.get(s, 0)
-		doc["$inc"]["src." + proto + "." + s] = obj.get(s,0)
-
-	if COL_FLOWS in obj:
-		flows = obj[COL_FLOWS]
-	else:
-		flows = 1
-
-	doc["$inc"][COL_FLOWS] = flows
-	doc["$inc"][proto + "." + COL_FLOWS] = flows
-	doc["$inc"]["src." + COL_FLOWS] = flows
-	doc["$inc"]["src." + proto + "." + COL_FLOWS] = flows
-	
-	# insert if not exists, else update sums
-	if COL_BUCKET in obj:
-		collection.update({COL_ID: obj[COL_SRC_IP], COL_BUCKET: obj[COL_BUCKET] }, doc, True)
-	else:
-		collection.update({COL_ID: obj[COL_SRC_IP] }, doc, True)
-	
-	# update destination node
-	doc = { "$inc": {} }
-	
-	for s in aggr_sum:
-		doc["$inc"][s] = obj.get(s, 0)
-		doc["$inc"][proto + "." + s] = obj.get(s,0)
-		doc["$inc"]["dst." + s] = obj.get(s, 0)
-		doc["$inc"]["dst." + proto + "." + s] = obj.get(s,0)
-
-	if COL_FLOWS in obj:
-		flows = obj[COL_FLOWS]
-	else:
-		flows = 1
-
-	doc["$inc"][COL_FLOWS] = flows
-	doc["$inc"][proto + "." + COL_FLOWS] = flows 
-	doc["$inc"]["dst." + COL_FLOWS] = flows 
-	doc["$inc"]["dst." + proto + "." + COL_FLOWS] = flows
-					
-	# insert if not exists, else update sums
-	if COL_BUCKET in obj:
-		collection.update({COL_ID: obj[COL_DST_IP], COL_BUCKET: obj[COL_BUCKET] }, doc, True)
-	else:
-		collection.update({COL_ID: obj[COL_DST_IP] }, doc, True)
-
-	# update total counters
-	doc = { "$inc": {} }
-
-	if COL_FLOWS in obj:
-		flows = obj[COL_FLOWS]
-	else:
-		flows = 1
-
-	doc["$inc"][COL_FLOWS] = flows 
-	doc["$inc"][proto + "." + COL_FLOWS]= flows 
-
-
-	for s in aggr_sum:
-		doc["$inc"][s] = obj.get(s, 0)
-		doc["$inc"][proto + "." + s] = obj.get(s, 0)
-
-	if COL_BUCKET in obj:
-		collection.update({COL_ID:  "total", COL_BUCKET: obj[COL_BUCKET] }, doc, True)
-	else:
-		collection.update({COL_ID : "total"  }, doc, True)
-
-	
-def update_port_index(obj, collection, aggr_sum, filter_ports):
-	"""Update the port index collection in MongoDB with the current flow.
-	
-	:Parameters:
-	 - `obj`: A dictionary containing a flow.
-	 - `collection`: A pymongo collection to insert the documents.
-	 - `aggr_sum`: A list of keys which will be sliced and summed up.
-	 - `filter_ports`: A dictionary of ports and protocols to remove unknown ports
+	Returns the registry of known ports (see portregistry.py) or None if
+	unknown ports should not be filtered.
 	"""
-	
-	# update source port
-	doc = { "$inc": {} }
-
-	for s in aggr_sum:
-		doc["$inc"][s] = obj.get(s, 0)
-		doc["$inc"]["src." + s] = obj.get(s, 0)
-
-	if COL_FLOWS in obj:
-		flows = obj[COL_FLOWS]
-	else:
-		flows = 1
-
-	doc["$inc"][COL_FLOWS] = flows
-	doc["$inc"]["src." + COL_FLOWS] = flows
-
-	# set unknown ports to None
-	port = obj.get(COL_SRC_PORT, None)
-	if filter_ports and port != None:
-		if port in filter_ports:
-			proto = int(obj.get(COL_PROTO, -1))
-			if proto >= 0 and not proto in filter_ports[port]:
-				port = None
-		else:
-			port = None
-	
-	# insert if not exists, else update sums
-	if COL_BUCKET in obj:
-		collection.update({ COL_ID: port, COL_BUCKET: obj[COL_BUCKET]}, doc, True)
-	else:
-		collection.update({ COL_ID: port }, doc, True)
-	
-	# update destination port
-	doc = { "$inc": {} }
-
-	for s in aggr_sum:
-		doc["$inc"][s] = obj.get(s, 0)
-		doc["$inc"]["dst." + s] = obj.get(s, 0)
-
-	if COL_FLOWS in obj:
-		flows = obj[COL_FLOWS]
-	else:
-		flows = 1
-	
-	doc["$inc"][COL_FLOWS] = flows
-	doc["$inc"]["dst." + COL_FLOWS] = flows
-	
-	# insert if not exists, else update sums
-	if COL_BUCKET in obj:
-		collection.update({COL_ID:  port, COL_BUCKET: obj[COL_BUCKET] }, doc, True)
-	else:
-		collection.update({COL_ID: port}, doc, True)
-
-	# update total counters
-	doc = { "$inc": {} }
-
-	if COL_FLOWS in obj:
-		flows = obj[COL_FLOWS]
-	else:
-		flows = 1
-
-	doc["$inc"][COL_FLOWS] = flows 
-	for s in aggr_sum:
-		doc["$inc"][s] = obj.get(s, 0)
-
-	if COL_BUCKET in obj:
-		collection.update({COL_ID : "total", COL_BUCKET: obj[COL_BUCKET]}, doc, True)
-	else:
-		collection.update({COL_ID : "total"}, doc, True)
+	if not flow_filter_unknown_ports:
+		return None
+	import portregistry
+	return portregistry.load(PORTS_FILE, PORTS_REGISTRY_FILE)
 
 
 # width defines bar width
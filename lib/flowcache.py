@@ -0,0 +1,267 @@
+"""
+Write-behind caches for the documents of the preprocessor.
+
+The caches keep the "$inc" documents of the most relevant aggregation
+keys in memory. Increments for cached keys are merged into the cached
+document in place, so that a key is only written to the backend when
+it is evicted or the cache is flushed. The eviction policy decides
+which key is written first:
+
+	- fifo: evict in insertion order (hits do not matter)
+	- lru: evict the least recently used key
+	- lfu: evict the least frequently used key. Ties are broken in
+	       least recently used order. Frequencies are halved after
+	       every size insertions. Otherwise, hot keys of closed buckets
+	       would never leave the cache
+	- bucket: evict the keys of the oldest bucket first, as flows for
+	          old buckets become unlikely. Least recently used order
+	          within a bucket
+
+All operations are O(1) (amortized for lfu), except for bucket 
+evictions which need to find the next bucket once the current one
+has been emptied.
+"""
+
+import heapq
+import common
+from ordered_dict import OrderedDict
+
+class FlowCache:
+	def __init__(self, size):
+		self.size = size
+
+	def get(self, key):
+		"""
+		Returns the cached document for key or None.
+		"""
+		raise Exception("Derived class did not implement get!")
+
+	def put(self, key, doc, bucket):
+		"""
+		Inserts a new document for key, which belongs to bucket.
+		"""
+		raise Exception("Derived class did not implement put!")
+
+	def pop(self):
+		"""
+		Removes the document that should be evicted next and returns
+		(key, doc).
+		"""
+		raise Exception("Derived class did not implement pop!")
+
+	def remove(self, key):
+		"""
+		Removes key from the cache and returns its document.
+		"""
+		raise Exception("Derived class did not implement remove!")
+
+	def items(self):
+		raise Exception("Derived class did not implement items!")
+
+	def pop_older(self, bucket):
+		"""
+		Removes all documents of buckets before bucket and returns them
+		as a list of (key, doc).
+		"""
+		keys = [ key for (key, doc) in self.items() if doc["$set"][common.COL_BUCKET] < bucket ]
+		return [ (key, self.remove(key)) for key in keys ]
+
+	def __len__(self):
+		raise Exception("Derived class did not implement __len__!")
+
+	def is_full(self):
+		return len(self) > self.size
+
+
+class FIFOCache(FlowCache):
+	def __init__(self, size):
+		FlowCache.__init__(self, size)
+		self.docs = OrderedDict()
+
+	def get(self, key):
+		return self.docs.get(key, None)
+
+	def put(self, key, doc, bucket):
+		self.docs[key] = doc
+
+	def pop(self):
+		return self.docs.popitem(last=False)
+
+	def remove(self, key):
+		return self.docs.pop(key)
+
+	def items(self):
+		return self.docs.items()
+
+	def __len__(self):
+		return len(self.docs)
+
+
+class LRUCache(FIFOCache):
+	def get(self, key):
+		doc = self.docs.pop(key, None)
+		if doc != None:
+			# move to the end of the eviction order
+			self.docs[key] = doc
+		return doc
+
+
+class LFUCache(FlowCache):
+	def __init__(self, size):
+		FlowCache.__init__(self, size)
+		self.docs = dict()
+		self.freq = dict()
+		# keys with the same frequency in least recently used order
+		self.freq_keys = dict()
+		self.min_freq = 0
+		self.inserts = 0
+
+	def get(self, key):
+		doc = self.docs.get(key, None)
+		if doc == None:
+			return None
+
+		freq = self.freq[key]
+		keys = self.freq_keys[freq]
+		del keys[key]
+		if len(keys) == 0:
+			del self.freq_keys[freq]
+			if self.min_freq == freq:
+				self.min_freq = freq + 1
+		freq += 1
+		self.freq[key] = freq
+		if not freq in self.freq_keys:
+			self.freq_keys[freq] = OrderedDict()
+		self.freq_keys[freq][key] = None
+		return doc
+
+	def put(self, key, doc, bucket):
+		self.inserts += 1
+		if self.inserts > self.size:
+			self.age()
+		self.docs[key] = doc
+		self.freq[key] = 1
+		if not 1 in self.freq_keys:
+			self.freq_keys[1] = OrderedDict()
+		self.freq_keys[1][key] = None
+		self.min_freq = 1
+
+	def pop(self):
+		keys = self.freq_keys[self.min_freq]
+		key = keys.popitem(last=False)[0]
+		if len(keys) == 0:
+			del self.freq_keys[self.min_freq]
+			if len(self.freq_keys) > 0:
+				self.min_freq = min(self.freq_keys)
+		del self.freq[key]
+		return (key, self.docs.pop(key))
+
+	def remove(self, key):
+		freq = self.freq.pop(key)
+		keys = self.freq_keys[freq]
+		del keys[key]
+		if len(keys) == 0:
+			del self.freq_keys[freq]
+			if self.min_freq == freq and len(self.freq_keys) > 0:
+				self.min_freq = min(self.freq_keys)
+		return self.docs.pop(key)
+
+	def items(self):
+		return self.docs.items()
+
+	def age(self):
+		"""
+		Halves all frequencies. Keys that share a frequency afterwards
+		keep their relative order, lower frequencies first.
+		"""
+		self.inserts = 0
+		freq_keys = dict()
+		for freq in sorted(self.freq_keys):
+			aged = max(1, freq / 2)
+			if not aged in freq_keys:
+				freq_keys[aged] = OrderedDict()
+			for key in self.freq_keys[freq]:
+				freq_keys[aged][key] = None
+				self.freq[key] = aged
+		self.freq_keys = freq_keys
+		if len(freq_keys) > 0:
+			self.min_freq = min(freq_keys)
+
+	def __len__(self):
+		return len(self.docs)
+
+
+class BucketCache(FlowCache):
+	def __init__(self, size):
+		FlowCache.__init__(self, size)
+		# bucket -> documents of the bucket in least recently used order
+		self.buckets = dict()
+		self.bucket_heap = []
+		self.key_bucket = dict()
+
+	def get(self, key):
+		bucket = self.key_bucket.get(key, None)
+		if bucket == None:
+			return None
+		docs = self.buckets[bucket]
+		doc = docs.pop(key)
+		docs[key] = doc
+		return doc
+
+	def put(self, key, doc, bucket):
+		if not bucket in self.buckets:
+			self.buckets[bucket] = OrderedDict()
+			heapq.heappush(self.bucket_heap, bucket)
+		self.buckets[bucket][key] = doc
+		self.key_bucket[key] = bucket
+
+	def pop(self):
+		bucket = self.bucket_heap[0]
+		docs = self.buckets[bucket]
+		(key, doc) = docs.popitem(last=False)
+		if len(docs) == 0:
+			del self.buckets[bucket]
+			heapq.heappop(self.bucket_heap)
+		del self.key_bucket[key]
+		return (key, doc)
+
+	def remove(self, key):
+		bucket = self.key_bucket.pop(key)
+		docs = self.buckets[bucket]
+		doc = docs.pop(key)
+		if len(docs) == 0:
+			del self.buckets[bucket]
+			self.bucket_heap.remove(bucket)
+			heapq.heapify(self.bucket_heap)
+		return doc
+
+	def items(self):
+		items = []
+		for docs in self.buckets.itervalues():
+			items += docs.items()
+		return items
+
+	def pop_older(self, bucket):
+		result = []
+		while len(self.bucket_heap) > 0 and self.bucket_heap[0] < bucket:
+			docs = self.buckets.pop(heapq.heappop(self.bucket_heap))
+			for key in docs:
+				del self.key_bucket[key]
+			result += docs.items()
+		return result
+
+	def __len__(self):
+		return len(self.key_bucket)
+
+
+CACHE_POLICIES = {
+	"fifo": FIFOCache,
+	"lru": LRUCache,
+	"lfu": LFUCache,
+	"bucket": BucketCache,
+}
+
+def get_cache(policy, size):
+	if not policy in CACHE_POLICIES:
+		raise Exception("Unknown cache policy " + str(policy) + ". Supported policies: " + ", ".join(sorted(CACHE_POLICIES)))
+	return CACHE_POLICIES[policy](size)
@@ -0,0 +1,107 @@
+"""
+Synthetic flow generator for benchmarks.
+
+Generates flows in the format of the importers with a configurable
+skew of hosts and ports, flow duration distribution and protocol mix.
+Flows are generated in the order of their end time, as a collector
+exports them. The generator is seeded, so the same parameters always
+produce the same flows.
+"""
+
+import bisect
+import random
+
+import common
+
+class ZipfSampler:
+	def __init__(self, rnd, n, skew):
+		"""
+		Draws values from 0 to n - 1. The probability of value k is
+		proportional to 1 / (k + 1)^skew. skew 0 is uniform.
+		"""
+		self.rnd = rnd
+		self.cumulative = []
+		total = 0.0
+		for k in range(n):
+			total += 1.0 / (k + 1) ** skew
+			self.cumulative.append(total)
+		self.total = total
+
+	def sample(self):
+		return bisect.bisect_left(self.cumulative, self.rnd.random() * self.total)
+
+
+class FlowGenerator:
+	def __init__(self, seed=0, start=1325376000, rate=1000.0, hosts=10000, host_skew=1.0, ports=1000, port_skew=1.2, duration="exp", duration_mean=10.0, protocols={ 6: 0.8, 17: 0.15, 1: 0.05 }):
+		"""
+		:Parameters:
+		 - `seed`: Seed of the random number generator.
+		 - `start`: Timestamp of the first flow end.
+		 - `rate`: Flows per second of flow time.
+		 - `hosts`: Number of distinct IPv4 addresses.
+		 - `host_skew`: Zipf exponent of the address popularity.
+		 - `ports`: Number of distinct server ports.
+		 - `port_skew`: Zipf exponent of the server port popularity.
+		 - `duration`: Flow duration distribution. "exp" (exponential) or
+		               "pareto" (heavy tailed, few very long flows).
+		 - `duration_mean`: Mean flow duration in seconds.
+		 - `protocols`: Dictionary of protocol number and share of flows.
+		"""
+		if not duration in [ "exp", "pareto" ]:
+			raise Exception("Unknown duration distribution " + str(duration) + ". Supported distributions: exp, pareto")
+		self.rnd = random.Random(seed)
+		self.start = start
+		self.rate = rate
+		self.hosts = ZipfSampler(self.rnd, hosts, host_skew)
+		self.ports = ZipfSampler(self.rnd, ports, port_skew)
+		self.duration = duration
+		self.duration_mean = duration_mean
+		self.protocols = sorted(protocols.items())
+		self.protocol_total = float(sum(protocols.values()))
+		self.count = 0
+
+	def get_duration(self):
+		if self.duration == "exp":
+			return self.rnd.expovariate(1.0 / self.duration_mean)
+		# pareto with shape 1.5 has the mean 3 * scale
+		return self.rnd.paretovariate(1.5) * self.duration_mean / 3.0
+
+	def get_protocol(self):
+		value = self.rnd.random() * self.protocol_total
+		for proto, share in self.protocols:
+			value -= share
+			if value < 0:
+				return proto
+		return self.protocols[-1][0]
+
+	def get_address(self):
+		# 10.0.0.0/8
+		return 0x0a000000 + self.hosts.sample()
+
+	def get_next_flow(self):
+		last = self.start + int(self.count / self.rate)
+		first = last - int(self.get_duration())
+		proto = self.get_protocol()
+		if proto in [ 6, 17 ]:
+			src_port = self.rnd.randint(1024, 65535)
+			dst_port = self.ports.sample() + 1
+		else:
+			src_port = 0
+			dst_port = 0
+		pkts = 1 + int(self.rnd.expovariate(1.0 / 20)) + int(last - first)
+		flow = {
+			common.COL_FIRST_SWITCHED: first,
+			common.COL_LAST_SWITCHED: last,
+			common.COL_SRC_IP: self.get_address(),
+			common.COL_DST_IP: self.get_address(),
+			common.COL_SRC_PORT: src_port,
+			common.COL_DST_PORT: dst_port,
+			common.COL_PROTO: proto,
+			common.COL_PKTS: pkts,
+			common.COL_BYTES: pkts * self.rnd.randint(40, 1500),
+		}
+		self.count += 1
+		return flow
+
+	def get_flows(self, count):
+		return [ self.get_next_flow() for i in xrange(count) ]
@@ -0,0 +1,163 @@
+"""
+Helpers for the Redis flow queue that connects the importers
+with the preprocessor.
+"""
+
+import time
+import zlib
+
+def drain(r, key, count):
+	"""
+	Removes up to count entries from the head of the queue with a
+	single round trip. LRANGE and LTRIM are sent in one MULTI/EXEC
+	block, so that multiple consumers never see the same entry.
+	Returns an empty list if the queue is empty.
+	"""
+	pipe = r.pipeline(transaction=True)
+	pipe.lrange(key, 0, count - 1)
+	pipe.ltrim(key, count, -1)
+	entries = pipe.execute()[0]
+	return entries
+
+def wait(r, key, timeout=0):
+	"""
+	Blocks until there is a new entry in the queue and removes it.
+	Returns None if timeout seconds elapsed without a new entry (timeout
+	0 waits forever).
+	"""
+	obj = r.blpop(key, timeout)
+	if obj == None:
+		return None
+	return obj[1]
+
+def push_back(r, key, entries):
+	"""
+	Returns entries that have been drained but not consumed to the
+	head of the queue, preserving their order.
+	"""
+	if len(entries) == 0:
+		return
+	r.lpush(key, *reversed(entries))
+
+def partition_key(key, partition):
+	"""
+	Returns the name of the Redis list that holds the given partition
+	of the queue.
+	"""
+	return "%s:%i" % (key, partition)
+
+def partition(flow, fields, partitions):
+	"""
+	Assigns a flow to one of partitions queue partitions. Flows that
+	agree in all fields always end up in the same partition, so that 
+	the preprocessor owning the partition sees all flows of an 
+	aggregation key. crc32 is used instead of hash() because it is 
+	stable across processes and machines.
+	"""
+	value = "|".join([str(flow.get(f, None)) for f in fields])
+	return (zlib.crc32(value) & 0xffffffff) % partitions
+
+
+class FlowControl:
+	def __init__(self, r, max_length, target_lag=0, scale=1, report_interval=10, pace=True):
+		"""
+		Paces a producer of the queue. The producer reports the queue
+		length after every push with update() and calls wait() before it
+		pushes again. The drain rate of the consumers is estimated from
+		the lengths and the pushed flows. wait() blocks while a queue 
+		holds more than target_lag seconds of work at the current drain
+		rate, but never more than max_length flows, and sleeps only as
+		long as the consumers need to work off the excess.
+
+		:Parameters:
+		 - `r`: The Redis connection.
+		 - `max_length`: Maximum queue length in flows.
+		 - `target_lag`: Seconds of work that the queue should hold. 0 only
+		                 limits the length to max_length.
+		 - `scale`: Number of flows per queue entry.
+		 - `report_interval`: Seconds between two throughput reports.
+		 - `pace`: False never blocks and only measures the queues, for
+		           producers that cannot wait (e.g. collectors).
+		"""
+		self.r = r
+		self.pace = pace
+		self.max_length = max_length
+		self.target_lag = target_lag
+		self.scale = scale
+		self.report_interval = report_interval
+		# queue key -> [length, length at the last rate sample, time of the
+		# last rate sample, flows pushed since then, drain rate]
+		self.queues = dict()
+
+		# stats
+		self.start = time.time()
+		self.last_report = self.start
+		self.pushed = 0
+		self.throttled = 0.0
+
+	def get_limit(self, rate):
+		# drain rates below a flow per second are unknown (e.g. the 
+		# consumers have not started yet)
+		if self.target_lag > 0 and rate >= 1:
+			return min(self.max_length, rate * self.target_lag)
+		return self.max_length
+
+	def update(self, key, length, pushed=0, now=None):
+		"""
+		Records the length (in entries) of the queue key after pushed
+		entries have been appended to it.
+		"""
+		if now == None:
+			now = time.time()
+		length *= self.scale
+		pushed *= self.scale
+		self.pushed += pushed
+		state = self.queues.get(key, None)
+		if state == None:
+			self.queues[key] = [ length, length, now, 0, 0.0 ]
+			return
+		state[0] = length
+		state[3] += pushed
+		elapsed = now - state[2]
+		# samples of less than a second are too noisy
+		if elapsed >= 1:
+			drained = max(0, state[1] + state[3] - length)
+			sample = drained / elapsed
+			if state[4] == 0:
+				state[4] = sample
+			else:
+				state[4] = 0.7 * state[4] + 0.3 * sample
+			state[1] = length
+			state[2] = now
+			state[3] = 0
+
+	def wait(self):
+		"""
+		Blocks while a queue is longer than its limit.
+		"""
+		if not self.pace:
+			return
+		for key, state in self.queues.iteritems():
+			while state[0] > self.get_limit(state[4]):
+				excess = state[0] - self.get_limit(state[4])
+				delay = 1.0
+				if state[4] >= 1:
+					delay = min(1.0, max(0.05, excess / state[4]))
+				time.sleep(delay)
+				self.throttled += delay
+				self.update(key, self.r.llen(key))
+
+	def report(self, now=None):
+		"""
+		Returns a throughput report every report_interval seconds or None.
+		"""
+		if now == None:
+			now = time.time()
+		if now - self.last_report < self.report_interval:
+			return None
+		self.last_report = now
+		elapsed = max(now - self.start, 0.001)
+		length = sum([ state[0] for state in self.queues.values() ])
+		rate = sum([ state[4] for state in self.queues.values() ])
+		return "pushed %i flows (%.0f flows/s), queue %i flows, drain rate %.0f flows/s, throttled %.0f%% of the time" % (
+			self.pushed, self.pushed / elapsed, length, rate, self.throttled / elapsed * 100)
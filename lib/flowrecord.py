@@ -0,0 +1,155 @@
+"""
+Binary record format for the flows in the Redis queue.
+
+A queue entry is either a JSON encoded flow, the END flag or a binary
+entry. Binary entries start with a header (magic, version, number of
+records) followed by the records. Every record packs the fields of
+the schema of its version as fixed width big endian integers. Many
+flows can share one entry, which saves Redis memory, network bytes and
+the JSON decoding in the preprocessor.
+
+The version in the header selects the schema, so that consumers can
+decode entries of every version they know and reject the others.
+Released schemas must never be changed. Add a new version instead.
+
+Fields of a flow that are not in the schema (e.g. the id of a SQL row)
+are not written. The preprocessor does not read them.
+"""
+
+import struct
+import common
+
+# neither a JSON object nor the END flag can start with these bytes
+MAGIC = "\xffF"
+HEADER = struct.Struct("!2sBH")
+MAX_RECORDS = 0xffff
+
+# version -> list of (field, struct format)
+SCHEMAS = {
+	1: [
+		(common.COL_FIRST_SWITCHED, "I"),
+		(common.COL_LAST_SWITCHED, "I"),
+		(common.COL_SRC_IP, "I"),
+		(common.COL_DST_IP, "I"),
+		(common.COL_SRC_PORT, "H"),
+		(common.COL_DST_PORT, "H"),
+		(common.COL_PROTO, "B"),
+		(common.COL_PKTS, "Q"),
+		(common.COL_BYTES, "Q"),
+	],
+	# version 1 and the number of flows of aggregated records
+	2: [
+		(common.COL_FIRST_SWITCHED, "I"),
+		(common.COL_LAST_SWITCHED, "I"),
+		(common.COL_SRC_IP, "I"),
+		(common.COL_DST_IP, "I"),
+		(common.COL_SRC_PORT, "H"),
+		(common.COL_DST_PORT, "H"),
+		(common.COL_PROTO, "B"),
+		(common.COL_PKTS, "Q"),
+		(common.COL_BYTES, "Q"),
+		(common.COL_FLOWS, "Q"),
+	],
+}
+
+# the version written by the producers
+VERSION = 2
+
+# fields that flows do not need to have and their default. the value
+# has to be an integer, flows with fractions are not encoded
+OPTIONAL = {
+	common.COL_FLOWS: 1,
+}
+
+RECORDS = dict([ (version, struct.Struct("!" + "".join([ f for (name, f) in schema ]))) for (version, schema) in SCHEMAS.items() ])
+FIELDS = dict([ (version, [ name for (name, f) in schema ]) for (version, schema) in SCHEMAS.items() ])
+
+def is_binary(entry):
+	return entry.startswith(MAGIC)
+
+def covers(fields, version=VERSION):
+	"""
+	Returns whether all fields are part of the schema of version.
+	"""
+	schema = FIELDS[version]
+	return all([ f in schema for f in fields ])
+
+def encode_flow(flow, version=VERSION):
+	"""
+	Packs a flow into a record. Raises ValueError if a field is missing
+	or does not fit into the schema (e.g. an IPv6 address).
+	"""
+	try:
+		values = []
+		for f in FIELDS[version]:
+			if f in OPTIONAL:
+				value = flow.get(f, OPTIONAL[f])
+				if int(value) != value:
+					raise ValueError("%s is not an integer: %s" % (f, value))
+			else:
+				value = flow[f]
+			values.append(int(value))
+		return RECORDS[version].pack(*values)
+	except (KeyError, TypeError, ValueError, struct.error), e:
+		raise ValueError("Flow does not match the record schema: " + str(e))
+
+def pack(records, version=VERSION):
+	"""
+	Builds a queue entry from a list of encoded records.
+	"""
+	return HEADER.pack(MAGIC, version, len(records)) + "".join(records)
+
+def decode(entry):
+	"""
+	Decodes a binary queue entry into a list of flows. Raises ValueError
+	for unknown versions and truncated entries.
+	"""
+	if len(entry) < HEADER.size:
+		raise ValueError("Binary queue entry is too short")
+	(magic, version, count) = HEADER.unpack_from(entry)
+	if not version in RECORDS:
+		raise ValueError("Unsupported record version %i. Supported versions: %s" % (version, ", ".join([ str(v) for v in sorted(RECORDS) ])))
+	record = RECORDS[version]
+	if len(entry) != HEADER.size + count * record.size:
+		raise ValueError("Binary queue entry has %i bytes, expected %i records of version %i" % (len(entry), count, version))
+	fields = FIELDS[version]
+	flows = []
+	offset = HEADER.size
+	for i in xrange(count):
+		flows.append(dict(zip(fields, record.unpack_from(entry, offset))))
+		offset += record.size
+	return flows
+
+
+class Encoder:
+	def __init__(self, batch_size, version=VERSION):
+		"""
+		Collects encoded flows into entries of up to batch_size records.
+		"""
+		self.batch_size = min(max(1, batch_size), MAX_RECORDS)
+		self.version = version
+		self.records = []
+
+	def add(self, flow):
+		"""
+		Adds flow to the current entry. Returns False if the flow
+		cannot be encoded with the schema.
+		"""
+		try:
+			self.records.append(encode_flow(flow, self.version))
+		except ValueError:
+			return False
+		return True
+
+	def is_full(self):
+		return len(self.records) >= self.batch_size
+
+	def flush(self):
+		"""
+		Returns the current entry or None if there are no records.
+		"""
+		if len(self.records) == 0:
+			return None
+		entry = pack(self.records, self.version)
+		self.records = []
+		return entry
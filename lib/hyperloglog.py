@@ -0,0 +1,193 @@
+"""
+HyperLogLog distinct counters for the fan-out of hosts.
+
+Scan detection needs the number of distinct destinations (and ports) a
+source talks to and the number of distinct sources of a destination.
+Counting them with COUNT(DISTINCT ...) over the flow collections is
+expensive. The preprocessor therefore keeps one HyperLogLog (Flajolet
+et al.) per bucket and host and writes it as a small blob. The counters
+of several buckets are merged by taking the maximum of every register,
+so the fan-out of any time range is estimated without reading flows.
+
+With precision p, a counter has 2^p registers and a standard error of
+about 1.04 / sqrt(2^p). Counters with few distinct values are kept and
+stored sparse.
+
+Blob format (version 1):
+	version (B), precision (B), number of sparse entries (H)
+	sparse: entries of register (H) and rank (B)
+	dense (number of sparse entries 0xffff): 2^p ranks (B)
+"""
+
+import math
+import struct
+import hashlib
+
+import common
+from bucketaggregator import BucketAggregator
+
+VERSION = 1
+HEADER = struct.Struct("!BBH")
+ENTRY = struct.Struct("!HB")
+DENSE = 0xffff
+
+def hash64(value):
+	return struct.unpack_from("!Q", hashlib.md5(str(value)).digest())[0]
+
+class HyperLogLog:
+	def __init__(self, precision=10):
+		"""
+		:Parameters:
+		 - `precision`: Number of index bits (4 to 16).
+		"""
+		if precision < 4 or precision > 16:
+			raise ValueError("HyperLogLog precision must be between 4 and 16")
+		self.precision = precision
+		self.m = 1 << precision
+		# register -> rank until a quarter of the registers is used.
+		# then a bytearray of all registers
+		self.registers = dict()
+
+	def is_sparse(self):
+		return type(self.registers) == dict
+
+	def to_dense(self):
+		if not self.is_sparse():
+			return
+		registers = bytearray(self.m)
+		for index, rank in self.registers.iteritems():
+			registers[index] = rank
+		self.registers = registers
+
+	def set_register(self, index, rank):
+		if self.is_sparse():
+			if rank > self.registers.get(index, 0):
+				self.registers[index] = rank
+				if len(self.registers) > self.m / 4:
+					self.to_dense()
+		elif rank > self.registers[index]:
+			self.registers[index] = rank
+
+	def add(self, value):
+		h = hash64(value)
+		index = h >> (64 - self.precision)
+		rest = (h << self.precision) & 0xffffffffffffffff
+		# position of the first 1 bit in the remaining bits
+		rank = 1
+		while rank <= 64 - self.precision and rest & 0x8000000000000000 == 0:
+			rest <<= 1
+			rank += 1
+		self.set_register(index, rank)
+
+	def merge(self, other):
+		if other.precision != self.precision:
+			raise ValueError("Cannot merge HyperLogLogs of different precision")
+		if other.is_sparse():
+			for index, rank in other.registers.iteritems():
+				self.set_register(index, rank)
+		else:
+			self.to_dense()
+			for index in xrange(self.m):
+				if other.registers[index] > self.registers[index]:
+					self.registers[index] = other.registers[index]
+
+	def count(self):
+		"""
+		Returns the estimated number of distinct values.
+		"""
+		if self.is_sparse():
+			ranks = self.registers.values()
+			zeros = self.m - len(ranks)
+		else:
+			ranks = [ rank for rank in self.registers if rank > 0 ]
+			zeros = self.m - len(ranks)
+		if self.m >= 128:
+			alpha = 0.7213 / (1 + 1.079 / self.m)
+		else:
+			alpha = { 16: 0.673, 32: 0.697, 64: 0.709 }[self.m]
+		estimate = alpha * self.m * self.m / (zeros + sum([ 2.0 ** -rank for rank in ranks ]))
+		if estimate <= 2.5 * self.m and zeros > 0:
+			# linear counting for small cardinalities
+			estimate = self.m * math.log(self.m / float(zeros))
+		return estimate
+
+	def serialize(self):
+		if self.is_sparse():
+			parts = [ HEADER.pack(VERSION, self.precision, len(self.registers)) ]
+			for index, rank in self.registers.iteritems():
+				parts.append(ENTRY.pack(index, rank))
+			return "".join(parts)
+		return HEADER.pack(VERSION, self.precision, DENSE) + str(self.registers)
+
+
+def deserialize(data):
+	"""
+	Returns the HyperLogLog of a blob written by serialize().
+	"""
+	data = str(data)
+	(version, precision, count) = HEADER.unpack_from(data)
+	if version != VERSION:
+		raise ValueError("Unsupported HyperLogLog version %i" % (version))
+	hll = HyperLogLog(precision)
+	if count == DENSE:
+		if len(data) != HEADER.size + hll.m:
+			raise ValueError("HyperLogLog is truncated")
+		hll.registers = bytearray(data[HEADER.size:])
+		return hll
+	if len(data) != HEADER.size + count * ENTRY.size:
+		raise ValueError("HyperLogLog is truncated")
+	for i in range(count):
+		(index, rank) = ENTRY.unpack_from(data, HEADER.size + i * ENTRY.size)
+		hll.registers[index] = rank
+	return hll
+
+def merge_docs(docs, field):
+	"""
+	Merges the counters of field in the documents docs (see
+	FanoutAggregator.get_values()) per host. Returns a dictionary of host
+	and HyperLogLog.
+	"""
+	result = dict()
+	for doc in docs:
+		if not field in doc:
+			continue
+		hll = deserialize(doc[field])
+		host = doc[common.COL_ID]
+		if host in result:
+			result[host].merge(hll)
+		else:
+			result[host] = hll
+	return result
+
+
+class FanoutAggregator(BucketAggregator):
+	def __init__(self, collection, key_field, count_fields, precision):
+		"""
+		Keeps one HyperLogLog per bucket, host and counted field until
+		the bucket is closed (see bucketaggregator.py).
+
+		:Parameters:
+		 - `collection`: The fan-out collection.
+		 - `key_field`: The host field (e.g. the source address).
+		 - `count_fields`: The fields whose distinct values are counted per host.
+		 - `precision`: The precision of the HyperLogLogs.
+		"""
+		BucketAggregator.__init__(self, collection)
+		self.key_field = key_field
+		self.count_fields = count_fields
+		self.precision = precision
+
+	def create_state(self):
+		return [ HyperLogLog(self.precision) for f in self.count_fields ]
+
+	def add_flow(self, obj):
+		counters = self.get_state((obj[common.COL_BUCKET], obj[self.key_field]))
+		for i, field in enumerate(self.count_fields):
+			counters[i].add(obj.get(field, None))
+
+	def get_values(self, key, counters):
+		(bucket, host) = key
+		values = { common.COL_BUCKET: bucket, common.COL_ID: host }
+		for i, field in enumerate(self.count_fields):
+			values[field] = counters[i].serialize()
+		return values
@@ -1,6 +1,17 @@
 import common
 
 import sys
+import os
+import gzip
+import mmap
+import time
+import socket
+import signal
+import errno
+import heapq
+
+import netflow
+import ipcodec
 
 ########################## functions
 def compareTables(a, b):
@@ -9,9 +20,19 @@ def compareTables(a, b):
 	return -cmp(int(compsA[1]), int(compsB[1])) or cmp(int(compsA[2]), int(compsB[2])) or cmp(int(compsA[3]), int(compsB[3]))
 
 
-def ip2int(string):
-	ip_fields=string.split('.')
-	return 2**24*long(ip_fields[0])+2**16*long(ip_fields[1])+2**8*long(ip_fields[2])+long(ip_fields[3])
+def import_dpkt():
+	"""
+	Returns the dpkt module with the pcap and IP decoders. Falls back
+	to the copy in app/vendor if dpkt is not installed.
+	"""
+	try:
+		import dpkt
+	except ImportError:
+		sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'app', 'vendor', 'dpkt-1.7'))
+		import dpkt
+	import dpkt.pcap
+	import dpkt.ip
+	return dpkt
 
 def getTableNameFromTimestamp(timestamp):
 	timeObj = datetime.datetime.utcfromtimestamp(timestamp)
@@ -54,13 +75,250 @@ def getTables(tables, firstTimestamp, lastTimestamp, TYPE):
 
 ############################## Classes
 
+class VermontMappingPlan:
+	"""
+	Translates the rows of a Vermont flow table into flows. The column 
+	names, the reverse flow fields and the millisecond conversions are
+	resolved once per table from the cursor description.
+	"""
+	# forward field -> field of the reverse flow
+	REVERSE_FIELDS = {
+		common.COL_SRC_IP: common.COL_DST_IP,
+		common.COL_DST_IP: common.COL_SRC_IP,
+		common.COL_SRC_PORT: common.COL_DST_PORT,
+		common.COL_DST_PORT: common.COL_SRC_PORT,
+		common.COL_PROTO: common.COL_PROTO,
+	}
+	# vermont flows can contain MilliSecond fields instead of second fields.
+	# flow-inspector requires seconds
+	MILLISECOND_FIELDS = {
+		"flowStartMilliSeconds": common.COL_FIRST_SWITCHED,
+		"flowEndMilliSeconds": common.COL_LAST_SWITCHED,
+	}
+
+	def __init__(self, description, db_type):
+		# field -> (column index, whether it is in milliseconds). a later
+		# column overwrites the field of an earlier one
+		fields = dict()
+		rev_fields = dict()
+		self.have_reverse = False
+		for j, colDesc in enumerate(description):
+			col = self.get_column_name(colDesc[0], db_type)
+			if col in common.IGNORE_COLUMNS:
+				continue
+
+			# vermont tables may contain reverse flow information
+			# if they have been produced using the biflowaggregation feature. 
+			# create a reverse flow which matches the flow
+			if col in self.REVERSE_FIELDS:
+				rev_fields[self.REVERSE_FIELDS[col]] = (j, False)
+
+			if col.startswith('rev'):
+				self.have_reverse = True
+				target = rev_fields
+				col = col[3:]
+			else:
+				target = fields
+			if col in self.MILLISECOND_FIELDS:
+				target[self.MILLISECOND_FIELDS[col]] = (j, True)
+			target[col] = (j, False)
+
+		(self.copy_fields, self.millisecond_fields) = self.split(fields)
+		(self.rev_copy_fields, self.rev_millisecond_fields) = self.split(rev_fields)
+
+	def get_column_name(self, name, db_type):
+		# oracle returns column names in upper cases, which we do not expect
+		# translate the name to what we expect and what we get from all the
+		# normal databases
+		if db_type != "oracle":
+			return name
+		if name.startswith('REV'):
+			if name[3:] in common.ORACLE_COLUMNMAP:
+				return 'rev' + common.ORACLE_COLUMNMAP[name[3:]]
+			# will probably be ignored
+			return name
+		return common.ORACLE_COLUMNMAP.get(name, name)
+
+	def split(self, fields):
+		copy_fields = [ (field, j) for (field, (j, millis)) in fields.iteritems() if not millis ]
+		millisecond_fields = [ (field, j) for (field, (j, millis)) in fields.iteritems() if millis ]
+		return (copy_fields, millisecond_fields)
+
+	def apply(self, rows):
+		"""
+		Returns the flows of rows. A reverse flow directly follows its
+		flow.
+		"""
+		flows = []
+		for row in rows:
+			obj = dict([ (field, row[j]) for (field, j) in self.copy_fields ])
+			for (field, j) in self.millisecond_fields:
+				obj[field] = row[j] / 1000
+			flows.append(obj)
+
+			if self.have_reverse:
+				revObj = dict([ (field, row[j]) for (field, j) in self.rev_copy_fields ])
+				for (field, j) in self.rev_millisecond_fields:
+					revObj[field] = row[j] / 1000
+				# check if the reverse flow start time is > 0. if it is zero, this means that we have a 
+				# one way flow (e.g. coming from a scan) that should not be imported into the database
+				if revObj.get(common.COL_FIRST_SWITCHED, 0) > 0:
+					flows.append(revObj)
+		return flows
+
+
+class LegacyMappingPlan:
+	"""
+	Translates the rows of a legacy Vermont table. Legacy column names
+	are replaced by their IPFIX names.
+	"""
+	def __init__(self, description):
+		self.fields = []
+		for j, col in enumerate(description):
+			if col[0] not in common.IGNORE_COLUMNS:
+				self.fields.append((common.LEGACY_COLUMNMAP.get(col[0].upper(), col[0]), j))
+
+	def apply(self, rows):
+		return [ dict([ (field, row[j]) for (field, j) in self.fields ]) for row in rows ]
+
+
+class ArgusMappingPlan:
+	"""
+	Translates the rows of an Argus table into a flow and its reverse flow.
+	"""
+	COLUMNMAP = {
+		"proto": common.COL_PROTO,
+		"saddr": common.COL_SRC_IP,
+		"daddr": common.COL_DST_IP,
+		"sport": common.COL_SRC_PORT,
+		"dport": common.COL_DST_PORT
+	}
+	SRC_DIRECTION_MAP = {
+		"spkts" : common.COL_PKTS,
+		"sbytes": common.COL_BYTES
+	}
+	DST_DIRECTION_MAP = {
+		"dpkts" : common.COL_PKTS,
+		"dbytes" : common.COL_BYTES
+	}
+
+	def __init__(self, description):
+		# (field, field of the reverse flow, column index, conversion)
+		self.endpoint_fields = []
+		self.src_fields = []
+		self.dst_fields = []
+		# columns of dotted quads, which are converted as a whole
+		self.address_columns = []
+		self.stime = None
+		self.dur = None
+		for j, col in enumerate(description):
+			name = col[0]
+			if name in self.COLUMNMAP:
+				field = self.COLUMNMAP[name]
+				convert = None
+				if field in [ common.COL_SRC_IP, common.COL_DST_IP ]:
+					self.address_columns.append(j)
+				elif field == common.COL_PROTO:
+					convert = common.getValueFromProto
+				self.endpoint_fields.append((field, VermontMappingPlan.REVERSE_FIELDS[field], j, convert))
+			elif name in self.SRC_DIRECTION_MAP:
+				self.src_fields.append((self.SRC_DIRECTION_MAP[name], j))
+			elif name in self.DST_DIRECTION_MAP:
+				self.dst_fields.append((self.DST_DIRECTION_MAP[name], j))
+			elif name == "stime":
+				self.stime = j
+			elif name == "dur":
+				self.dur = j
+
+	def apply(self, rows):
+		addresses = dict([ (j, ipcodec.ip2int_array([ row[j] for row in rows ])) for j in self.address_columns ])
+		flows = []
+		for i, row in enumerate(rows):
+			obj = dict([ (field, row[j]) for (field, j) in self.src_fields ])
+			revObj = dict([ (field, row[j]) for (field, j) in self.dst_fields ])
+			for (field, rev_field, j, convert) in self.endpoint_fields:
+				if j in addresses:
+					value = addresses[j][i]
+				else:
+					value = row[j]
+					if convert != None:
+						value = convert(value)
+				obj[field] = value
+				revObj[rev_field] = value
+			if self.stime != None:
+				firstSwitched = float(row[self.stime])
+				obj[common.COL_FIRST_SWITCHED] = firstSwitched
+				revObj[common.COL_FIRST_SWITCHED] = firstSwitched
+				if self.dur != None:
+					obj[common.COL_LAST_SWITCHED] = firstSwitched + float(row[self.dur])
+					revObj[common.COL_LAST_SWITCHED] = firstSwitched + float(row[self.dur])
+			flows.append(obj)
+
+			# check if the reverse flow start time is > 0. if it is zero, this means that we have a 
+			# one way flow (e.g. coming from a scan) that should not be imported into the database
+			if revObj.get(common.COL_FIRST_SWITCHED, 0) > 0:
+				flows.append(revObj)
+		return flows
+
+
 class BaseImporter:
+	# importers that receive flows from exporters cannot wait while the
+	# queue is full. they are not paced by --max-queue
+	can_wait = True
+
 	def __init__(self, args):
 		self.args = args
 
 	def get_next_flow(self):
 		raise Exception("Derived class did not implement get_next_flow!")
 
+	def get_next_flows(self):
+		"""
+		Returns the next block of flows or None if there are no more flows.
+		"""
+		flows = []
+		while len(flows) < self.args.fetch_size:
+			flow = self.get_next_flow()
+			if flow == None:
+				break
+			flows.append(flow)
+		if len(flows) == 0:
+			return None
+		return flows
+
+	def get_parts(self):
+		"""
+		Returns the independent parts of the import (e.g. tables) in import
+		order or None if the import cannot be split. Used to import the
+		parts in parallel.
+		"""
+		return None
+
+	def set_checkpoints(self, checkpoints):
+		"""
+		Resumes the import of a previous run. checkpoints is a
+		dictionary of table and state (see checkpoint.py).
+		"""
+		print >> sys.stderr, "This importer does not support checkpoints."
+		sys.exit(1)
+
+	def get_checkpoint(self):
+		"""
+		Returns the states of the tables that changed with the flows
+		returned since the last call.
+		"""
+		return dict()
+
+	def get_stats(self):
+		"""
+		Returns a dictionary of counters that are exported to Redis or
+		None.
+		"""
+		return None
+
+	def close(self):
+		pass
+
 	def get_db_connection(self):
 		# check if is there a MySQL or a PostgreSQL database
 		try:
@@ -83,7 +341,7 @@ class BaseImporter:
 			try:
 				print "Failed to connect to postgresql db. Reason: ", e
 				print "Trying mysql instead ..."
-				#import MySQLdb
+				import MySQLdb
 				#import _mysql_exceptions
 		
 				self.TYPE = "mysql"
@@ -111,15 +369,207 @@ class BaseImporter:
 					print >> sys.stderr, "Could not connect to source database:", e
 					sys.exit(1)
 
+	def get_stream_cursor(self):
+		"""
+		Returns a new cursor that streams the rows of a query from the 
+		server instead of buffering the complete result in the client.
+		At most --fetch-size rows are transferred at once.
+		"""
+		if self.TYPE == "mysql":
+			import MySQLdb.cursors
+			return self.conn.cursor(MySQLdb.cursors.SSCursor)
+		elif self.TYPE == "postgresql":
+			# named cursors are server-side cursors
+			self.stream_count = getattr(self, "stream_count", 0) + 1
+			cursor = self.conn.cursor(name="flowinspector_import_%i" % (self.stream_count))
+			cursor.itersize = self.args.fetch_size
+			return cursor
+		elif self.TYPE == "oracle":
+			import cx_Oracle
+			cursor = cx_Oracle.Cursor(self.conn)
+			cursor.arraysize = self.args.fetch_size
+			return cursor
+		return self.conn.cursor()
 
-	
-class VermontDB(BaseImporter):
+
+
+class BatchImporter(BaseImporter):
+	"""
+	Base class of the importers that implement get_next_flows().
+	"""
 	def __init__(self, args):
 		BaseImporter.__init__(self, args)
+		self.pending = []
+
+	def get_next_flow(self):
+		while len(self.pending) == 0:
+			flows = self.get_next_flows()
+			if flows == None:
+				return None
+			flows.reverse()
+			self.pending = flows
+		return self.pending.pop()
+
+
+class SQLImporter(BatchImporter):
+	"""
+	Imports the tables in self.tables (last table first) block by block
+	with fetchmany() on a server-side cursor, so that the memory usage 
+	does not depend on the table size. Derived classes compile a mapping
+	plan for the columns of every table, which translates the rows into
+	flows.
+
+	With checkpoints, the rows are ordered by the first of ORDER_COLUMNS
+	that a table has. All tables except self.newest_table, which the
+	collector may still write to, are done once they have been imported.
+	Rows that are inserted after a checkpoint with a smaller value of the
+	ordering column than the checkpoint are not imported.
+	"""
+	ORDER_COLUMNS = []
+
+	def __init__(self, args):
+		BatchImporter.__init__(self, args)
+		self.plan = None
+		# cursor of the table that is imported (see get_stream_cursor())
+		self.stream = None
+		self.newest_table = None
+		# checkpoint state
+		self.checkpoints = None
+		self.updates = dict()
+		self.table = None
+		self.order_index = None
+		self.position = None
+		self.skip = 0
+
+	def get_query(self, table):
+		return "SELECT * FROM " + table
+
+	def compile_plan(self, description):
+		raise Exception("Derived class did not implement compile_plan!")
+
+	def get_next_flows(self):
+		while True:
+			if self.stream != None:
+				rows = self.stream.fetchmany(self.args.fetch_size)
+				if len(rows) > 0:
+					# the description of server-side cursors is only 
+					# available after the first fetch
+					if self.plan == None:
+						self.plan = self.compile_plan(self.stream.description)
+					if self.checkpoints != None:
+						rows = self.advance(rows)
+						if len(rows) == 0:
+							continue
+					return self.plan.apply(rows)
+				self.stream.close()
+				self.stream = None
+				if self.checkpoints != None and self.table != self.newest_table:
+					self.updates[self.table] = { "done": True }
+
+			if len(self.tables) == 0:
+				return None
+			table = self.tables.pop()
+
+			print "Importing table ", table, "..."
+			if self.checkpoints != None:
+				self.start_table(table)
+			else:
+				self.stream = self.get_stream_cursor()
+				self.stream.execute(self.get_query(table))
+			self.plan = None
+
+	def set_checkpoints(self, checkpoints):
+		self.checkpoints = checkpoints
+		self.tables = [ table for table in self.tables if not checkpoints.get(table, {}).get("done", False) ]
+
+	def get_checkpoint(self):
+		updates = self.updates
+		self.updates = dict()
+		return updates
+
+	def get_order_column(self, table):
+		"""
+		Returns the name and index of the column that orders the rows
+		of table or (None, None).
+		"""
+		self.c.execute("SELECT * FROM " + table + " WHERE 1 = 0")
+		names = [ col[0] for col in self.c.description ]
+		for column in self.ORDER_COLUMNS:
+			for j, name in enumerate(names):
+				# oracle returns upper case names
+				if name.lower() == column.lower():
+					return (name, j)
+		return (None, None)
+
+	def start_table(self, table):
+		self.table = table
+		self.position = None
+		self.skip = 0
+		# query the columns before the stream is opened. mysql does not 
+		# allow other queries while a server-side cursor is open
+		(column, self.order_index) = self.get_order_column(table)
+		self.stream = self.get_stream_cursor()
+		if column == None:
+			print >> sys.stderr, "Table %s has none of the columns %s. It cannot be resumed." % (table, ", ".join(self.ORDER_COLUMNS))
+			self.stream.execute(self.get_query(table))
+			return
+
+		query = "SELECT * FROM " + table
+		state = self.checkpoints.get(table, {})
+		if "key" in state:
+			self.position = (float(state["key"]), int(state["count"]))
+			self.skip = self.position[1]
+			print "Resuming table %s at %s = %r" % (table, column, self.position[0])
+			query += " WHERE %s >= %r" % (column, self.position[0])
+		self.stream.execute(query + " ORDER BY %s ASC" % (column))
+
+	def advance(self, rows):
+		"""
+		Drops the rows of rows that a previous run has imported and 
+		updates the position of the current table.
+		"""
+		j = self.order_index
+		if j == None:
+			return rows
+		start = 0
+		while self.skip > 0 and start < len(rows) and float(rows[start][j]) == self.position[0]:
+			start += 1
+			self.skip -= 1
+		if start < len(rows):
+			self.skip = 0
+		rows = rows[start:]
+		if len(rows) == 0:
+			return rows
+
+		# count the rows that share the key of the last row
+		key = float(rows[-1][j])
+		i = len(rows) - 1
+		while i > 0 and float(rows[i - 1][j]) == key:
+			i -= 1
+		count = len(rows) - i
+		if i == 0 and self.position != None and self.position[0] == key:
+			count += self.position[1]
+		self.position = (key, count)
+		self.updates[self.table] = { "key": key, "count": count }
+		return rows
+
+	def get_parts(self):
+		# the tables are imported from the end of the list
+		return list(reversed(self.tables))
+
+	def close(self):
+		self.conn.close()
+
+
+class VermontDB(SQLImporter):
+	# vermont writes the flows when they end
+	ORDER_COLUMNS = [ "flowEndMilliSeconds", "flowEndSeconds" ]
+
+	def __init__(self, args):
+		SQLImporter.__init__(self, args)
 		self.get_db_connection()
-		self.flows = None
 		self.get_tables();
-		self.prevFlow = None
+		self.newest_table = max(self.tables or [ None ])
 		print self.tables;
 		if self.args.table_name:
 			print "Limiting table space to ", self.args.table_name
@@ -130,96 +580,10 @@ class VermontDB(BaseImporter):
 				self.tables = []
 				
 
-	def get_next_flow(self):
-		if self.prevFlow:
-			ret = self.prevFlow
-			self.prevFlow = None
-			return ret
-	
-		flow = self.c.fetchone()
-
-		if flow == None:
-			if len(self.tables) == 0:
-				return None
-			table =  self.tables.pop()
-
-			print "Importing table ", table, "..."
-			self.c.execute("SELECT * FROM " + table)
-			return self.get_next_flow()
-
-
-		obj = dict()
-		revObj = dict()
-		haveReverse = False
-		for j, colDesc in enumerate(self.c.description):
-			# oracle returns column names in upper cases, which we do not expect
-			# translate the name to what we expect and what we get from all the
-			# normal databases
-			if self.TYPE == "oracle":
-				if colDesc[0].startswith('REV'):
-					fieldName = colDesc[0][3:len(col[0])]
-					if fieldName in common.ORACLE_COLUMNMAP:
-						col = 'rev' + common.ORACLE_COLUMNMAP[fieldName]
-					else:
-						# will probably be ignored
-						col = colDesc[0]
-				else:
-					if colDesc[0] in common.ORACLE_COLUMNMAP:
-						col = common.ORACLE_COLUMNMAP[colDesc[0]]
-					else:
-						col = colDesc[0]
-			else:
-				col = colDesc[0]
-
-			if col not in common.IGNORE_COLUMNS:
-				# vermont tables may contain reverse flow information
-				# if they have been produced using the biflowaggregation feature. 
-				# create a revObj which matches the reverse flow
-				if col == common.COL_SRC_IP:
-					revObj[common.COL_DST_IP] = flow[j]
-				if col == common.COL_DST_IP:
-					revObj[common.COL_SRC_IP] = flow[j]
-				if col == common.COL_SRC_PORT:
-					revObj[common.COL_DST_PORT] = flow[j]
-				if col == common.COL_DST_PORT:
-					revObj[common.COL_SRC_PORT] = flow[j]
-				if col == common.COL_PROTO:
-					revObj[common.COL_PROTO] = flow[j]
-
-				if col.startswith('rev'):
-					haveReverse = True
-					fieldName = col[3:len(col)]
-					# vermont flows can contain MilliSecond fields instead of second fields
-					# flow-inspector requires seconds. hence, we produce the second fields
-					# from the milliseconds
-					if fieldName == "flowStartMilliSeconds":
-						revObj[common.COL_FIRST_SWITCHED] = flow[j] / 1000
-					elif fieldName == "flowEndMilliSeconds":
-						revObj[common.COL_LAST_SWITCHED] = flow[j] / 1000
-					revObj[fieldName] = flow[j]
-				else:
-	
-					# vermont flows can contain MilliSecond fields instead of second fields
-					# flow-inspector requires seconds. hence, we produce the second fields
-						# from the milliseconds
-					if col == "flowStartMilliSeconds":
-							obj[common.COL_FIRST_SWITCHED] = flow[j] / 1000
-					elif col == "flowEndMilliSeconds":
-						obj[common.COL_LAST_SWITCHED] = flow[j] / 1000
-					obj[col] = flow[j]
-
-		# if we have at least one reverse flow field, we need to create the reverse field
-		# we will store the reversefield and return it on the next call to get_next_flow
-		if haveReverse:
-			# check if the reverse flow start time is > 0. if it is zero, this means that we have a 
-			# one way flow (e.g. coming from a scan) that should not be imported into the database
-			if common.COL_FIRST_SWITCHED in revObj and revObj[common.COL_FIRST_SWITCHED] > 0:
-				self.prevFlow = revObj
-
-		return obj
+	def compile_plan(self, description):
+		return VermontMappingPlan(description, self.TYPE)
 
 	
-	
 	def compareTables(a, b):
 		compsA = a.split('_')
 		compsB = b.split('_')
@@ -246,49 +610,26 @@ class VermontDB(BaseImporter):
 			self.tables.sort()
 
 
-class LegacyVermontDB(BaseImporter):
+class LegacyVermontDB(SQLImporter):
+	ORDER_COLUMNS = [ "ID", "LASTSWITCHED" ]
+
 	def __init__(self, args):
-		BaseImporter.__init__(self, args)
+		SQLImporter.__init__(self, args)
 		self.get_db_connection()
-		self.flows = None
-		self.get_tables;
-
-	def get_next_flow(self):
+		self.get_tables()
+		self.newest_table = max(self.tables or [ None ])
 		if self.args.table_name:
 			if self.args.table_name in self.tables:
 				self.tables = [ self.args.table_name ]
 			else:
-				# the requested table is not known!
-				return None
+				print "Table " + self.args.table_name + " is not in database!"
+				self.tables = []
 
-		if self.flows == None:
-			if len(self.tables) == 0:
-				return None
-			table = self.tables.pop()
-			print "Importing table ", table, "..."
-		
-			self.c.execute("SELECT * FROM " + table + " ORDER BY FIRSTSWITCHED ASC")
-			self.flows = self.c.fetchall()
+	def get_query(self, table):
+		return "SELECT * FROM " + table + " ORDER BY FIRSTSWITCHED ASC"
 
-		if len(self.flows) >= 1:
-			flow =  self.flows.pop()
-		else:
-			flow = None
-		if len(self.flows) == 0:
-			self.flows = None
-
-		if flow != None:
-			# remove legacy names and return object with IPFIX names
-			obj = dict()
-			for j, col in enumerate(self.c.description):
-				if col[0] not in common.IGNORE_COLUMNS:
-					if col[0].upper() in common.LEGACY_COLUMNMAP:
-						obj[common.LEGACY_COLUMNMAP[col[0].upper()]] = row[j]
-					else:
-						obj[col[0]] = row[j]
-			return obj
-
-		return flow;
+	def compile_plan(self, description):
+		return LegacyMappingPlan(description)
 	
 	
 	def compareTables(a, b):
@@ -300,12 +641,12 @@ class LegacyVermontDB(BaseImporter):
 	def get_tables(self):
 		# get all flow tables
 		if self.TYPE == "oracle":
-			c.execute("""SELECT * FROM user_objects WHERE object_type = 'TABLE' AND object_name LIKE 'H!_%' ESCAPE '!'""")
+			self.c.execute("""SELECT * FROM user_objects WHERE object_type = 'TABLE' AND object_name LIKE 'H!_%' ESCAPE '!'""")
 		else:
-			c.execute("""SELECT table_name from information_schema.tables 
-				WHERE table_schema=%s AND table_type='BASE TABLE' AND table_name LIKE 'h\\_%%' ORDER BY table_name ASC""", (args.src_database))
+			self.c.execute("""SELECT table_name from information_schema.tables 
+				WHERE table_schema=%s AND table_type='BASE TABLE' AND table_name LIKE 'h\\_%%' ORDER BY table_name ASC""", (self.args.src_database,))
 		print "Getting all table names ..."
-		self.tables = c.fetchall()
+		self.tables = self.c.fetchall()
 	
 		# get the table names in list format
 		self.tables = map(lambda x: x[0], list(self.tables))
@@ -317,166 +658,222 @@ class LegacyVermontDB(BaseImporter):
 
 
 
-class BroImporter(BaseImporter):
+class BroImporter(BatchImporter):
+	"""
+	Imports Bro/Zeek conn.log files. --conn-file is a log file or a 
+	directory of (rotated) logs. Logs can be gzip compressed. The field
+	positions and separators are taken from the log header. Every
+	connection yields a flow for each direction.
+
+	The logs are read in large chunks (memory-mapped if uncompressed)
+	and every chunk is converted into one block of flows.
+	"""
+	CHUNK_SIZE = 4 * 1024 * 1024
+	# fields of the logs without a #fields header
+	DEFAULT_FIELDS = [ "ts", "uid", "id.orig_h", "id.orig_p", "id.resp_h", "id.resp_p", "proto", "service", "duration", "orig_bytes", "resp_bytes", "conn_state", "local_orig", "missed_bytes", "history", "orig_pkts", "orig_ip_bytes", "resp_pkts", "resp_ip_bytes", "tunnel_parents" ]
+	REQUIRED_FIELDS = [ "ts", "id.orig_h", "id.orig_p", "id.resp_h", "id.resp_p", "proto", "duration", "orig_pkts", "orig_ip_bytes", "resp_pkts", "resp_ip_bytes" ]
+
 	def __init__(self, args):
-		BaseImporter.__init__(self, args)
+		BatchImporter.__init__(self, args)
 		if not args.conn_file:
 			print "missing argument --conn-file!"
 			sys.exit(-1)
 
+		if os.path.isdir(args.conn_file):
+			self.files = [ os.path.join(args.conn_file, name) for name in sorted(os.listdir(args.conn_file)) 
+				if name.startswith("conn") and (name.endswith(".log") or name.endswith(".log.gz")) ]
+		else:
+			self.files = [ args.conn_file ]
+		self.files.reverse()
+
+		self.input_file = None
+		self.data = None
+		self.skipped_lines = 0
+		self.protos = dict()
+
+	def open_next_file(self):
+		"""
+		Opens the next log file. Returns False if there are no more files.
+		"""
+		self.close()
+		if len(self.files) == 0:
+			return False
+		filename = self.files.pop()
+		print "Importing log file ", filename, "..."
 		try:
-			self.input_file = open(args.conn_file, "r")
+			if filename.endswith(".gz"):
+				self.input_file = gzip.open(filename, "rb")
+				self.data = None
+			else:
+				self.input_file = open(filename, "rb")
+				if os.path.getsize(filename) > 0:
+					self.data = mmap.mmap(self.input_file.fileno(), 0, access=mmap.ACCESS_READ)
+				else:
+					self.data = ""
 		except Exception as e:
-			print >> sys.stderr, "Could not open connection log file ", args.conn_file, ": ", e
+			print >> sys.stderr, "Could not open connection log file ", filename, ": ", e
 			sys.exit(1)
+		self.offset = 0
+		self.rest = ""
+		self.separator = "\t"
+		self.unset_values = set([ "-", "(empty)", "" ])
+		self.set_fields(self.DEFAULT_FIELDS)
+		return True
 
-		self.prevFlow = None
+	def read_chunk(self):
+		"""
+		Returns the next chunk of complete lines of the current file or
+		None at the end of the file.
+		"""
+		if self.data != None:
+			chunk = self.data[self.offset:self.offset + self.CHUNK_SIZE]
+			self.offset += len(chunk)
+		else:
+			chunk = self.input_file.read(self.CHUNK_SIZE)
+		if len(chunk) == 0:
+			if len(self.rest) == 0:
+				return None
+			chunk = self.rest
+			self.rest = ""
+			return chunk
+		chunk = self.rest + chunk
+		end = chunk.rfind("\n") + 1
+		# keep an incomplete last line for the next chunk
+		self.rest = chunk[end:]
+		return chunk[:end]
 
+	def set_fields(self, fields):
+		missing = [ f for f in self.REQUIRED_FIELDS if not f in fields ]
+		if len(missing) > 0:
+			print >> sys.stderr, "Connection log lacks the fields " + ", ".join(missing)
+			sys.exit(1)
+		self.positions = [ fields.index(f) for f in self.REQUIRED_FIELDS ]
+		self.num_fields = len(fields)
 
-	def get_next_flow(self):
-		if self.prevFlow:
-			ret = self.prevFlow
-			self.prevFlow = None
-			return ret
+	def parse_header(self, line):
+		if line.startswith("#separator"):
+			self.separator = line[len("#separator"):].strip().decode("string_escape")
+			return
+		values = line.split(self.separator)
+		if values[0] == "#fields":
+			self.set_fields(values[1:])
+		elif values[0] == "#unset_field" and len(values) > 1:
+			self.unset_values.add(values[1])
+		elif values[0] == "#empty_field" and len(values) > 1:
+			self.unset_values.add(values[1])
 
-		line = self.input_file.readline()
-		if not line:
-			return None
-		# we only support the default format at the moment. 
-		# TODO: parse the header, get the appropriate names and 
-		# field separators ...
-		if line.startswith('#'):
-			return self.get_next_flow()
-	
-		fields = line.split()	
-	
-		srcFlow = {}
-		srcFlow[common.COL_FIRST_SWITCHED] = float(fields[0])
-		srcFlow[common.COL_SRC_IP] = ip2int(fields[2])
-		srcFlow[common.COL_SRC_PORT] = int(fields[3])
-		srcFlow[common.COL_DST_IP] = ip2int(fields[4])
-		srcFlow[common.COL_DST_PORT] = int(fields[5])
-		srcFlow[common.COL_PROTO] = common.getValueFromProto(fields[6])
-		if fields[8] == '-':
-			srcFlow[common.COL_LAST_SWITCHED] = float(fields[0])
-		else:
-			srcFlow[common.COL_LAST_SWITCHED] = float(fields[0]) + float(fields[8])
-		srcFlow[common.COL_PKTS] = int(fields[15])
-		srcFlow[common.COL_BYTES] = int(fields[16])
-	
-		dstFlow = {}
-		dstFlow[common.COL_FIRST_SWITCHED] = float(fields[0])
-		dstFlow[common.COL_SRC_IP] = ip2int(fields[4])
-		dstFlow[common.COL_SRC_PORT] = int(fields[5])
-		dstFlow[common.COL_DST_IP] = ip2int(fields[2])
-		dstFlow[common.COL_DST_PORT] = int(fields[3])
-		dstFlow[common.COL_PROTO] = common.getValueFromProto(fields[6])
-		if fields[8] == '-':
-			dstFlow[common.COL_LAST_SWITCHED] = float(fields[0])
-		else:
-			dstFlow[common.COL_LAST_SWITCHED] = float(fields[0]) + float(fields[8])
-		dstFlow[common.COL_PKTS] = int(fields[17])
-		dstFlow[common.COL_BYTES] = int(fields[18])
-	
-		# return srcFlow now, return dstflow at the next call to get_next_flow()
-		self.prevFlow = dstFlow
-		return srcFlow
+	def get_proto(self, proto):
+		value = self.protos.get(proto, None)
+		if value == None:
+			value = common.getValueFromProto(proto)
+			self.protos[proto] = value
+		return value
+
+	def parse_chunk(self, chunk):
+		flows = []
+		unset = self.unset_values
+		separator = self.separator
+		for line in chunk.split("\n"):
+			if len(line) == 0:
+				continue
+			if line[0] == "#":
+				self.parse_header(line.rstrip("\r"))
+				separator = self.separator
+				continue
+			values = line.rstrip("\r").split(separator)
+			if len(values) < self.num_fields:
+				self.skipped_lines += 1
+				continue
+			(ts, orig_h, orig_p, resp_h, resp_p, proto, duration, orig_pkts, orig_bytes, resp_pkts, resp_bytes) = [ values[i] for i in self.positions ]
+			try:
+				orig_ip = ipcodec.ip2int(orig_h)
+				resp_ip = ipcodec.ip2int(resp_h)
+			except ValueError:
+				# not an IPv4 address
+				self.skipped_lines += 1
+				continue
+
+			first = float(ts)
+			last = first
+			if not duration in unset:
+				last = first + float(duration)
+			proto = self.get_proto(proto)
+			orig_p = int(orig_p)
+			resp_p = int(resp_p)
+
+			srcFlow = {
+				common.COL_FIRST_SWITCHED: first,
+				common.COL_LAST_SWITCHED: last,
+				common.COL_SRC_IP: orig_ip,
+				common.COL_SRC_PORT: orig_p,
+				common.COL_DST_IP: resp_ip,
+				common.COL_DST_PORT: resp_p,
+				common.COL_PROTO: proto,
+				common.COL_PKTS: 0 if orig_pkts in unset else int(orig_pkts),
+				common.COL_BYTES: 0 if orig_bytes in unset else int(orig_bytes),
+			}
+			dstFlow = {
+				common.COL_FIRST_SWITCHED: first,
+				common.COL_LAST_SWITCHED: last,
+				common.COL_SRC_IP: resp_ip,
+				common.COL_SRC_PORT: resp_p,
+				common.COL_DST_IP: orig_ip,
+				common.COL_DST_PORT: orig_p,
+				common.COL_PROTO: proto,
+				common.COL_PKTS: 0 if resp_pkts in unset else int(resp_pkts),
+				common.COL_BYTES: 0 if resp_bytes in unset else int(resp_bytes),
+			}
+			flows.append(srcFlow)
+			flows.append(dstFlow)
+		return flows
+
+	def get_next_flows(self):
+		while True:
+			if self.input_file != None:
+				chunk = self.read_chunk()
+				if chunk != None:
+					flows = self.parse_chunk(chunk)
+					if len(flows) > 0:
+						return flows
+					continue
+			if not self.open_next_file():
+				if self.skipped_lines > 0:
+					print >> sys.stderr, "Skipped %i malformed or non-IPv4 connections." % (self.skipped_lines)
+					self.skipped_lines = 0
+				return None
+
+	def get_parts(self):
+		# the files are imported from the end of the list
+		return list(reversed(self.files))
+
+	def close(self):
+		if self.data != None and type(self.data) != str:
+			self.data.close()
+		self.data = None
+		if self.input_file != None:
+			self.input_file.close()
+		self.input_file = None
+
+class ArgusDB(SQLImporter):
+	ORDER_COLUMNS = [ "stime" ]
 
-class ArgusDB(BaseImporter):
 	def __init__(self, args):
-		BaseImporter.__init__(self, args)
+		SQLImporter.__init__(self, args)
 		self.get_db_connection()
-		self.flows = None
 		self.get_tables();
-		self.prevFlow = None
+		self.newest_table = max(self.tables or [ None ])
 		if self.args.table_name:
 			if self.args.table_name in self.tables:
 				self.tables = [ self.args.table_name ]
 			else:
 				print "Table " + self.args.table_name + " is not in database!"
 				self.tables = []
-		self.columnmap = {
-			"proto": common.COL_PROTO,
-			"saddr": common.COL_SRC_IP,
-			"daddr": common.COL_DST_IP,
-			"sport": common.COL_SRC_PORT,
-			"dport": common.COL_DST_PORT
-		}
-		self.srcDirectionMap = {
-			"spkts" : common.COL_PKTS,
-			"sbytes": common.COL_BYTES
-		}
-		self.dstDirectionMap = {
-			"dpkts" : common.COL_PKTS,
-			"dbytes" : common.COL_BYTES
-		}
-				
-
-	def get_next_flow(self):
-		if self.prevFlow:
-			ret = self.prevFlow
-			self.prevFlow = None
-			return ret
-	
-		flow = self.c.fetchone()
-		if flow == None:
-			if len(self.tables) == 0:
-				return None
-			table =  self.tables.pop()
-
-			print "Importing table ", table, "..."
-			self.c.execute("SELECT * FROM " + table + " ORDER BY stime ASC")
-			return self.get_next_flow()
-
-		obj = dict()
-		revObj = dict()
-		firstSwitched = None
-		for j, col in enumerate(self.c.description):
-			print col[0]
-			if col[0] in self.columnmap:
-				fieldName = self.columnmap[col[0]]
-				print "fieldName: ", fieldName
-				# argus tables contain reverse flow information
-				# create a revObj which matches the reverse flow
-				if fieldName == common.COL_SRC_IP:
-					ip = ip2int(flow[j])
-					obj[common.COL_SRC_IP] = ip
-					revObj[common.COL_DST_IP] = ip
-				if fieldName == common.COL_DST_IP:
-					ip = ip2int(flow[j])
-					obj[common.COL_DST_IP] = ip
-					revObj[common.COL_SRC_IP] = ip
-				if fieldName == common.COL_SRC_PORT:
-					obj[common.COL_SRC_PORT] = flow[j]
-					revObj[common.COL_DST_PORT] = flow[j]
-				if fieldName == common.COL_DST_PORT:
-					obj[common.COL_DST_PORT] = flow[j]
-					revObj[common.COL_SRC_PORT] = flow[j]
-				if fieldName == common.COL_PROTO:
-					obj[common.COL_PROTO] = common.getValueFromProto(flow[j])
-					revObj[common.COL_PROTO] = common.getValueFromProto(flow[j])
-			elif col[0] in self.srcDirectionMap:
-				fieldName = self.srcDirectionMap[col[0]]
-				obj[fieldName] = flow[j]
-			elif col[0] in self.dstDirectionMap:
-				fieldName = self.dstDirectionMap[col[0]]
-				revObj[fieldName] = flow[j]
-			elif col[0] == "stime":
-				firstSwitched = float(flow[j])
-				obj[common.COL_FIRST_SWITCHED] = firstSwitched
-				revObj[common.COL_FIRST_SWITCHED] = firstSwitched
-			elif col[0] == "dur":
-				obj[common.COL_LAST_SWITCHED] = firstSwitched + float(flow[j])
-				revObj[common.COL_LAST_SWITCHED] = firstSwitched + float(flow[j])
-				
 
-		# check if the reverse flow start time is > 0. if it is zero, this means that we have a 
-		# one way flow (e.g. coming from a scan) that should not be imported into the database
-		if common.COL_FIRST_SWITCHED in revObj and revObj[common.COL_FIRST_SWITCHED] > 0:
-			self.prevFlow = revObj
+	def get_query(self, table):
+		return "SELECT * FROM " + table + " ORDER BY stime ASC"
 
-		print obj
-		return obj
+	def compile_plan(self, description):
+		return ArgusMappingPlan(description)
 
 	def get_tables(self):
 		query_string = """SELECT table_name from information_schema.tables 
@@ -489,6 +886,310 @@ class ArgusDB(BaseImporter):
 		self.tables = map(lambda x: x[0], list(self.tables))
 
 	
+class PcapImporter(BatchImporter):
+	"""
+	Aggregates the packets of pcap files into flows. --pcap-file is a
+	capture or a directory of captures (.pcap, .cap, optionally gzip
+	compressed). The packets are streamed through a table of 
+	bidirectional flows. A flow expires when it has been idle for
+	--flow-idle-timeout seconds, when it has been active for 
+	--flow-active-timeout seconds or, if the table holds more than 
+	--max-flows flows, when it is among the least recently seen ones.
+	An expired flow yields a flow for each direction that has packets.
+	"""
+	EXTENSIONS = (".pcap", ".cap", ".pcap.gz", ".cap.gz")
+	# fields of the flow table entries
+	FIRST, LAST, PKTS, BYTES, REV_PKTS, REV_BYTES = range(6)
+	ETHERTYPE_IP = 0x0800
+	ETHERTYPE_VLAN = (0x8100, 0x88a8)
+	DLT_RAW = (12, 14, 101)
+	DLT_LOOP = (0, 108)
+	DLT_LINUX_SLL = 113
+
+	def __init__(self, args):
+		BatchImporter.__init__(self, args)
+		if not args.pcap_file:
+			print "missing argument --pcap-file!"
+			sys.exit(-1)
+		self.dpkt = import_dpkt()
+
+		if os.path.isdir(args.pcap_file):
+			self.files = [ os.path.join(args.pcap_file, name) for name in sorted(os.listdir(args.pcap_file)) if name.endswith(self.EXTENSIONS) ]
+		else:
+			self.files = [ args.pcap_file ]
+		self.files.reverse()
+
+		self.input_file = None
+		self.packets = None
+		# (src ip, dst ip, src port, dst port, proto) of the first packet -> entry
+		self.table = dict()
+		self.expired = []
+		self.next_sweep = 0
+		self.sweep_interval = max(1, min(args.flow_idle_timeout, args.flow_active_timeout) / 2)
+		self.skipped_packets = 0
+
+	def open_next_file(self):
+		"""
+		Opens the next capture. Returns False if there are no more files.
+		"""
+		self.close()
+		if len(self.files) == 0:
+			return False
+		filename = self.files.pop()
+		print "Importing capture ", filename, "..."
+		try:
+			if filename.endswith(".gz"):
+				self.input_file = gzip.open(filename, "rb")
+			else:
+				self.input_file = open(filename, "rb")
+			reader = self.dpkt.pcap.Reader(self.input_file)
+		except Exception as e:
+			print >> sys.stderr, "Could not open capture ", filename, ": ", e
+			sys.exit(1)
+		self.linktype = reader.datalink()
+		self.packets = iter(reader)
+		return True
+
+	def get_ip_offset(self, buf):
+		"""
+		Returns the offset of the IPv4 header in the frame buf or -1 if
+		the frame does not contain IPv4.
+		"""
+		if self.linktype == self.dpkt.pcap.DLT_EN10MB:
+			offset = 12
+			ethertype = (ord(buf[offset]) << 8) + ord(buf[offset + 1])
+			while ethertype in self.ETHERTYPE_VLAN:
+				offset += 4
+				ethertype = (ord(buf[offset]) << 8) + ord(buf[offset + 1])
+			if ethertype != self.ETHERTYPE_IP:
+				return -1
+			return offset + 2
+		elif self.linktype == self.DLT_LINUX_SLL:
+			if (ord(buf[14]) << 8) + ord(buf[15]) != self.ETHERTYPE_IP:
+				return -1
+			return 16
+		elif self.linktype in self.DLT_RAW:
+			offset = 0
+		elif self.linktype in self.DLT_LOOP:
+			offset = 4
+		else:
+			return -1
+		if ord(buf[offset]) >> 4 != 4:
+			return -1
+		return offset
+
+	def add_packet(self, ts, buf):
+		try:
+			offset = self.get_ip_offset(buf)
+			if offset < 0:
+				self.skipped_packets += 1
+				return
+			ip = self.dpkt.ip.IP(buf[offset:])
+		except (IndexError, self.dpkt.UnpackError):
+			self.skipped_packets += 1
+			return
+
+		sport = 0
+		dport = 0
+		# the IP class leaves the payload of fragments and truncated
+		# packets undecoded
+		if isinstance(ip.data, (self.dpkt.tcp.TCP, self.dpkt.udp.UDP)):
+			sport = ip.data.sport
+			dport = ip.data.dport
+		src = ipcodec.packed2int(ip.src)
+		dst = ipcodec.packed2int(ip.dst)
+
+		key = (src, dst, sport, dport, ip.p)
+		forward = True
+		entry = self.table.get(key, None)
+		if entry == None:
+			rev_key = (dst, src, dport, sport, ip.p)
+			entry = self.table.get(rev_key, None)
+			if entry != None:
+				key = rev_key
+				forward = False
+		if entry != None and (ts - entry[self.LAST] > self.args.flow_idle_timeout or ts - entry[self.FIRST] > self.args.flow_active_timeout):
+			self.emit(key, self.table.pop(key))
+			entry = None
+		if entry == None:
+			entry = [ ts, ts, 0, 0, 0, 0 ]
+			self.table[key] = entry
+		if ts > entry[self.LAST]:
+			entry[self.LAST] = ts
+		if forward:
+			entry[self.PKTS] += 1
+			entry[self.BYTES] += ip.len
+		else:
+			entry[self.REV_PKTS] += 1
+			entry[self.REV_BYTES] += ip.len
+
+		if ts >= self.next_sweep:
+			self.expire(ts)
+			self.next_sweep = ts + self.sweep_interval
+		elif len(self.table) > self.args.max_flows:
+			# expire a tenth of the table, so that it is not scanned for
+			# every new flow
+			oldest = heapq.nsmallest(max(1, self.args.max_flows / 10), self.table.iteritems(), key=lambda item: item[1][self.LAST])
+			for (key, entry) in oldest:
+				self.emit(key, self.table.pop(key))
+
+	def expire(self, now):
+		"""
+		Emits the flows that are idle or active for too long at time now
+		or all flows if now is None.
+		"""
+		if now == None:
+			keys = self.table.keys()
+		else:
+			keys = [ key for (key, entry) in self.table.iteritems()
+				if now - entry[self.LAST] > self.args.flow_idle_timeout or now - entry[self.FIRST] > self.args.flow_active_timeout ]
+		keys.sort(key=lambda key: self.table[key][self.LAST])
+		for key in keys:
+			self.emit(key, self.table.pop(key))
+
+	def emit(self, key, entry):
+		(src, dst, sport, dport, proto) = key
+		first = int(entry[self.FIRST])
+		last = int(entry[self.LAST])
+		if entry[self.PKTS] > 0:
+			self.expired.append({
+				common.COL_FIRST_SWITCHED: first,
+				common.COL_LAST_SWITCHED: last,
+				common.COL_SRC_IP: src,
+				common.COL_SRC_PORT: sport,
+				common.COL_DST_IP: dst,
+				common.COL_DST_PORT: dport,
+				common.COL_PROTO: proto,
+				common.COL_PKTS: entry[self.PKTS],
+				common.COL_BYTES: entry[self.BYTES],
+			})
+		if entry[self.REV_PKTS] > 0:
+			self.expired.append({
+				common.COL_FIRST_SWITCHED: first,
+				common.COL_LAST_SWITCHED: last,
+				common.COL_SRC_IP: dst,
+				common.COL_SRC_PORT: dport,
+				common.COL_DST_IP: src,
+				common.COL_DST_PORT: sport,
+				common.COL_PROTO: proto,
+				common.COL_PKTS: entry[self.REV_PKTS],
+				common.COL_BYTES: entry[self.REV_BYTES],
+			})
+
+	def take_expired(self):
+		flows = self.expired
+		self.expired = []
+		return flows
+
+	def get_next_flows(self):
+		while True:
+			if self.packets != None:
+				for (ts, buf) in self.packets:
+					self.add_packet(ts, buf)
+					if len(self.expired) >= self.args.fetch_size:
+						return self.take_expired()
+				# flows do not continue in the next capture
+				self.expire(None)
+				self.close()
+			if len(self.expired) > 0:
+				return self.take_expired()
+			if not self.open_next_file():
+				if self.skipped_packets > 0:
+					print >> sys.stderr, "Skipped %i non-IPv4 or malformed packets." % (self.skipped_packets)
+					self.skipped_packets = 0
+				return None
+
+	def get_parts(self):
+		return list(reversed(self.files))
+
+	def close(self):
+		self.packets = None
+		if self.input_file != None:
+			self.input_file.close()
+		self.input_file = None
+
+
+class NetflowCollector(BatchImporter):
+	"""
+	Receives NetFlow v5/v9 and IPFIX packets on a UDP socket (see
+	netflow.py). Packets are received until --fetch-size flows are
+	decoded or no packet arrived for a second, so that every block of 
+	flows is pushed to the queue in bulk.
+
+	The exporters cannot be paused, so the collector never waits for
+	the queue. SIGINT and SIGTERM stop it after the current block.
+	"""
+	can_wait = False
+
+	def __init__(self, args):
+		BatchImporter.__init__(self, args)
+		self.decoder = netflow.Decoder()
+		self.stopped = False
+		signal.signal(signal.SIGINT, self.stop)
+		signal.signal(signal.SIGTERM, self.stop)
+		self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+		try:
+			# bursts of packets must not be dropped while a block is pushed
+			self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 8 * 1024 * 1024)
+			self.sock.bind((args.listen_host, args.listen_port))
+		except socket.error as e:
+			print >> sys.stderr, "Could not listen on %s:%i: %s" % (args.listen_host, args.listen_port, e)
+			sys.exit(1)
+		self.sock.settimeout(1)
+		self.last_packet = time.time()
+
+	def receive(self):
+		"""
+		Returns the packets of the next block as a list of (data,
+		exporter) or None if the collector should stop.
+		"""
+		packets = []
+		flows = 0
+		while not self.stopped:
+			try:
+				(data, (exporter, port)) = self.sock.recvfrom(65535)
+			except socket.timeout:
+				if len(packets) > 0:
+					return packets
+				if self.args.idle_timeout > 0 and time.time() - self.last_packet > self.args.idle_timeout:
+					return None
+				continue
+			except socket.error as e:
+				# interrupted by stop()
+				if e.errno == errno.EINTR:
+					continue
+				raise
+			self.last_packet = time.time()
+			packets.append((data, exporter))
+			# estimate with the smallest records (NetFlow v5)
+			flows += len(data) / netflow.V5_RECORD.size
+			if flows >= self.args.fetch_size:
+				return packets
+		if len(packets) > 0:
+			return packets
+		return None
+
+	def stop(self, signum=None, frame=None):
+		print "Stopping the collector ..."
+		self.stopped = True
+
+	def get_stats(self):
+		return self.decoder.get_stats()
+
+	def get_next_flows(self):
+		while True:
+			packets = self.receive()
+			if packets == None:
+				print "Collector stopped: %s" % (self.decoder.get_stats())
+				return None
+			flows = self.decoder.decode_packets(packets)
+			if len(flows) > 0:
+				return flows
+
+	def close(self):
+		self.sock.close()
+
+
 def get_importer_module(importer_type, args):
 	if importer_type == "vermont-db":
 		return VermontDB(args);
@@ -498,6 +1199,10 @@ def get_importer_module(importer_type, args):
 		return BroImporter(args)
 	elif importer_type == "argus-importer":
 		return ArgusDB(args)
+	elif importer_type == "netflow-collector":
+		return NetflowCollector(args)
+	elif importer_type == "pcap-importer":
+		return PcapImporter(args)
 	else:
 		print "Unsupported importer module " + importer_type
 		sys.exit(-1)
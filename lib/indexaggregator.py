@@ -0,0 +1,147 @@
+"""
+Combiners for the node and port indexes.
+
+The indexes count bytes, packets and flows per node (IP address) or
+port and direction, optionally per bucket. Instead of sending three
+"$inc" documents per flow to the backend, the aggregators keep one
+counter array per (id, bucket) and write every key with a single upsert
+when they are flushed. The field names and the counters that a flow
+has to be added to are computed once when the aggregator is created.
+"""
+
+import common
+
+class IndexAggregator:
+	def __init__(self, collection, aggr_sum, protos, size=0):
+		"""
+		:Parameters:
+		 - `collection`: The index collection.
+		 - `aggr_sum`: A list of keys which will be summed up.
+		 - `protos`: Whether to keep per protocol counters.
+		 - `size`: Flush the aggregator as soon as it holds more than size
+		           keys. 0 only flushes on flush().
+		"""
+		self.collection = collection
+		self.aggr_sum = aggr_sum
+		self.protos = protos
+		self.size = size
+		self.counters = dict()
+
+		sums = aggr_sum + [ common.COL_FLOWS ]
+		proto_prefixes = [ "" ]
+		if protos:
+			proto_prefixes += [ p + "." for p in common.AVAILABLE_PROTOS ]
+
+		# field names of the counter arrays
+		self.fields = []
+		for direction in [ "", "src.", "dst." ]:
+			for proto in proto_prefixes:
+				for s in sums:
+					self.fields.append(direction + proto + s)
+		field_pos = dict([(f, i) for i, f in enumerate(self.fields)])
+
+		# (direction, proto) -> for each sum the counters it is added to
+		self.positions = dict()
+		for direction in [ None, "src", "dst" ]:
+			for proto in [ None ] + common.AVAILABLE_PROTOS:
+				if proto != None and not protos:
+					continue
+				positions = []
+				for s in sums:
+					names = [ s ]
+					if proto != None:
+						names.append(proto + "." + s)
+					if direction != None:
+						names += [ direction + "." + name for name in names ]
+					positions.append([ field_pos[name] for name in names ])
+				self.positions[(direction, proto)] = positions
+
+	def get_values(self, obj):
+		values = [ obj.get(s, 0) for s in self.aggr_sum ]
+		values.append(obj.get(common.COL_FLOWS, 1))
+		return values
+
+	def add(self, id, bucket, direction, proto, values):
+		"""
+		Adds values (one per sum field and the number of flows) to the
+		counters of id in bucket.
+		"""
+		key = (id, bucket)
+		counters = self.counters.get(key, None)
+		if counters == None:
+			counters = [ 0 ] * len(self.fields)
+			self.counters[key] = counters
+		for j, positions in enumerate(self.positions[(direction, proto)]):
+			value = values[j]
+			for pos in positions:
+				counters[pos] += value
+
+	def add_flow(self, obj):
+		raise Exception("Derived class did not implement add_flow!")
+
+	def add_flows(self, flows):
+		for obj in flows:
+			self.add_flow(obj)
+		if self.size > 0 and len(self.counters) > self.size:
+			self.flush()
+
+	def flush(self):
+		"""
+		Writes one upsert per key to the collection and clears the
+		counters.
+		"""
+		for (id, bucket), counters in self.counters.iteritems():
+			# only send the counters that changed
+			inc = dict([ (self.fields[i], value) for i, value in enumerate(counters) if value != 0 ])
+			if len(inc) == 0:
+				continue
+			doc = { "$inc": inc }
+			if bucket == None:
+				statement = { common.COL_ID: id }
+			else:
+				statement = { common.COL_ID: id, common.COL_BUCKET: bucket }
+			# the documents are already combined, do not let the backend
+			# cache them again
+			self.collection.update(statement, doc, True, True)
+		self.counters = dict()
+
+
+class NodeIndexAggregator(IndexAggregator):
+	def __init__(self, collection, aggr_sum, size=0):
+		IndexAggregator.__init__(self, collection, aggr_sum, True, size)
+
+	def add_flow(self, obj):
+		"""Adds a flow to the source, destination and total counters.
+		"""
+		values = self.get_values(obj)
+		proto = common.getProto(obj)
+		bucket = obj.get(common.COL_BUCKET, None)
+		self.add(obj[common.COL_SRC_IP], bucket, "src", proto, values)
+		self.add(obj[common.COL_DST_IP], bucket, "dst", proto, values)
+		self.add("total", bucket, None, proto, values)
+
+
+class PortIndexAggregator(IndexAggregator):
+	def __init__(self, collection, aggr_sum, filter_ports, size=0):
+		"""
+		:Parameters:
+		 - `filter_ports`: A registry of known ports (see portregistry.py) to remove unknown ports
+		"""
+		IndexAggregator.__init__(self, collection, aggr_sum, False, size)
+		self.filter_ports = filter_ports
+
+	def filter_port(self, port, obj):
+		# set unknown ports to None
+		if self.filter_ports and port != None:
+			if not self.filter_ports.is_known(port, int(obj.get(common.COL_PROTO, -1))):
+				port = None
+		return port
+
+	def add_flow(self, obj):
+		"""Adds a flow to the source, destination and total counters.
+		"""
+		values = self.get_values(obj)
+		bucket = obj.get(common.COL_BUCKET, None)
+		self.add(self.filter_port(obj.get(common.COL_SRC_PORT, None), obj), bucket, "src", None, values)
+		self.add(self.filter_port(obj.get(common.COL_DST_PORT, None), obj), bucket, "dst", None, values)
+		self.add("total", bucket, None, None, values)
@@ -0,0 +1,149 @@
+"""
+Conversion of IP addresses between strings, packed bytes and integers.
+
+Flows store IPv4 addresses as unsigned 32 bit integers. The scalar
+functions use the C implementations of inet_pton/inet_ntop and struct
+instead of splitting strings. The array functions convert whole
+columns (e.g. the rows of a fetchmany() block) at once with numpy and
+fall back to the scalar functions if numpy is not installed.
+
+IPv6 addresses are converted to and from 128 bit integers.
+"""
+
+import socket
+import struct
+
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+IPV4 = struct.Struct("!I")
+IPV6 = struct.Struct("!QQ")
+
+# prefix length -> netmask
+NETMASKS = [ (0xffffffff << (32 - n)) & 0xffffffff for n in range(33) ]
+# netmask -> prefix length
+PREFIX_LENGTHS = dict([ (mask, n) for (n, mask) in enumerate(NETMASKS) ])
+OCTET_WEIGHTS = None
+if numpy != None:
+	OCTET_WEIGHTS = numpy.array([ 1 << 24, 1 << 16, 1 << 8, 1 ], dtype=numpy.uint32)
+
+def ip2int(address):
+	"""
+	Converts a dotted quad (i.e. 10.0.0.1) to an integer. Raises
+	ValueError for other strings, including IPv6 addresses.
+	"""
+	try:
+		return IPV4.unpack(socket.inet_pton(socket.AF_INET, address))[0]
+	except (socket.error, TypeError):
+		raise ValueError("Not an IPv4 address: %r" % (address,))
+
+def int2ip(value):
+	"""
+	Converts an integer to a dotted quad.
+	"""
+	return socket.inet_ntoa(IPV4.pack(int(value)))
+
+def ip62int(address):
+	"""
+	Converts an IPv6 address to a 128 bit integer. Raises ValueError
+	for invalid addresses.
+	"""
+	try:
+		(high, low) = IPV6.unpack(socket.inet_pton(socket.AF_INET6, address))
+	except (socket.error, TypeError):
+		raise ValueError("Not an IPv6 address: %r" % (address,))
+	return (high << 64) | low
+
+def int2ip6(value):
+	"""
+	Converts a 128 bit integer to an IPv6 address.
+	"""
+	value = long(value)
+	return socket.inet_ntop(socket.AF_INET6, IPV6.pack(value >> 64, value & 0xffffffffffffffff))
+
+def any2int(address):
+	"""
+	Converts an IPv4 or IPv6 address to an integer. Returns (version,
+	integer).
+	"""
+	if ":" in address:
+		return (6, ip62int(address))
+	return (4, ip2int(address))
+
+def packed2int(value):
+	"""
+	Converts a packed address (4 or 16 bytes, e.g. from dpkt) to an
+	integer.
+	"""
+	if len(value) == 4:
+		return IPV4.unpack(value)[0]
+	(high, low) = IPV6.unpack(value)
+	return (high << 64) | low
+
+def hex2int(value):
+	"""
+	Converts a hex string with optional spaces (i.e. DE AD BE EF) to an
+	integer.
+	"""
+	return int(value.replace(" ", ""), 16)
+
+def netmask2int(netmask):
+	"""
+	Converts a netmask to its prefix length (i.e. 255.255.255.0 -> 24).
+	Non-contiguous masks are counted bit by bit.
+	"""
+	mask = ip2int(netmask)
+	length = PREFIX_LENGTHS.get(mask, None)
+	if length == None:
+		return bin(mask).count("1")
+	return length
+
+def int2netmask(length):
+	"""
+	Converts a prefix length to a netmask (i.e. 24 -> 255.255.255.0).
+	"""
+	return int2ip(NETMASKS[int(length)])
+
+def ip_range(ip, length):
+	"""
+	Returns the smallest and the biggest address of the network of
+	ip with the prefix length.
+	"""
+	mask = NETMASKS[int(length)]
+	low = int(ip) & mask
+	return (low, low | (~mask & 0xffffffff))
+
+def ip2int_array(addresses):
+	"""
+	Converts a sequence of dotted quads to a list of integers. Raises
+	ValueError if an address is invalid.
+	"""
+	if numpy == None or len(addresses) == 0:
+		return [ ip2int(address) for address in addresses ]
+	# parse all octets with a single call
+	text = ".".join(addresses)
+	# numpy also parses whitespace and signs, which inet_pton rejects
+	if not isinstance(text, str) or text.translate(None, "0123456789.") or ".." in text or text.startswith(".") or text.endswith("."):
+		return [ ip2int(address) for address in addresses ]
+	dots = text.count(".")
+	octets = numpy.fromstring(text, dtype=numpy.uint32, sep=".")
+	if len(octets) != 4 * len(addresses) or (len(octets) > 0 and octets.max() > 255) or dots != 4 * len(addresses) - 1:
+		# find the invalid address
+		return [ ip2int(address) for address in addresses ]
+	# octets with leading zeros (or so many digits that they overflow)
+	# have more characters than their values have digits
+	digits = 1 + (octets >= 10) + (octets >= 100)
+	if digits.sum() != len(text) - dots:
+		return [ ip2int(address) for address in addresses ]
+	return octets.reshape((len(addresses), 4)).dot(OCTET_WEIGHTS).astype(numpy.uint32).tolist()
+
+def int2ip_array(values):
+	"""
+	Converts a sequence of integers to a list of dotted quads.
+	"""
+	if numpy == None or len(values) == 0:
+		return [ int2ip(value) for value in values ]
+	packed = numpy.asarray(values, dtype=numpy.uint64).astype(">u4").tostring()
+	return [ socket.inet_ntoa(packed[i:i + 4]) for i in xrange(0, len(packed), 4) ]
@@ -0,0 +1,126 @@
+"""
+Adaptive load shedding for the preprocessor.
+
+Live collectors cannot pause when the preprocessor falls behind. The
+LoadShedder watches the queue length and the processing lag (wall
+clock time minus the end of the latest flow). When the preprocessor is
+overloaded it samples the flows: a flow is kept with the probability
+1/weight and its counters are multiplied by weight, so that the totals
+stay unbiased. The weight is doubled on every check that still sees an
+overload and halved once the backlog has cleared, until it is back at
+1 (no sampling).
+
+Sampling is deterministic: the decision is a hash over the 5-tuple of
+the flow, so all flows of a connection are either kept or dropped and
+flows that are kept at weight 2w are also kept at weight w.
+"""
+
+import time
+import datetime
+import hashlib
+import struct
+
+import common
+
+# field that marks flows that stand for more than one flow. holds the
+# weight of the flow
+WEIGHT = "sampleWeight"
+
+SAMPLE_FIELDS = [ common.COL_SRC_IP, common.COL_DST_IP, common.COL_SRC_PORT, common.COL_DST_PORT, common.COL_PROTO ]
+
+class LoadShedder:
+	def __init__(self, high, low, max_lag=0, max_weight=64, interval=10):
+		"""
+		:Parameters:
+		 - `high`: Queue length (flows) above which the preprocessor is overloaded.
+		 - `low`: Queue length (flows) below which the backlog has cleared.
+		 - `max_lag`: Processing lag in seconds above which the preprocessor is
+		              overloaded. 0 ignores the lag.
+		 - `max_weight`: Maximum weight (inverse sampling rate). Rounded down to a
+		                 power of two.
+		 - `interval`: Minimum number of seconds between two adaptions.
+		"""
+		self.high = high
+		self.low = low
+		self.max_lag = max_lag
+		self.max_weight = 1
+		while self.max_weight * 2 <= max_weight:
+			self.max_weight *= 2
+		self.interval = interval
+
+		self.weight = 1
+		self.since = time.time()
+		self.last_check = 0
+		self.queue_length = 0
+		self.lag = 0
+
+		# stats
+		self.kept_flows = 0
+		self.dropped_flows = 0
+		self.sampled_time = 0
+
+	def is_overloaded(self):
+		return self.queue_length > self.high or (self.max_lag > 0 and self.lag > self.max_lag)
+
+	def is_cleared(self):
+		return self.queue_length < self.low and (self.max_lag == 0 or self.lag < self.max_lag / 2)
+
+	def check(self, queue_length, lag, now=None):
+		"""
+		Adapts the weight to the current queue length and lag. Returns
+		True if the weight has changed.
+		"""
+		if now == None:
+			now = time.time()
+		if now - self.last_check < self.interval:
+			return False
+		self.last_check = now
+		self.queue_length = queue_length
+		self.lag = lag
+
+		weight = self.weight
+		if self.is_overloaded() and weight < self.max_weight:
+			weight *= 2
+		elif self.is_cleared() and weight > 1:
+			weight /= 2
+		if weight == self.weight:
+			return False
+
+		print "%s: Load shedding: sampling rate 1/%i -> 1/%i (queue length %i, lag %i s). The previous rate was active for %i s." % (
+			datetime.datetime.now(), self.weight, weight, queue_length, lag, now - self.since)
+		if self.weight > 1:
+			self.sampled_time += now - self.since
+		self.weight = weight
+		self.since = now
+		return True
+
+	def sample(self, flow):
+		"""
+		Returns the weight of flow or 0 if the flow should be dropped.
+		"""
+		if self.weight == 1:
+			self.kept_flows += 1
+			return 1
+		key = "|".join([ str(flow.get(f, None)) for f in SAMPLE_FIELDS ])
+		# do not use crc32 here. queue partitions are assigned by crc32,
+		# so its low bits are the same for all flows of a partition
+		value = struct.unpack_from("!I", hashlib.md5(key).digest())[0]
+		if value & (self.weight - 1) != 0:
+			self.dropped_flows += 1
+			return 0
+		self.kept_flows += 1
+		return self.weight
+
+	def get_stats(self):
+		sampled_time = self.sampled_time
+		if self.weight > 1:
+			sampled_time += time.time() - self.since
+		return {
+			"weight": self.weight,
+			"since": int(self.since),
+			"queue_length": self.queue_length,
+			"lag": int(self.lag),
+			"kept_flows": self.kept_flows,
+			"dropped_flows": self.dropped_flows,
+			"sampled_seconds": int(sampled_time),
+		}
@@ -0,0 +1,107 @@
+"""
+In-memory stand-in for the Redis lists that hold the flow queue.
+
+Implements the list and hash commands used by the importers, the 
+preprocessor and lib/flowqueue.py, so that they can run without a Redis
+server (e.g. in benchmarks). All commands are atomic and thread safe.
+"""
+
+import threading
+import time
+
+class MemoryRedis:
+	def __init__(self):
+		self.lists = dict()
+		self.cond = threading.Condition()
+
+	def rpush(self, key, *values):
+		with self.cond:
+			l = self.lists.setdefault(key, [])
+			l.extend(values)
+			self.cond.notify_all()
+			return len(l)
+
+	def lpush(self, key, *values):
+		with self.cond:
+			l = self.lists.setdefault(key, [])
+			l[0:0] = reversed(values)
+			self.cond.notify_all()
+			return len(l)
+
+	def llen(self, key):
+		with self.cond:
+			return len(self.lists.get(key, []))
+
+	def lrange(self, key, start, end):
+		with self.cond:
+			l = self.lists.get(key, [])
+			if end == -1:
+				return l[start:]
+			return l[start:end + 1]
+
+	def ltrim(self, key, start, end):
+		with self.cond:
+			self.lists[key] = self.lrange(key, start, end)
+			return True
+
+	def blpop(self, key, timeout=0):
+		"""
+		Returns (key, value) or None after timeout seconds (0 waits
+		forever).
+		"""
+		deadline = time.time() + timeout
+		with self.cond:
+			while len(self.lists.get(key, [])) == 0:
+				if timeout == 0:
+					self.cond.wait(1)
+				else:
+					remaining = deadline - time.time()
+					if remaining <= 0:
+						return None
+					self.cond.wait(remaining)
+			return (key, self.lists[key].pop(0))
+
+	def hmset(self, key, mapping):
+		with self.cond:
+			h = self.lists.setdefault(key, {})
+			for (field, value) in mapping.items():
+				h[field] = str(value)
+			return True
+
+	def hgetall(self, key):
+		with self.cond:
+			return dict(self.lists.get(key, {}))
+
+	def delete(self, *keys):
+		with self.cond:
+			count = 0
+			for key in keys:
+				if self.lists.pop(key, None) != None:
+					count += 1
+			return count
+
+	def pipeline(self, transaction=True):
+		return MemoryPipeline(self)
+
+
+class MemoryPipeline:
+	def __init__(self, r):
+		"""
+		Collects commands and executes them atomically in execute().
+		"""
+		self.r = r
+		self.commands = []
+
+	def __getattr__(self, name):
+		func = getattr(self.r, name)
+		def command(*args):
+			self.commands.append((func, args))
+			return self
+		return command
+
+	def execute(self):
+		# the condition is reentrant, so the commands can take it again
+		with self.r.cond:
+			result = [ func(*args) for (func, args) in self.commands ]
+		self.commands = []
+		return result
@@ -0,0 +1,432 @@
+"""
+Decoder for NetFlow v5, NetFlow v9 and IPFIX export packets.
+
+Used by the built-in collector (see importer_modules.NetflowCollector),
+which receives the packets of the exporters on a UDP socket and pushes
+the flows into the Redis queue without an intermediate flow database.
+
+NetFlow v9 and IPFIX records are described by templates that the
+exporters send from time to time. The Decoder keeps the templates per
+exporter, observation domain and template id and compiles every
+template into a struct, so that a data record is decoded with a single
+unpack. Records that arrive before their template cannot be decoded
+and are counted as missed.
+
+Only the fields of the importer flow format are decoded. Records
+without IPv4 addresses (e.g. IPv6 flows) are skipped and counted.
+
+Exported data that never reaches the collector (e.g. datagrams that the
+kernel drops while the socket buffer is full) is counted from the gaps
+in the sequence numbers of the packets: lost records for NetFlow v5 and
+IPFIX, whose sequence numbers count records, and lost packets for
+NetFlow v9, whose sequence numbers count packets.
+
+The encode functions build packets from flows. They are used by
+tools/netflow_replay.py to test the collector.
+"""
+
+import struct
+import binascii
+
+import common
+
+V5_HEADER = struct.Struct("!HHIIIIBBH")
+# srcaddr, dstaddr, dPkts, dOctets, First, Last, srcport, dstport, prot
+V5_RECORD = struct.Struct("!II4x4xIIIIHHxxBx4x2x2x")
+V5_MAX_RECORDS = 30
+V9_HEADER = struct.Struct("!HHIIII")
+IPFIX_HEADER = struct.Struct("!HHIII")
+SET_HEADER = struct.Struct("!HH")
+FIELD = struct.Struct("!HH")
+
+V9_TEMPLATE_SET = 0
+V9_OPTIONS_SET = 1
+IPFIX_TEMPLATE_SET = 2
+IPFIX_OPTIONS_SET = 3
+VARIABLE_LENGTH = 0xffff
+
+# information element -> field of the decoded record
+ELEMENTS = {
+	1: "bytes",		# octetDeltaCount
+	2: "pkts",		# packetDeltaCount
+	4: "proto",		# protocolIdentifier
+	7: "sport",		# sourceTransportPort
+	8: "src",		# sourceIPv4Address
+	11: "dport",		# destinationTransportPort
+	12: "dst",		# destinationIPv4Address
+	21: "last_up",		# flowEndSysUpTime (LAST_SWITCHED)
+	22: "first_up",		# flowStartSysUpTime (FIRST_SWITCHED)
+	85: "bytes",		# octetTotalCount
+	86: "pkts",		# packetTotalCount
+	150: "first_s",		# flowStartSeconds
+	151: "last_s",		# flowEndSeconds
+	152: "first_ms",	# flowStartMilliseconds
+	153: "last_ms",		# flowEndMilliseconds
+	160: "init_ms",		# systemInitTimeMilliseconds
+}
+INT_FORMATS = { 1: "B", 2: "H", 4: "I", 8: "Q" }
+
+def bytes_to_int(value):
+	if len(value) == 0:
+		return 0
+	return int(binascii.hexlify(value), 16)
+
+
+class Template:
+	def __init__(self, fields):
+		"""
+		:Parameters:
+		 - `fields`: List of (information element, length). Enterprise
+		             specific elements have the element None.
+		"""
+		self.fields = fields
+		self.variable = any([ length == VARIABLE_LENGTH for (element, length) in fields ])
+		self.names = []
+		# indexes of the values that have to be converted from strings
+		self.convert = []
+		formats = []
+		for (element, length) in fields:
+			name = ELEMENTS.get(element, None)
+			if name == None or length == VARIABLE_LENGTH:
+				formats.append("%ix" % (length))
+				continue
+			if length in INT_FORMATS:
+				formats.append(INT_FORMATS[length])
+			else:
+				formats.append("%is" % (length))
+				self.convert.append(len(self.names))
+			self.names.append(name)
+		if not self.variable:
+			self.record = struct.Struct("!" + "".join(formats))
+			self.size = self.record.size
+
+	def decode_records(self, data, offset, end):
+		"""
+		Returns the records (dictionaries of decoded fields) of the data
+		set between offset and end.
+		"""
+		records = []
+		if not self.variable:
+			if self.size == 0:
+				return records
+			while offset + self.size <= end:
+				values = self.record.unpack_from(data, offset)
+				offset += self.size
+				if len(self.convert) > 0:
+					values = list(values)
+					for i in self.convert:
+						values[i] = bytes_to_int(values[i])
+				records.append(dict(zip(self.names, values)))
+			return records
+
+		# records with variable length fields are parsed field by field
+		while offset < end:
+			record = dict()
+			try:
+				for (element, length) in self.fields:
+					if length == VARIABLE_LENGTH:
+						length = ord(data[offset])
+						offset += 1
+						if length == 255:
+							length = struct.unpack_from("!H", data, offset)[0]
+							offset += 2
+					if offset + length > end:
+						raise IndexError("Record exceeds its set")
+					name = ELEMENTS.get(element, None)
+					if name != None:
+						record[name] = bytes_to_int(data[offset:offset + length])
+					offset += length
+			except (IndexError, struct.error):
+				# padding at the end of the set
+				break
+			records.append(record)
+		return records
+
+
+class Decoder:
+	def __init__(self):
+		# (exporter, version, observation domain, template id) -> Template
+		self.templates = dict()
+		# stats
+		self.packets = 0
+		self.invalid_packets = 0
+		self.missed_records = 0
+		self.skipped_records = 0
+		# (exporter, version, observation domain) -> next sequence number
+		self.sequences = dict()
+		self.lost_records = 0
+		self.lost_packets = 0
+
+	def decode(self, data, exporter=None):
+		"""
+		Returns the flows of the export packet data.
+
+		:Parameters:
+		 - `data`: The UDP payload.
+		 - `exporter`: The address of the exporter. The templates of
+		               different exporters are kept apart.
+		"""
+		self.packets += 1
+		try:
+			(version,) = struct.unpack_from("!H", data)
+			if version == 5:
+				return self.decode_v5(data, exporter)
+			elif version == 9:
+				return self.decode_v9(data, exporter)
+			elif version == 10:
+				return self.decode_ipfix(data, exporter)
+		except struct.error:
+			pass
+		self.invalid_packets += 1
+		return []
+
+	def decode_packets(self, packets):
+		"""
+		Returns the flows of a list of (data, exporter).
+		"""
+		flows = []
+		for (data, exporter) in packets:
+			flows.extend(self.decode(data, exporter))
+		return flows
+
+	def check_sequence(self, source, sequence, count):
+		"""
+		Returns the number of records or packets that were lost before
+		a packet with sequence number sequence, which advances the
+		sequence number of source by count.
+		"""
+		expected = self.sequences.get(source, None)
+		self.sequences[source] = (sequence + count) & 0xffffffff
+		if expected == None:
+			return 0
+		gap = (sequence - expected) & 0xffffffff
+		# reordered packets and restarted exporters go back
+		if gap >= 0x80000000:
+			return 0
+		return gap
+
+	def decode_v5(self, data, exporter):
+		(version, count, sys_uptime, unix_secs, unix_nsecs, sequence, engine_type, engine_id, sampling) = V5_HEADER.unpack_from(data)
+		if len(data) < V5_HEADER.size + count * V5_RECORD.size:
+			self.invalid_packets += 1
+			return []
+		self.lost_records += self.check_sequence((exporter, 5, (engine_type, engine_id)), sequence, count)
+		# the flow times are milliseconds of the router uptime
+		boot_ms = unix_secs * 1000 + unix_nsecs / 1000000 - sys_uptime
+		# the upper two bits are the sampling mode
+		rate = sampling & 0x3fff
+		if rate < 1:
+			rate = 1
+
+		flows = []
+		offset = V5_HEADER.size
+		for i in xrange(count):
+			(src, dst, pkts, octets, first, last, sport, dport, proto) = V5_RECORD.unpack_from(data, offset)
+			offset += V5_RECORD.size
+			flows.append({
+				common.COL_FIRST_SWITCHED: (boot_ms + first) / 1000,
+				common.COL_LAST_SWITCHED: (boot_ms + last) / 1000,
+				common.COL_SRC_IP: src,
+				common.COL_DST_IP: dst,
+				common.COL_SRC_PORT: sport,
+				common.COL_DST_PORT: dport,
+				common.COL_PROTO: proto,
+				common.COL_PKTS: pkts * rate,
+				common.COL_BYTES: octets * rate,
+			})
+		return flows
+
+	def decode_v9(self, data, exporter):
+		(version, count, sys_uptime, unix_secs, sequence, source_id) = V9_HEADER.unpack_from(data)
+		times = (unix_secs, unix_secs * 1000 - sys_uptime)
+		self.lost_packets += self.check_sequence((exporter, 9, source_id), sequence, 1)
+		return self.decode_sets(data, V9_HEADER.size, len(data), (exporter, 9, source_id), V9_TEMPLATE_SET, times)[0]
+
+	def decode_ipfix(self, data, exporter):
+		(version, length, export_time, sequence, domain) = IPFIX_HEADER.unpack_from(data)
+		if length > len(data):
+			self.invalid_packets += 1
+			return []
+		(flows, records, complete) = self.decode_sets(data, IPFIX_HEADER.size, length, (exporter, 10, domain), IPFIX_TEMPLATE_SET, (export_time, None))
+		if complete:
+			self.lost_records += self.check_sequence((exporter, 10, domain), sequence, records)
+		else:
+			# the records of unknown templates cannot be counted
+			self.sequences.pop((exporter, 10, domain), None)
+		return flows
+
+	def decode_sets(self, data, offset, end, source, template_set, times):
+		"""
+		Returns the flows of the sets between offset and end, the number
+		of data records and whether all data sets could be decoded.
+		"""
+		flows = []
+		count = 0
+		complete = True
+		while offset + SET_HEADER.size <= end:
+			(set_id, length) = SET_HEADER.unpack_from(data, offset)
+			if length < SET_HEADER.size or offset + length > end:
+				self.invalid_packets += 1
+				break
+			if set_id == template_set:
+				self.read_templates(data, offset + SET_HEADER.size, offset + length, source, template_set == IPFIX_TEMPLATE_SET)
+			elif set_id >= 256:
+				template = self.templates.get(source + (set_id,), None)
+				if template == None:
+					# unknown template. count the set once
+					self.missed_records += 1
+					complete = False
+				else:
+					records = template.decode_records(data, offset + SET_HEADER.size, offset + length)
+					count += len(records)
+					flows.extend(self.make_flows(records, times))
+			# options templates and their data are not needed
+			offset += length
+		return (flows, count, complete)
+
+	def read_templates(self, data, offset, end, source, ipfix):
+		while offset + FIELD.size <= end:
+			(template_id, field_count) = FIELD.unpack_from(data, offset)
+			offset += FIELD.size
+			if template_id < 256:
+				# padding
+				break
+			if field_count == 0:
+				# template withdrawal
+				self.templates.pop(source + (template_id,), None)
+				continue
+			fields = []
+			for i in xrange(field_count):
+				(element, length) = FIELD.unpack_from(data, offset)
+				offset += FIELD.size
+				if ipfix and element & 0x8000:
+					# enterprise number follows
+					offset += 4
+					element = None
+				fields.append((element, length))
+			if offset > end:
+				raise struct.error("Template exceeds its set")
+			self.templates[source + (template_id,)] = Template(fields)
+
+	def make_flows(self, records, times):
+		(export_time, boot_ms) = times
+		flows = []
+		for record in records:
+			if not "src" in record or not "dst" in record:
+				self.skipped_records += 1
+				continue
+			if "first_s" in record:
+				first = record["first_s"]
+			elif "first_ms" in record:
+				first = record["first_ms"] / 1000
+			elif "first_up" in record and boot_ms != None:
+				first = (boot_ms + record["first_up"]) / 1000
+			elif "first_up" in record and "init_ms" in record:
+				first = (record["init_ms"] + record["first_up"]) / 1000
+			else:
+				first = export_time
+			if "last_s" in record:
+				last = record["last_s"]
+			elif "last_ms" in record:
+				last = record["last_ms"] / 1000
+			elif "last_up" in record and boot_ms != None:
+				last = (boot_ms + record["last_up"]) / 1000
+			elif "last_up" in record and "init_ms" in record:
+				last = (record["init_ms"] + record["last_up"]) / 1000
+			else:
+				last = export_time
+			flows.append({
+				common.COL_FIRST_SWITCHED: first,
+				common.COL_LAST_SWITCHED: last,
+				common.COL_SRC_IP: record["src"],
+				common.COL_DST_IP: record["dst"],
+				common.COL_SRC_PORT: record.get("sport", 0),
+				common.COL_DST_PORT: record.get("dport", 0),
+				common.COL_PROTO: record.get("proto", 0),
+				common.COL_PKTS: record.get("pkts", 0),
+				common.COL_BYTES: record.get("bytes", 0),
+			})
+		return flows
+
+	def get_stats(self):
+		return {
+			"packets": self.packets,
+			"invalid_packets": self.invalid_packets,
+			"missed_records": self.missed_records,
+			"skipped_records": self.skipped_records,
+			"lost_records": self.lost_records,
+			"lost_packets": self.lost_packets,
+			"templates": len(self.templates),
+		}
+
+
+########################## encoding
+TEMPLATE_ID = 256
+# (information element, length, flow field) of the template of the
+# encoded v9 and IPFIX packets. v9 uses the uptime fields for the times
+V9_FIELDS = [ (8, 4, common.COL_SRC_IP), (12, 4, common.COL_DST_IP), (7, 2, common.COL_SRC_PORT), (11, 2, common.COL_DST_PORT), (4, 1, common.COL_PROTO), (2, 8, common.COL_PKTS), (1, 8, common.COL_BYTES), (22, 4, common.COL_FIRST_SWITCHED), (21, 4, common.COL_LAST_SWITCHED) ]
+IPFIX_FIELDS = V9_FIELDS[:-2] + [ (150, 4, common.COL_FIRST_SWITCHED), (151, 4, common.COL_LAST_SWITCHED) ]
+TEMPLATE_RECORD = struct.Struct("!" + "".join([ INT_FORMATS[length] for (element, length, field) in V9_FIELDS ]))
+
+def encode_v5(flows, sequence=0, now=None):
+	"""
+	Returns a NetFlow v5 packet of up to 30 flows. The router uptime
+	is set to the start of the earliest flow and the export time now
+	defaults to the latest flow end.
+	"""
+	if now == None:
+		now = max([ flow[common.COL_LAST_SWITCHED] for flow in flows ])
+	boot = min([ flow[common.COL_FIRST_SWITCHED] for flow in flows ])
+	parts = [ V5_HEADER.pack(5, len(flows), (now - boot) * 1000, now, 0, sequence, 0, 0, 0) ]
+	for flow in flows:
+		parts.append(V5_RECORD.pack(flow[common.COL_SRC_IP], flow[common.COL_DST_IP],
+			flow[common.COL_PKTS], flow[common.COL_BYTES],
+			(flow[common.COL_FIRST_SWITCHED] - boot) * 1000, (flow[common.COL_LAST_SWITCHED] - boot) * 1000,
+			flow[common.COL_SRC_PORT], flow[common.COL_DST_PORT], flow[common.COL_PROTO]))
+	return "".join(parts)
+
+def encode_template_records(flows, fields, boot):
+	parts = []
+	for flow in flows:
+		values = [ flow[field] for (element, length, field) in fields ]
+		if boot != None:
+			# uptime milliseconds
+			values[-2] = (values[-2] - boot) * 1000
+			values[-1] = (values[-1] - boot) * 1000
+		parts.append(TEMPLATE_RECORD.pack(*values))
+	return "".join(parts)
+
+def encode_set(set_id, body):
+	return SET_HEADER.pack(set_id, SET_HEADER.size + len(body)) + body
+
+def encode_template(fields):
+	return FIELD.pack(TEMPLATE_ID, len(fields)) + "".join([ FIELD.pack(element, length) for (element, length, field) in fields ])
+
+def encode_v9(flows, sequence=0, source_id=0, template=True, now=None):
+	"""
+	Returns a NetFlow v9 packet of flows. If template is True, the
+	packet starts with the template.
+	"""
+	if now == None:
+		now = max([ flow[common.COL_LAST_SWITCHED] for flow in flows ])
+	boot = min([ flow[common.COL_FIRST_SWITCHED] for flow in flows ])
+	sets = []
+	if template:
+		sets.append(encode_set(V9_TEMPLATE_SET, encode_template(V9_FIELDS)))
+	sets.append(encode_set(TEMPLATE_ID, encode_template_records(flows, V9_FIELDS, boot)))
+	count = len(flows) + (1 if template else 0)
+	return V9_HEADER.pack(9, count, (now - boot) * 1000, now, sequence, source_id) + "".join(sets)
+
+def encode_ipfix(flows, sequence=0, domain=0, template=True, now=None):
+	"""
+	Returns an IPFIX message of flows. If template is True, the message
+	starts with the template.
+	"""
+	if now == None:
+		now = max([ flow[common.COL_LAST_SWITCHED] for flow in flows ])
+	sets = []
+	if template:
+		sets.append(encode_set(IPFIX_TEMPLATE_SET, encode_template(IPFIX_FIELDS)))
+	sets.append(encode_set(TEMPLATE_ID, encode_template_records(flows, IPFIX_FIELDS, None)))
+	body = "".join(sets)
+	return IPFIX_HEADER.pack(10, IPFIX_HEADER.size + len(body), now, sequence, domain) + body
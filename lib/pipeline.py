@@ -0,0 +1,213 @@
+"""
+Pipeline stages of the preprocessor.
+
+The preprocessor reads flows from Redis, slices them into buckets and
+writes the documents to the backend. With the classes in this module
+each of these stages runs in its own thread:
+
+	- QueueReader drains the Redis queue into a bounded buffer
+	- the main thread decodes and slices the flows
+	- BackendWriter executes the backend writes
+
+Both buffers are bounded. If the backend cannot keep up, the main
+thread blocks when it submits writes, which stops it from taking
+entries out of the read buffer, which in turn stops the reader.
+SyncReader and SyncWriter do the same work in the calling thread.
+"""
+
+import sys
+import threading
+import Queue
+
+import flowqueue
+
+class SyncReader:
+	def __init__(self, r, key, drain_size):
+		self.r = r
+		self.key = key
+		self.drain_size = drain_size
+
+	def poll(self):
+		"""
+		Returns the next entries of the queue or an empty list if the
+		queue is empty.
+		"""
+		return flowqueue.drain(self.r, self.key, self.drain_size)
+
+	def wait(self, timeout=0):
+		"""
+		Blocks until there are new entries (at most timeout seconds, 0
+		waits forever). Returns an empty list on timeout.
+		"""
+		obj = flowqueue.wait(self.r, self.key, timeout)
+		if obj == None:
+			return []
+		return [ obj ]
+
+	def close(self):
+		"""
+		Stops reading and returns the entries that have been read but
+		not been returned by poll() or wait().
+		"""
+		return []
+
+
+class QueueReader(threading.Thread):
+	def __init__(self, r, key, drain_size, size):
+		"""
+		:Parameters:
+		 - `size`: Maximum number of drained blocks in the buffer.
+		"""
+		threading.Thread.__init__(self)
+		self.daemon = True
+		self.r = r
+		self.key = key
+		self.drain_size = drain_size
+		self.buffer = Queue.Queue(size)
+		self.stopping = threading.Event()
+		# entries that could not be put into the buffer before close()
+		self.leftover = []
+		self.start()
+
+	def run(self):
+		while not self.stopping.is_set():
+			entries = flowqueue.drain(self.r, self.key, self.drain_size)
+			if len(entries) == 0:
+				# wake up regularly to check whether we should stop
+				obj = flowqueue.wait(self.r, self.key, 1)
+				if obj == None:
+					continue
+				entries = [ obj ]
+
+			# entries behind END belong to the next run
+			end = "END" in entries
+			if end:
+				pos = entries.index("END")
+				flowqueue.push_back(self.r, self.key, entries[pos + 1:])
+				entries = entries[:pos + 1]
+
+			while True:
+				try:
+					self.buffer.put(entries, True, 1)
+					break
+				except Queue.Full:
+					if self.stopping.is_set():
+						self.leftover = entries
+						return
+			if end:
+				return
+
+	def poll(self):
+		try:
+			return self.buffer.get_nowait()
+		except Queue.Empty:
+			return []
+
+	def wait(self, timeout=0):
+		try:
+			if timeout == 0:
+				# Queue.get() without timeout cannot be interrupted by Ctrl-C
+				while True:
+					try:
+						return self.buffer.get(True, 1)
+					except Queue.Empty:
+						pass
+			return self.buffer.get(True, timeout)
+		except Queue.Empty:
+			return []
+
+	def close(self):
+		self.stopping.set()
+		entries = []
+		while self.is_alive():
+			# unblock the reader if it waits for free space
+			entries += self.poll()
+			self.join(0.1)
+		entries += self.poll()
+		return entries + self.leftover
+
+
+class SyncWriter:
+	def submit(self, func, *args):
+		func(*args)
+
+	def sync(self):
+		pass
+
+	def close(self):
+		pass
+
+
+class BackendWriter(threading.Thread):
+	def __init__(self, size):
+		"""
+		Executes backend operations in submission order in a separate
+		thread.
+
+		:Parameters:
+		 - `size`: Maximum number of pending operations. submit() blocks
+		           as soon as it is reached.
+		"""
+		threading.Thread.__init__(self)
+		self.daemon = True
+		self.ops = Queue.Queue(size)
+		self.error = None
+		self.start()
+
+	def run(self):
+		while True:
+			op = self.ops.get()
+			try:
+				if op == None:
+					return
+				if self.error == None:
+					(func, args) = op
+					func(*args)
+			except Exception, e:
+				# drop all further operations. the error is raised
+				# in the main thread
+				print >> sys.stderr, "Backend write failed: %s" % (e)
+				self.error = e
+			finally:
+				self.ops.task_done()
+
+	def check(self):
+		if self.error != None:
+			raise Exception("Backend writer failed: %s" % (self.error))
+
+	def submit(self, func, *args):
+		self.check()
+		self.ops.put((func, args))
+
+	def sync(self):
+		"""
+		Waits until all submitted operations have been executed.
+		"""
+		self.ops.join()
+		self.check()
+
+	def close(self):
+		self.ops.put(None)
+		self.join()
+		self.check()
+
+
+class WriterCollection:
+	def __init__(self, collection, writer):
+		"""
+		Collection wrapper that passes the writes of the preprocessor to
+		a writer. Documents must not be modified after they have been
+		passed to update().
+		"""
+		self.collection = collection
+		self.writer = writer
+		self.name = collection.name
+
+	def createIndex(self, fieldName):
+		self.writer.submit(self.collection.createIndex, fieldName)
+
+	def update(self, statement, document, insertIfNotExist=False, comes_from_cache=False):
+		self.writer.submit(self.collection.update, statement, document, insertIfNotExist, comes_from_cache)
+
+	def flushCache(self, collectionName=None):
+		self.writer.submit(self.collection.flushCache, collectionName)
@@ -0,0 +1,163 @@
+"""
+Compiled registry of the known (IANA assigned) ports.
+
+Parsing the IANA service-names-port-numbers.xml takes seconds. The
+registry is therefore compiled once into a small binary file, which
+holds one bitmap over all 65536 ports per protocol. The preprocessor
+memory-maps the file and tests single bits, so lookups are O(1).
+
+File format (version 1):
+	magic "PORTREG", version (B), number of bitmaps (B)
+	one protocol number (B) per bitmap
+	the bitmaps, 8192 bytes each. Bit (port % 8) of byte (port / 8)
+	is set if the port is known for the protocol
+
+Ports of protocols other than tcp and udp (e.g. sctp) are stored under
+protocol 0. Flows of other protocols never have known ports.
+"""
+
+import os
+import mmap
+import struct
+
+MAGIC = "PORTREG"
+VERSION = 1
+HEADER = struct.Struct("!7sBB")
+BITMAP_SIZE = 65536 / 8
+
+# protocols with a bitmap of their own. all other protocols are 0
+PROTOCOLS = [ 6, 17, 0 ]
+
+def parse_xml(filename):
+	"""
+	Parses the IANA xml file and returns a dictionary of port number
+	and list of protocols.
+	"""
+	import xml.dom.minidom
+	f = open(filename, "r")
+	dom = xml.dom.minidom.parse(f)
+	f.close()
+
+	def getDomText(node):
+		rc = []
+		for n in node.childNodes:
+			if n.nodeType == node.TEXT_NODE:
+				rc.append(n.data)
+		return ''.join(rc)
+
+	known_ports = dict()
+	records = dom.getElementsByTagName("record")
+	for record in records:
+		description = record.getElementsByTagName("description")
+		if len(description) > 0 and getDomText(description[0]) == "Unassigned":
+			continue
+		number = record.getElementsByTagName("number")
+		if len(number) == 0:
+			continue
+		numbers = getDomText(number[0]).split('-')
+		number = int(numbers[0])
+		number_to = int(numbers[len(numbers)-1])
+
+		protocol = record.getElementsByTagName("protocol")
+		if len(protocol) > 0:
+			protocol = getDomText(protocol[0])
+			if protocol == "tcp":
+				protocol = 6
+			elif protocol == "udp":
+				protocol = 17
+			else:
+				protocol = 0
+		else:
+			protocol = 0
+
+		while number <= number_to:
+			if number in known_ports:
+				known_ports[number].append(protocol)
+			else:
+				known_ports[number] = [protocol]
+			number += 1
+	return known_ports
+
+def compile(xml_file, registry_file):
+	"""
+	Writes the compiled registry for xml_file to registry_file.
+	"""
+	bitmaps = dict([ (proto, bytearray(BITMAP_SIZE)) for proto in PROTOCOLS ])
+	for port, protocols in parse_xml(xml_file).iteritems():
+		for proto in protocols:
+			bitmaps[proto][port >> 3] |= 1 << (port & 7)
+
+	# write to a temporary file first. concurrent preprocessors must
+	# never map a partially written registry
+	tmp_file = "%s.%i.tmp" % (registry_file, os.getpid())
+	f = open(tmp_file, "wb")
+	f.write(HEADER.pack(MAGIC, VERSION, len(PROTOCOLS)))
+	f.write("".join([ chr(proto) for proto in PROTOCOLS ]))
+	for proto in PROTOCOLS:
+		f.write(str(bitmaps[proto]))
+	f.close()
+	os.rename(tmp_file, registry_file)
+
+
+class PortRegistry:
+	def __init__(self, registry_file):
+		"""
+		Memory-maps a compiled registry (see compile()).
+		"""
+		f = open(registry_file, "rb")
+		try:
+			self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+		finally:
+			f.close()
+
+		if len(self.data) < HEADER.size:
+			raise Exception("Port registry " + registry_file + " is truncated")
+		(magic, version, count) = HEADER.unpack_from(self.data)
+		if magic != MAGIC or version != VERSION:
+			raise Exception("Port registry " + registry_file + " has an unsupported format")
+		if len(self.data) != HEADER.size + count + count * BITMAP_SIZE:
+			raise Exception("Port registry " + registry_file + " is truncated")
+
+		# protocol -> offset of its bitmap
+		self.offsets = dict()
+		for i in range(count):
+			proto = ord(self.data[HEADER.size + i])
+			self.offsets[proto] = HEADER.size + count + i * BITMAP_SIZE
+		self.any = [ self.offsets[proto] for proto in sorted(self.offsets) ]
+
+	def is_set(self, offset, port):
+		return ord(self.data[offset + (port >> 3)]) & (1 << (port & 7)) != 0
+
+	def is_known(self, port, proto=-1):
+		"""
+		Returns whether port is a known port of proto. -1 accepts the
+		port for any protocol.
+		"""
+		if port == None or port < 0 or port > 65535:
+			return False
+		if proto == -1:
+			for offset in self.any:
+				if self.is_set(offset, port):
+					return True
+			return False
+		offset = self.offsets.get(proto, None)
+		if offset == None:
+			return False
+		return self.is_set(offset, port)
+
+
+def load(xml_file, registry_file):
+	"""
+	Returns the registry for xml_file. The registry is (re)compiled if
+	registry_file does not exist or is older than xml_file. If the
+	registry cannot be written, it is compiled to a temporary file.
+	"""
+	if not os.path.exists(registry_file) or os.path.getmtime(registry_file) < os.path.getmtime(xml_file):
+		try:
+			compile(xml_file, registry_file)
+		except (IOError, OSError):
+			import tempfile
+			(fd, registry_file) = tempfile.mkstemp(suffix=".portreg")
+			os.close(fd)
+			compile(xml_file, registry_file)
+	return PortRegistry(registry_file)
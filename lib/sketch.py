@@ -0,0 +1,235 @@
+"""
+Heavy-hitter sketches for the node and port indexes.
+
+The index collections hold one row per IP address or port and bucket.
+When the network is scanned, they grow with the number of distinct
+addresses and a top-N query has to group and sort all of these rows.
+The preprocessor therefore additionally keeps one Space-Saving sketch
+(Metwally et al.) of bounded size per bucket and counter (bytes, pkts,
+flows). The sketches are written as small binary blobs. Sketches of
+several buckets can be merged, so that the heavy hitters of any time
+range are found by merging a fixed number of blobs per bucket.
+
+Every key whose share of the total is larger than 1/capacity is
+guaranteed to be in a sketch. The counts of a sketch overestimate the
+true counts by at most the error of the entry.
+
+Blob format (version 1):
+	version (B), capacity (H), number of entries (H), total (d)
+	entries: key (Q), count (d), error (d)
+None (e.g. unknown ports) is stored as key 0xffffffffffffffff.
+"""
+
+import heapq
+import struct
+
+import common
+from bucketaggregator import BucketAggregator
+
+VERSION = 1
+HEADER = struct.Struct("!BHHd")
+ENTRY = struct.Struct("!Qdd")
+NONE_KEY = 0xffffffffffffffff
+
+class SpaceSaving:
+	def __init__(self, capacity):
+		"""
+		:Parameters:
+		 - `capacity`: Maximum number of keys that are counted.
+		"""
+		self.capacity = capacity
+		self.counts = dict()
+		self.errors = dict()
+		# min-heap of (count, key). counts only grow, so entries may be
+		# lower than the current count. they are repaired in pop_min()
+		self.heap = []
+		self.total = 0
+
+	def __len__(self):
+		return len(self.counts)
+
+	def is_full(self):
+		return len(self.counts) >= self.capacity
+
+	def pop_min(self):
+		"""
+		Removes the key with the smallest count and returns (count, key).
+		"""
+		while True:
+			(count, key) = heapq.heappop(self.heap)
+			current = self.counts[key]
+			if current == count:
+				del self.counts[key]
+				del self.errors[key]
+				return (count, key)
+			heapq.heappush(self.heap, (current, key))
+
+	def min_count(self):
+		"""
+		Returns the smallest count if the sketch is full, else 0. Keys
+		that are not in the sketch occurred at most this often.
+		"""
+		if not self.is_full():
+			return 0
+		while True:
+			(count, key) = self.heap[0]
+			current = self.counts[key]
+			if current == count:
+				return count
+			heapq.heapreplace(self.heap, (current, key))
+
+	def add(self, key, value=1):
+		self.total += value
+		if key in self.counts:
+			self.counts[key] += value
+			return
+		error = 0
+		if self.is_full():
+			# the new key takes over the count of the evicted one
+			(error, evicted) = self.pop_min()
+		self.counts[key] = error + value
+		self.errors[key] = error
+		heapq.heappush(self.heap, (error + value, key))
+
+	def merge(self, other):
+		"""
+		Adds the counts of other. Keys that are missing in a full sketch
+		are estimated with its smallest count.
+		"""
+		self_min = self.min_count()
+		other_min = other.min_count()
+		counts = dict()
+		errors = dict()
+		for key in set(self.counts) | set(other.counts):
+			counts[key] = self.counts.get(key, self_min) + other.counts.get(key, other_min)
+			errors[key] = self.errors.get(key, self_min) + other.errors.get(key, other_min)
+
+		keys = sorted(counts, key=counts.get, reverse=True)[:self.capacity]
+		self.counts = dict([ (key, counts[key]) for key in keys ])
+		self.errors = dict([ (key, errors[key]) for key in keys ])
+		self.heap = [ (count, key) for (key, count) in self.counts.iteritems() ]
+		heapq.heapify(self.heap)
+		self.total += other.total
+
+	def top(self, n):
+		"""
+		Returns up to n (key, count, error) of the largest counts.
+		"""
+		keys = sorted(self.counts, key=self.counts.get, reverse=True)[:n]
+		return [ (key, self.counts[key], self.errors[key]) for key in keys ]
+
+	def serialize(self):
+		parts = [ HEADER.pack(VERSION, self.capacity, len(self.counts), self.total) ]
+		for key, count in self.counts.iteritems():
+			if key == None:
+				packed_key = NONE_KEY
+			else:
+				packed_key = key
+			parts.append(ENTRY.pack(packed_key, count, self.errors[key]))
+		return "".join(parts)
+
+
+def deserialize(data):
+	"""
+	Returns the SpaceSaving sketch of a blob written by serialize().
+	"""
+	data = str(data)
+	(version, capacity, count, total) = HEADER.unpack_from(data)
+	if version != VERSION:
+		raise ValueError("Unsupported sketch version %i" % (version))
+	if len(data) != HEADER.size + count * ENTRY.size:
+		raise ValueError("Sketch is truncated")
+	sketch = SpaceSaving(capacity)
+	sketch.total = total
+	offset = HEADER.size
+	for i in range(count):
+		(key, value, error) = ENTRY.unpack_from(data, offset)
+		offset += ENTRY.size
+		if key == NONE_KEY:
+			key = None
+		sketch.counts[key] = value
+		sketch.errors[key] = error
+	sketch.heap = [ (value, key) for (key, value) in sketch.counts.iteritems() ]
+	heapq.heapify(sketch.heap)
+	return sketch
+
+def merge_docs(docs, field):
+	"""
+	Merges the sketches of field in the sketch documents docs (see
+	SketchAggregator.get_values()). Returns None if there is no sketch.
+	"""
+	merged = None
+	for doc in docs:
+		if not field in doc:
+			continue
+		sketch = deserialize(doc[field])
+		if merged == None:
+			merged = sketch
+		else:
+			merged.merge(sketch)
+	return merged
+
+
+class SketchAggregator(BucketAggregator):
+	def __init__(self, collection, aggr_sum, capacity):
+		"""
+		Keeps one sketch per bucket and counter until the bucket is
+		closed (see bucketaggregator.py).
+
+		:Parameters:
+		 - `collection`: The sketch collection.
+		 - `aggr_sum`: A list of keys which will be summed up.
+		 - `capacity`: Number of keys per sketch.
+		"""
+		BucketAggregator.__init__(self, collection)
+		self.aggr_sum = aggr_sum
+		self.fields = aggr_sum + [ common.COL_FLOWS ]
+		self.capacity = capacity
+
+	def get_keys(self, obj):
+		raise Exception("Derived class did not implement get_keys!")
+
+	def create_state(self):
+		return [ SpaceSaving(self.capacity) for f in self.fields ]
+
+	def add_flow(self, obj):
+		sketches = self.get_state((obj[common.COL_BUCKET],))
+		values = [ obj.get(s, 0) for s in self.aggr_sum ]
+		values.append(obj.get(common.COL_FLOWS, 1))
+		for key in self.get_keys(obj):
+			for i, sketch in enumerate(sketches):
+				sketch.add(key, values[i])
+
+	def get_values(self, key, sketches):
+		# one blob per counter
+		values = { common.COL_BUCKET: key[0] }
+		for i, field in enumerate(self.fields):
+			values[field] = sketches[i].serialize()
+		return values
+
+
+class NodeSketchAggregator(SketchAggregator):
+	def get_keys(self, obj):
+		# the node index counts both endpoints
+		return [ obj[common.COL_SRC_IP], obj[common.COL_DST_IP] ]
+
+
+class PortSketchAggregator(SketchAggregator):
+	def __init__(self, collection, aggr_sum, capacity, filter_ports):
+		"""
+		:Parameters:
+		 - `filter_ports`: A registry of known ports (see portregistry.py) to remove unknown ports
+		"""
+		SketchAggregator.__init__(self, collection, aggr_sum, capacity)
+		self.filter_ports = filter_ports
+
+	def get_keys(self, obj):
+		keys = []
+		proto = int(obj.get(common.COL_PROTO, -1))
+		for field in [ common.COL_SRC_PORT, common.COL_DST_PORT ]:
+			port = obj.get(field, None)
+			# set unknown ports to None, as the port index does
+			if self.filter_ports and port != None and not self.filter_ports.is_known(port, proto):
+				port = None
+			keys.append(port)
+		return keys
@@ -15,7 +15,9 @@ sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lib'))
 
 import math
 import time
+import copy
 import argparse
+import multiprocessing
 import datetime
 import redis
 import json
@@ -23,13 +25,9 @@ import json
 import common
 import config
 import importer_modules
-
-######### functions
-
-
-######### main
-
-
+import flowqueue
+import flowrecord
+import checkpoint
 
 parser = argparse.ArgumentParser(description="Import IPFIX flows from MySQL or PostgreSQL Vermont format into the Redis buffer for preprocessing")
 parser.add_argument("--src-host", nargs="?", default=config.flowDBHost, help="MySQL or PostgreSQL host")
@@ -40,64 +38,263 @@ parser.add_argument("--src-database", nargs="?", default=config.flowDBName, help
 parser.add_argument("--dst-host", nargs="?", default="127.0.0.1", help="Redis host")
 parser.add_argument("--dst-port", nargs="?", default=6379, type=int, help="Redis port")
 parser.add_argument("--dst-database", nargs="?", default=0, type=int, help="Redis database")
-parser.add_argument("--max-queue", nargs="?", type=int, default=100000, help="The maximum queue length before the import will sleep.")
+parser.add_argument("--max-queue", nargs="?", type=int, default=100000, help="The maximum queue length in flows. The import waits while a queue is longer. The NetFlow collector never waits, the load shedding of the preprocessor (--overload) handles its backlog.")
+parser.add_argument("--target-lag", nargs="?", type=int, default=30, help="Seconds of work the queue should hold for the preprocessor. The import is paced by the measured drain rate so that the queue stays near this lag. 0 only enforces --max-queue.")
 parser.add_argument("--clear-queue", nargs="?", type=bool, default=False, const=True, help="Whether to clear the queue before importing the flows.")
 parser.add_argument("--legacy-vermont", nargs="?", type=bool, default=False, const=True, help="Whether the old legacy VERMONT format should be used")
 parser.add_argument("--bro-conn-log", nargs="?", type=bool, default=False, const=True, help="Import files from bro connection logs. If set, --conn-file must be defined.")
 parser.add_argument("--argus-db", nargs="?", type=bool, default=False, const=True, help="Import files from argus rasqlinsert")
-parser.add_argument("--conn-file", nargs="?", default=None, help="Bro Connection log file. Preprocess will only evaulate this log if --bro-conn-log is set.")
+parser.add_argument("--netflow-collector", nargs="?", type=bool, default=False, const=True, help="Receive NetFlow v5/v9 and IPFIX packets on UDP --listen-port instead of importing from a database. Runs until interrupted or --idle-timeout.")
+parser.add_argument("--listen-host", nargs="?", default="0.0.0.0", help="Address the NetFlow/IPFIX collector listens on.")
+parser.add_argument("--listen-port", nargs="?", type=int, default=4739, help="UDP port of the NetFlow/IPFIX collector.")
+parser.add_argument("--idle-timeout", nargs="?", type=int, default=0, help="Stop the NetFlow/IPFIX collector after this many seconds without packets. 0 runs until interrupted.")
+parser.add_argument("--conn-file", nargs="?", default=None, help="Bro Connection log file (can be gzip compressed) or a directory of conn*.log[.gz] files. Preprocess will only evaulate this log if --bro-conn-log is set.")
+parser.add_argument("--pcap-import", nargs="?", type=bool, default=False, const=True, help="Aggregate the packets of pcap files into flows. If set, --pcap-file must be defined.")
+parser.add_argument("--pcap-file", nargs="?", default=None, help="pcap file (can be gzip compressed) or a directory of .pcap/.cap files.")
+parser.add_argument("--flow-idle-timeout", nargs="?", type=int, default=30, help="pcap import: seconds without packets after which a flow expires.")
+parser.add_argument("--flow-active-timeout", nargs="?", type=int, default=300, help="pcap import: seconds after which a long flow expires and a new one starts.")
+parser.add_argument("--max-flows", nargs="?", type=int, default=1000000, help="pcap import: maximum number of flows in the flow table. The least recently seen flows expire early when the table is full.")
 parser.add_argument("--table-name", nargs="?", default=None, help="Table name to import from SQL database.")
+parser.add_argument("--fetch-size", nargs="?", type=int, default=1000, help="Number of rows that are fetched from the SQL database at once.")
+parser.add_argument("--queue-format", nargs="?", default=getattr(config, "queue_format", "binary"), choices=["json", "binary"], help="Encoding of the flows in the queue. Binary entries hold up to --queue-batch flows.")
+parser.add_argument("--queue-batch", nargs="?", type=int, default=100, help="Number of flows per binary queue entry.")
+parser.add_argument("--partitions", nargs="?", type=int, default=1, help="Number of queue partitions. Flows are distributed by their aggregation values. Must match the --partitions setting of the preprocessor.")
+parser.add_argument("--checkpoint", nargs="?", default=None, help="Name of a checkpoint in Redis. Tables that a previous run with the same checkpoint imported completely are skipped, the newest table is continued after its last imported row.")
+parser.add_argument("--reset-checkpoint", nargs="?", type=bool, default=False, const=True, help="Clear the --checkpoint and import all tables again.")
+parser.add_argument("--workers", nargs="?", type=int, default=1, help="Number of processes that import SQL tables, Bro log files or pcap files in parallel. Each process imports one table or file at a time. Flows are only in order within a table or file.")
+
+def get_importer_type(args):
+	if args.legacy_vermont:
+		return "legacy-vermont-db"
+	elif args.bro_conn_log:
+		return "bro-importer"
+	elif args.argus_db:
+		return "argus-importer"
+	elif args.netflow_collector:
+		return "netflow-collector"
+	elif args.pcap_import:
+		return "pcap-importer"
+	return "vermont-db"
+
+def connect_redis(args):
+	try:
+		return redis.Redis(host=args.dst_host, port=args.dst_port, db=args.dst_database)
+	except Exception, e:
+		print >> sys.stderr, "Could not connect to Redis database: ", e
+		sys.exit(1)
+
+def push_entries(control, r, entries, store=None, states=None):
+	"""
+	Appends the entries (dictionary of queue key and list of entries) 
+	with one pipeline once the flow control admits it. The checkpoint
+	states of the entries are saved in store with the same pipeline.
+	"""
+	if len(entries) == 0 and not states:
+		return
+	control.wait()
+	pipe = r.pipeline(transaction=False)
+	queue_keys = entries.keys()
+	for queue_key in queue_keys:
+		pipe.rpush(queue_key, *entries[queue_key])
+	if states:
+		store.save(pipe, states)
+	queue_lengths = pipe.execute()
+
+	for queue_key, queue_length in zip(queue_keys, queue_lengths):
+		control.update(queue_key, queue_length, len(entries[queue_key]))
+	report = control.report()
+	if report != None:
+		print "%s: %s" % (datetime.datetime.now(), report)
+
+def import_flows(args, importer, r, queue_keys, store=None):
+	"""
+	Pushes all flows of importer into the queues. Returns the number of
+	flows. If store is set, the checkpoint of the importer is saved 
+	after every block.
+	"""
+	encoders = None
+	if args.queue_format == "binary":
+		if flowrecord.covers(config.flow_aggr_values + config.flow_aggr_sums):
+			encoders = dict([ (queue_key, flowrecord.Encoder(args.queue_batch)) for queue_key in queue_keys ])
+		else:
+			print >> sys.stderr, "The binary record format does not contain all fields of flow_aggr_values and flow_aggr_sums. Using JSON ..."
+
+	# binary entries are counted with --queue-batch flows
+	scale = 1
+	if encoders != None:
+		scale = args.queue_batch
+	control = flowqueue.FlowControl(r, args.max_queue, args.target_lag, scale, pace=importer.can_wait)
+
+	count = 0
+	while True:
+		flows = importer.get_next_flows()
+		if flows == None:
+			break;
+
+		entries = dict()
+		for flow in flows:
+			if args.partitions > 1:
+				queue_key = queue_keys[flowqueue.partition(flow, config.flow_aggr_values, args.partitions)]
+			else:
+				queue_key = common.REDIS_QUEUE_KEY
+
+			count += 1
+			if encoders == None:
+				entries.setdefault(queue_key, []).append(json.dumps(flow))
+				continue
+			encoder = encoders[queue_key]
+			if encoder.add(flow):
+				if encoder.is_full():
+					entries.setdefault(queue_key, []).append(encoder.flush())
+			else:
+				# keep the order of the flows: write the pending records 
+				# before the flow that does not fit into the schema
+				entries.setdefault(queue_key, []).extend([ e for e in [ encoder.flush(), json.dumps(flow) ] if e != None ])
+
+		states = None
+		if store != None:
+			# a checkpoint must not cover flows that wait in the encoders
+			states = importer.get_checkpoint()
+			flush_encoders(encoders, entries)
+		push_entries(control, r, entries, store, states)
+		export_stats(importer, r)
+
+	# write the flows of incomplete binary entries
+	entries = dict()
+	flush_encoders(encoders, entries)
+	states = None
+	if store != None:
+		states = importer.get_checkpoint()
+	push_entries(control, r, entries, store, states)
+	return count
+
+def export_stats(importer, r):
+	"""
+	Writes the counters of the importer (e.g. the packets lost by the
+	exporters of the collector) to the Redis hash <queue key>:importer.
+	"""
+	stats = importer.get_stats()
+	if stats == None:
+		return
+	try:
+		r.hmset(common.REDIS_QUEUE_KEY + ":importer", stats)
+	except Exception, e:
+		print >> sys.stderr, "Could not export the importer counters: %s" % (e)
+
+def flush_encoders(encoders, entries):
+	"""
+	Appends the incomplete binary entries of encoders to entries.
+	"""
+	if encoders == None:
+		return
+	for (queue_key, encoder) in encoders.iteritems():
+		entry = encoder.flush()
+		if entry != None:
+			entries.setdefault(queue_key, []).append(entry)
+
+def import_table(task):
+	"""
+	Entry point of the worker processes in parallel mode. Imports a
+	single part (table or log file) with its own source and Redis
+	connection.
+	"""
+	(args, queue_keys, part) = task
+	args = copy.copy(args)
+	importer_type = get_importer_type(args)
+	if importer_type == "bro-importer":
+		args.conn_file = part
+	elif importer_type == "pcap-importer":
+		args.pcap_file = part
+	else:
+		args.table_name = part
+	start = time.time()
+	importer = importer_modules.get_importer_module(importer_type, args)
+	r = connect_redis(args)
+	store = None
+	if args.checkpoint:
+		store = checkpoint.CheckpointStore(r, args.checkpoint)
+		importer.set_checkpoints(store.load())
+	count = import_flows(args, importer, r, queue_keys, store)
+	importer.close()
+	return (part, count, time.time() - start)
+
+def import_parallel(args, queue_keys, parts):
+	"""
+	Imports the parts with a pool of --workers processes. Returns the
+	number of flows.
+	"""
+	pool = multiprocessing.Pool(args.workers)
+	count = 0
+	try:
+		tasks = [ (args, queue_keys, part) for part in parts ]
+		for i, (part, part_count, seconds) in enumerate(pool.imap_unordered(import_table, tasks)):
+			count += part_count
+			print "%s: imported %s: %i flows in %.1f s (%i of %i parts done)" % (datetime.datetime.now(), part, part_count, seconds, i + 1, len(parts))
+	except:
+		pool.terminate()
+		pool.join()
+		raise
+	pool.close()
+	pool.join()
+	return count
+
+
+if __name__ == "__main__":
+	args = parser.parse_args()
+
+	r = connect_redis(args)
+	if args.partitions > 1:
+		queue_keys = [ flowqueue.partition_key(common.REDIS_QUEUE_KEY, i) for i in range(args.partitions) ]
+	else:
+		queue_keys = [ common.REDIS_QUEUE_KEY ]
+
+	if args.clear_queue:
+		r.delete(*queue_keys)
+
+	importer_type = get_importer_type(args)
+	if importer_type == "legacy-vermont-db":
+		print "Importing data from legacy VERMONT db ..."
+	elif importer_type == "bro-importer":
+		print "Importing data from Bro connection logs ..."
+	elif importer_type == "argus-importer":
+		print "Importing data from Argus MYSQL db ..."
+	elif importer_type == "pcap-importer":
+		print "Importing packets from pcap files ..."
+	elif importer_type == "netflow-collector":
+		print "Collecting NetFlow/IPFIX packets on %s:%i ..." % (args.listen_host, args.listen_port)
+	else:
+		print "Importing data from VERMONT DB ..."
+	importer = importer_modules.get_importer_module(importer_type, args)
+
+	store = None
+	if args.checkpoint:
+		store = checkpoint.CheckpointStore(r, args.checkpoint)
+		if args.reset_checkpoint:
+			store.clear()
+		importer.set_checkpoints(store.load())
+
+	startTime = datetime.datetime.now()
+	print "%s: connected to source and destination database" % (startTime)
+
+	print "Starting to import flows ..."
+	if args.workers > 1:
+		parts = importer.get_parts()
+		importer.close()
+		if parts == None:
+			print >> sys.stderr, "--workers is not supported by this importer."
+			sys.exit(1)
+		print "Importing %i parts with %i processes ..." % (len(parts), args.workers)
+		count = import_parallel(args, queue_keys, parts)
+	else:
+		count = import_flows(args, importer, r, queue_keys, store)
 
-args = parser.parse_args()
-
-try:
-	r = redis.Redis(host=args.dst_host, port=args.dst_port, db=args.dst_database)
-except e:
-	print >> sys.stderr, "Could not connect to Redis database: ", e
-	sys.exit(1)
-	
-if args.clear_queue:
-	r.delete(common.REDIS_QUEUE_KEY)
-	
-if args.legacy_vermont:
-	print "Importing data from legacy VERMONT db ..."
-	importer = importer_modules.get_importer_module("legacy-vermont-db", args)
-elif args.bro_conn_log:
-	print "Importing data from Bro connection logs ..."
-	importer = importer_modules.get_importer_module("bro-importer", args)
-elif args.argus_db:
-	print "Importing data from Argus MYSQL db ..."
-	importer = importer_modules.get_importer_module("argus-importer", args)
-else:
-	print "Importing data from VERMONT DB ..."
-	importer = importer_modules.get_importer_module("vermont-db", args)
-
-startTime = datetime.datetime.now()
-print "%s: connected to source and destination database" % (startTime)
-
-print "Starting to import flows ..."
-count = 0
-
-while True:
-	flow = importer.get_next_flow()
-	if flow == None:
-		break;
-
-	queue_length = r.rpush(common.REDIS_QUEUE_KEY, json.dumps(flow))
-	while queue_length > args.max_queue:
-		print "Max queue length reached, importing paused..."
-		time.sleep(10)
-		queue_length = r.llen(common.REDIS_QUEUE_KEY)
-	count += 1
-	
-
-common.progress(100, 100)
-
-# Append termination flag to queue
-# The preprocessing daemon will terminate with this flag.
-r.rpush(common.REDIS_QUEUE_KEY, "END")
-
-endTime = datetime.datetime.now()
-print "%s: imported %i flows in %s" % (endTime, count, endTime - startTime)
+	common.progress(100, 100)
 
+	# Append termination flag to queue
+	# The preprocessing daemon will terminate with this flag. In sharded
+	# mode, every preprocessor process needs its own flag.
+	for queue_key in queue_keys:
+		r.rpush(queue_key, "END")
 
+	endTime = datetime.datetime.now()
+	print "%s: imported %i flows in %s" % (endTime, count, endTime - startTime)
@@ -4,7 +4,10 @@
 """
 Preprocess flows taken from Redis queue.
 
-It is save to run multiple instances of this script!
+It is save to run multiple instances of this script! In order to keep
+the caches of multiple instances disjunct, start the importer and the
+preprocessor with the same --partitions setting. The preprocessor will 
+then start one process per queue partition.
 
 Author: Mario Volke, Lothar Braun 
 """
@@ -16,18 +19,32 @@ sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lib'))
 
 import math
 import time
+import struct
 import threading
+import multiprocessing
 import argparse
 import datetime
 import redis
 import json
 import bson
-import xml.dom.minidom
-from collections import deque
+
+try:
+	import numpy
+except ImportError:
+	numpy = None
 
 import common
 import backend
 import config
+import flowqueue
+import flowrecord
+import pipeline
+import loadshedder
+import flowcache
+import indexaggregator
+import sketch
+import hyperloglog
+import bucketcatalog
 
 parser = argparse.ArgumentParser(description="Import IPFIX flows from Redis cache into MongoDB.")
 parser.add_argument("--src-host", nargs="?", default="127.0.0.1", help="Redis host")
@@ -40,20 +57,33 @@ parser.add_argument("--dst-password", nargs="?", default=config.db_password, hel
 parser.add_argument("--dst-database", nargs="?", default=config.db_name, help="Backend database name")
 parser.add_argument("--clear-database", nargs="?", type=bool, default=False, const=True, help="Whether to clear the whole databse before importing any flows.")
 parser.add_argument("--backend", nargs="?", default=config.db_backend, const=True, help="Selects the backend type that is used to store the data")
-
-args = parser.parse_args()
+parser.add_argument("--drain-size", nargs="?", default=1000, type=int, help="Maximum number of queue entries that are fetched from Redis with a single round trip.")
+parser.add_argument("--batch-size", nargs="?", default=5000, type=int, help="Maximum number of flows that are sliced into buckets at once.")
+parser.add_argument("--read-buffer", nargs="?", default=4, type=int, help="Number of drained blocks that a reader thread buffers ahead of the slicing. 0 reads from Redis in the main thread.")
+parser.add_argument("--write-buffer", nargs="?", default=10000, type=int, help="Number of backend writes that a writer thread buffers. Slicing blocks when the buffer is full. 0 writes in the main thread.")
+parser.add_argument("--cache-policy", nargs="?", default=getattr(config, "pre_cache_policy", "lru"), choices=sorted(flowcache.CACHE_POLICIES), help="Eviction policy of the preprocessor caches.")
+parser.add_argument("--allowed-lateness", nargs="?", default=getattr(config, "pre_allowed_lateness", 300), type=int, help="Live import: seconds a flow may end after a bucket before the bucket is written to the database.")
+parser.add_argument("--rollup", nargs="?", type=bool, default=getattr(config, "pre_rollup", False), const=True, help="Only slice flows into the smallest bucket size. Larger bucket sizes are merged from the documents of smaller ones.")
+parser.add_argument("--overload", nargs="?", type=bool, default=getattr(config, "pre_overload", False), const=True, help="Sample the flows while the preprocessor cannot keep up with the queue. Counters of the sampled flows are scaled up.")
+parser.add_argument("--overload-high", nargs="?", default=100000, type=int, help="Overload mode: queue length in flows that starts or increases sampling. Binary queue entries are counted with the average number of flows per entry. Importers that are paced by --max-queue stay below their limit, so this applies to producers that cannot wait (e.g. the NetFlow collector).")
+parser.add_argument("--overload-low", nargs="?", default=10000, type=int, help="Overload mode: queue length in flows below which sampling is reduced.")
+parser.add_argument("--overload-max-lag", nargs="?", default=900, type=int, help="Overload mode: seconds between the end of the latest flow and now that start or increase sampling. 0 ignores the lag (use for historical data).")
+parser.add_argument("--overload-max-weight", nargs="?", default=64, type=int, help="Overload mode: keep at least one of this many flows.")
+parser.add_argument("--partitions", nargs="?", default=1, type=int, help="Number of queue partitions. Starts one preprocessor process per partition. Must match the --partitions setting of the importer.")
 
 
 # Class to handle flows
 class FlowHandler:
-	def __init__(self, bucket_interval, collection, nodes_collection, ports_collection, aggr_sum, aggr_values=[], filter_ports=None, cache_size=0):
+	def __init__(self, bucket_interval, collection, nodes_collection, ports_collection, aggr_sum, aggr_values=[], filter_ports=None, cache_size=0, cache_policy="lru"):
 		"""
 		:Parameters:
 		 - `bucket_interval`: The bucket interval in seconds.
 		 - `collection`: A pymongo collection to insert the documents.
 		 - `aggr_sum`: A list of keys which will be sliced and summed up.
 		 - `aggr_values`: A list of keys which have to match in order to aggregate two flows
-		 - `filter_ports`: A dictionary of ports and protocols to remove unknown ports
+		 - `filter_ports`: A registry of known ports (see portregistry.py) to remove unknown ports
+		 - `cache_size`: Number of documents to cache before writing them to the database
+		 - `cache_policy`: The eviction policy of the cache (see flowcache.py)
 		"""
 		self.bucket_interval = bucket_interval
 		self.collection = collection
@@ -71,25 +101,59 @@ class FlowHandler:
 		self.aggr_sum = aggr_sum
 		self.aggr_values = aggr_values
 		self.filter_ports = filter_ports
+
+		# combine the bucket index updates until the cache is flushed
+		self.node_index = None
+		if self.nodes_collection:
+			self.node_index = indexaggregator.NodeIndexAggregator(self.nodes_collection, aggr_sum)
+		self.port_index = None
+		if self.ports_collection:
+			self.port_index = indexaggregator.PortIndexAggregator(self.ports_collection, aggr_sum, filter_ports)
+
+		# packs the cache keys (see get_id())
+		self.key_struct = None
+		if all([v in common.KEY_FORMATS for v in aggr_values]):
+			self.key_struct = struct.Struct("!" + common.KEY_FORMATS[common.COL_BUCKET] + "".join([common.KEY_FORMATS[v] for v in aggr_values]))
 		
 		# init cache
 		self.cache = None
 		self.cache_size = cache_size
 		if cache_size > 0:
-			self.cache = dict()
-			self.cache_queue = deque()
+			self.cache = flowcache.get_cache(cache_policy, cache_size)
+			# late flows for buckets that have already been flushed
+			self.reopen = flowcache.FIFOCache(max(1, cache_size / 10))
+		# buckets before closed_before have been flushed (see flushClosed())
+		self.closed_before = None
+
+		# handlers of larger bucket sizes that merge our documents
+		self.rollups = []
+		# sketches of the nodes and ports (see sketch.py and hyperloglog.py)
+		self.sketches = []
 			
 		# stats
 		self.num_flows = 0
 		self.num_slices = 0
 		self.cache_hits = 0
 		self.cache_misses = 0
+		self.cache_evictions = 0
+		self.late_slices = 0
+		self.merged_docs = 0
 		self.db_requests = 0
 		
 	def get_id(self, bucket, flow):
 		"""Generate a unique id.
+
+		The id is the bucket and the aggregation values packed into a 
+		fixed-width binary string. Flows with values that cannot be 
+		packed (missing fields, unknown columns) get a string id that
+		is prefixed with a marker byte.
 		"""
-		id = str(bucket)
+		if self.key_struct != None:
+			try:
+				return self.key_struct.pack(bucket, *[flow.get(col, None) for col in self.aggr_values])
+			except struct.error:
+				pass
+		id = "\xff" + str(bucket)
 		for i,col in enumerate(self.aggr_values):
 			id += str(flow.get(col, "x"))
 		return id
@@ -126,57 +190,13 @@ class FlowHandler:
 			intervalFactor = (bucketEnd - bucketStart + 1) / float(flow[common.COL_LAST_SWITCHED] - flow[common.COL_FIRST_SWITCHED] + 1)
 			
 			key = self.get_id(bucket, flow)	
+			doc = self.get_doc(key, bucket, flow)
 			
-			# check if we hit the cache
-			doc = None
-			if self.cache != None:
-				doc = self.cache.get(key, None)
-				if doc == None:
-					self.cache_misses += 1
-				else:
-					self.cache_hits += 1
-			if doc == None:
-				doc = { "$set": { common.COL_BUCKET: bucket }, "$inc": {} }
-			
-				# set unknown ports to None
-				if self.filter_ports:
-					for v in self.aggr_values:
-						if v == common.COL_SRC_PORT or v == common.COL_DST_PORT:
-							set_value = None
-							value = flow.get(v, None)
-							if value != None and value in self.filter_ports:
-								filter_proto = int(flow.get(common.COL_PROTO, -1))
-								if filter_proto == -1 or filter_proto in self.filter_ports[value]:
-									set_value = value
-							doc["$set"][v] = set_value
-						else:
-							doc["$set"][v] = flow.get(v, None)
-				else:
-					for v in self.aggr_values:
-						doc["$set"][v] = flow.get(v, None)
-						
-				for s in self.aggr_sum:
-					doc["$inc"][s] = 0
-					doc["$inc"][proto + "." + s] = 0
-				doc["$inc"][common.COL_FLOWS] = 0
-				doc["$inc"][proto + "." + common.COL_FLOWS ] = 0
-				
-				if self.cache != None:
-					# insert into cache
-					self.cache[key] = doc
-					self.cache_queue.append(key)
-			
+			sums = dict()
 			if nextBucket > flow[common.COL_LAST_SWITCHED]:
 				for s in self.aggr_sum:
 					assert flow.get(s, 0) - emitted[s] >= 0
-					doc["$inc"][s] += flow.get(s, 0) - emitted[s]
-					# it is possible that the protocol specific part is not yet in the document
-					# check and adopt to this
-					keyString = proto + "." + s
-					if not keyString in doc["$inc"]:
-						doc["$inc"][keyString] = flow.get(s, 0) - emitted[s]
-					else:
-						doc["$inc"][keyString] += flow.get(s, 0) - emitted[s]
+					sums[s] = flow.get(s, 0) - emitted[s]
 			else:
 				for s in self.aggr_sum:
 					interval = intervalFactor * flow.get(s, 0)
@@ -184,56 +204,285 @@ class FlowHandler:
 					val = int(num)
 					carry[s] = num - val;
 					emitted[s] += val
-					doc["$inc"][s] += val
-					keyString = proto + "." + s
-					if not keyString in doc["$inc"]:
-						doc["$inc"][keyString] = val
-					else:
-						doc["$inc"][keyString] += val
-					
-			# count number of aggregated flows in the bucket
-			doc["$inc"][common.COL_FLOWS] += intervalFactor
- 
-			keyString = proto + "." + common.COL_FLOWS
-			if not keyString in doc["$inc"]:
-				doc["$inc"][keyString] = intervalFactor
+					sums[s] = val
+			# sampled flows stand for more than one flow. their sums 
+			# have already been scaled by shed_load()
+			self.add_to_doc(doc, proto, sums, intervalFactor * flow.get(loadshedder.WEIGHT, 1))
+			self.commit_doc(key, doc)
+				
+			bucket = nextBucket
+
+	def handleFlows(self, flows):
+		"""Slice a block of flows into buckets in one vectorized pass.
+
+		Start and end buckets, interval factors and the integer distribution
+		of the sum columns are computed as numpy arrays for all slices of 
+		all flows. Slices that share a bucket and the aggregation values are
+		summed up before they are merged into the cache, so every key is 
+		touched once per block. 
+		Falls back to handleFlow() if numpy is not available.
+		"""
+		valid = []
+		for flow in flows:
+			# leave malformed flows to the scalar code path
+			if flow[common.COL_LAST_SWITCHED] < flow[common.COL_FIRST_SWITCHED] or numpy == None:
+				self.handleFlow(flow)
 			else:
-				doc["$inc"][keyString] += intervalFactor
-			
-			# if caching is actived then insert into cache
-			if self.cache != None:
-				self.handleCache()
+				valid.append(flow)
+		if len(valid) == 0:
+			return
+		flows = valid
+		self.num_flows += len(flows)
+
+		# flows with equal aggregation values and protocol end up in the 
+		# same documents. group them before slicing.
+		groups = dict()
+		group_flows = []
+		group_protos = []
+		group_ids = numpy.empty(len(flows), dtype=numpy.int64)
+		for i, flow in enumerate(flows):
+			proto = common.getProto(flow)
+			group = (proto,) + tuple([flow.get(v, None) for v in self.aggr_values])
+			gid = groups.get(group, None)
+			if gid == None:
+				gid = len(group_flows)
+				groups[group] = gid
+				group_flows.append(flow)
+				group_protos.append(proto)
+			group_ids[i] = gid
+
+		interval = self.bucket_interval
+		first = numpy.array([flow[common.COL_FIRST_SWITCHED] for flow in flows], dtype=numpy.int64)
+		last = numpy.array([flow[common.COL_LAST_SWITCHED] for flow in flows], dtype=numpy.int64)
+		duration = last - first + 1
+
+		first_bucket = first // interval * interval
+		num_buckets = (last // interval * interval - first_bucket) // interval + 1
+		num_slices = int(num_buckets.sum())
+		self.num_slices += num_slices
+
+		# one row per slice. idx points to the flow, pos is the number of the
+		# slice within its flow
+		idx = numpy.repeat(numpy.arange(len(flows)), num_buckets)
+		pos = numpy.arange(num_slices) - numpy.repeat(numpy.cumsum(num_buckets) - num_buckets, num_buckets)
+		buckets = first_bucket[idx] + pos * interval
+		slice_start = numpy.maximum(buckets, first[idx])
+		slice_end = numpy.minimum(buckets + interval - 1, last[idx])
+		slice_duration = duration[idx]
+		factors = (slice_end - slice_start + 1) / slice_duration.astype(numpy.float64)
+		# sampled flows stand for more than one flow
+		weights = numpy.array([flow.get(loadshedder.WEIGHT, 1) for flow in flows], dtype=numpy.float64)
+		factors *= weights[idx]
+
+		# handleFlow() carries the fractional part of each slice over to the
+		# next one. This is the same as emitting floor(value * elapsed / duration)
+		# up to the end of each slice, which can be done with exact integer math
+		elapsed = slice_end - first[idx] + 1
+		is_first = pos == 0
+		sums = dict()
+		for s in self.aggr_sum:
+			values = numpy.array([flow.get(s, 0) for flow in flows], dtype=numpy.int64)
+			if len(values) > 0 and values.max() > 0 and int(values.max()) * int(duration.max()) >= 2**63:
+				# value * elapsed would overflow int64. use python integers
+				values = values.astype(object)
+			emitted = values[idx] * elapsed // slice_duration
+			previous = numpy.roll(emitted, 1)
+			previous[is_first] = 0
+			sums[s] = emitted - previous
+
+		# sum up all slices with the same group and bucket
+		slice_groups = group_ids[idx]
+		order = numpy.lexsort((buckets, slice_groups))
+		slice_groups = slice_groups[order]
+		buckets = buckets[order]
+		change = numpy.ones(num_slices, dtype=bool)
+		change[1:] = (slice_groups[1:] != slice_groups[:-1]) | (buckets[1:] != buckets[:-1])
+		starts = numpy.flatnonzero(change)
+		partial_flows = numpy.add.reduceat(factors[order], starts)
+		partial_sums = dict()
+		for s in self.aggr_sum:
+			partial_sums[s] = numpy.add.reduceat(sums[s][order], starts)
+
+		for i, start in enumerate(starts):
+			gid = slice_groups[start]
+			flow = group_flows[gid]
+			bucket = int(buckets[start])
+			key = self.get_id(bucket, flow)
+			doc = self.get_doc(key, bucket, flow)
+			slice_sums = dict()
+			for s in self.aggr_sum:
+				slice_sums[s] = int(partial_sums[s][i])
+			self.add_to_doc(doc, group_protos[gid], slice_sums, float(partial_flows[i]))
+			self.commit_doc(key, doc)
+
+	def get_doc(self, key, bucket, flow):
+		"""Get the document for key from the cache or create a new one.
+		"""
+		cache = self.cache
+		if cache != None and self.closed_before != None and bucket < self.closed_before:
+			# the bucket has already been written. collect the late flows 
+			# in the reopen buffer
+			self.late_slices += 1
+			cache = self.reopen
+
+		# check if we hit the cache
+		doc = None
+		if cache != None:
+			doc = cache.get(key)
+			if doc == None:
+				self.cache_misses += 1
 			else:
-				self.updateCollection(key, doc)
+				self.cache_hits += 1
+		if doc != None:
+			return doc
+
+		doc = { "$set": { common.COL_BUCKET: bucket }, "$inc": {} }
+			
+		# set unknown ports to None
+		if self.filter_ports:
+			for v in self.aggr_values:
+				if v == common.COL_SRC_PORT or v == common.COL_DST_PORT:
+					set_value = None
+					value = flow.get(v, None)
+					if value != None and self.filter_ports.is_known(value, int(flow.get(common.COL_PROTO, -1))):
+						set_value = value
+					doc["$set"][v] = set_value
+				else:
+					doc["$set"][v] = flow.get(v, None)
+		else:
+			for v in self.aggr_values:
+				doc["$set"][v] = flow.get(v, None)
 				
-			bucket = nextBucket
+		proto = common.getProto(flow)
+		for s in self.aggr_sum:
+			doc["$inc"][s] = 0
+			doc["$inc"][proto + "." + s] = 0
+		doc["$inc"][common.COL_FLOWS] = 0
+		doc["$inc"][proto + "." + common.COL_FLOWS ] = 0
+		
+		if cache != None:
+			# insert into cache
+			cache.put(key, doc, bucket)
+		return doc
+
+	def addRollup(self, handler):
+		"""Merge all documents that we write into the buckets of handler.
+		The bucket interval of handler has to be a multiple of ours.
+		"""
+		if handler.bucket_interval % self.bucket_interval != 0:
+			raise Exception("Cannot roll up bucket size %i into bucket size %i" % (self.bucket_interval, handler.bucket_interval))
+		self.rollups.append(handler)
+
+	def addSketch(self, aggregator):
+		"""Feed all documents that we write into a sketch aggregator.
+		"""
+		self.sketches.append(aggregator)
+
+	def mergeDoc(self, doc):
+		"""Add a document of a smaller bucket size to the document of the 
+		bucket that contains it.
+		"""
+		self.merged_docs += 1
+		values = doc["$set"]
+		bucket = self.get_bucket(values[common.COL_BUCKET], self.bucket_interval)
+		key = self.get_id(bucket, values)
+		target = self.get_doc(key, bucket, values)
+		inc = target["$inc"]
+		for field, value in doc["$inc"].iteritems():
+			inc[field] = inc.get(field, 0) + value
+		self.commit_doc(key, target)
+
+	def add_to_doc(self, doc, proto, sums, flows):
+		"""Add the sliced sums and the number of (partial) flows to doc.
+		"""
+		for s in self.aggr_sum:
+			doc["$inc"][s] += sums[s]
+			# it is possible that the protocol specific part is not yet in the document
+			# check and adopt to this
+			keyString = proto + "." + s
+			if not keyString in doc["$inc"]:
+				doc["$inc"][keyString] = sums[s]
+			else:
+				doc["$inc"][keyString] += sums[s]
+			
+		# count number of aggregated flows in the bucket
+		doc["$inc"][common.COL_FLOWS] += flows
+
+		keyString = proto + "." + common.COL_FLOWS
+		if not keyString in doc["$inc"]:
+			doc["$inc"][keyString] = flows
+		else:
+			doc["$inc"][keyString] += flows
+
+	def commit_doc(self, key, doc):
+		# if caching is actived then insert into cache
+		if self.cache != None:
+			self.handleCache()
+		else:
+			self.updateCollection(key, doc)
 			
 	def updateCollection(self, key, doc):
-		# bindata will reduce id size by 50%
-		#self.collection.update({ "_id": bson.binary.Binary(key) }, doc, True)
-		self.collection.update({ "_id": key }, doc, True)
-		if self.nodes_collection:
-			newdoc = doc["$set"]
+		if self.node_index or self.port_index or self.sketches:
+			newdoc = dict(doc["$set"])
 			newdoc.update(doc["$inc"])
-			common.update_node_index(newdoc, self.nodes_collection, config.flow_aggr_sums)
-		if self.ports_collection:
-			newdoc = doc["$set"]
-			newdoc.update(doc["$inc"])
-			common.update_port_index(newdoc, self.ports_collection, config.flow_aggr_sums, known_ports)
+			if self.node_index:
+				self.node_index.add_flow(newdoc)
+			if self.port_index:
+				self.port_index.add_flow(newdoc)
+			for aggregator in self.sketches:
+				aggregator.add_flow(newdoc)
+		for rollup in self.rollups:
+			rollup.mergeDoc(doc)
+		# the document may be written by the backend writer thread from 
+		# here on. do not touch it anymore
+		self.collection.update({ "_id": key }, doc, True)
 		self.db_requests += 1
 		
 	def handleCache(self, clear=False):
 		if not self.cache:
 			return
 			
-		while (clear and len(self.cache_queue) > 0) or len(self.cache_queue) > self.cache_size:
-			key = self.cache_queue.popleft()
-			doc = self.cache[key]
+		while (clear and len(self.cache) > 0) or self.cache.is_full():
+			if not clear:
+				self.cache_evictions += 1
+			(key, doc) = self.cache.pop()
 			self.updateCollection(key, doc)
-			del self.cache[key]
+
+		# the reopen buffer is small. write it as a whole once it is full
+		if clear or self.reopen.is_full():
+			while len(self.reopen) > 0:
+				(key, doc) = self.reopen.pop()
+				self.updateCollection(key, doc)
 	
 	def flushCache(self):
 		self.handleCache(True)
+		self.flushBackend()
+
+	def flushClosed(self, watermark):
+		"""Write the documents of all buckets that end before watermark.
+		Slices of later flows for these buckets go to the reopen buffer.
+		"""
+		limit = self.get_bucket(watermark, self.bucket_interval)
+		if self.closed_before == None or limit > self.closed_before:
+			self.closed_before = limit
+		if self.cache != None:
+			for (key, doc) in self.cache.pop_older(self.closed_before):
+				self.updateCollection(key, doc)
+			while len(self.reopen) > 0:
+				(key, doc) = self.reopen.pop()
+				self.updateCollection(key, doc)
+		self.flushBackend(self.closed_before)
+
+	def flushBackend(self, closed_before=None):
+		"""Write the indexes and the aggregators. The sketches of buckets
+		from closed_before on are kept until the buckets are closed.
+		"""
+		if self.node_index:
+			self.node_index.flush()
+		if self.port_index:
+			self.port_index.flush()
+		for aggregator in self.sketches:
+			aggregator.flush(closed_before)
 		self.collection.flushCache()
 		if self.nodes_collection:
 			self.nodes_collection.flushCache()
@@ -250,6 +499,8 @@ class FlowHandler:
 		else:
 			avg_per_flow = self.num_slices / float(self.num_flows)
 		print "Slices overall: %i (avg. %.2f per flow)" % (self.num_slices, avg_per_flow)
+		if self.merged_docs > 0:
+			print "Documents merged from smaller buckets: %i" % (self.merged_docs)
 		print "Database requests: %i" % (self.db_requests)
 		
 		if self.cache != None:
@@ -258,138 +509,472 @@ class FlowHandler:
 			else:
 				hitratio = self.cache_hits / float(self.cache_hits + self.cache_misses) * 100
 			print "Cache hit ratio: %.2f%%" % (hitratio)
+			print "Cache hits: %i, misses: %i, evictions: %i" % (self.cache_hits, self.cache_misses, self.cache_evictions)
+			print "Slices for closed buckets: %i" % (self.late_slices)
 
 		else:
 			print "Cache deactivated"
 			
 		print ""
 		
-output_flows = 0
-def print_output():
-	global output_flows, timer
-	print "%s: Processed %i flows within last %i seconds (%.2f flows/s)." % (
-		datetime.datetime.now(), output_flows, common.OUTPUT_INTERVAL, output_flows / float(common.OUTPUT_INTERVAL))
-	output_flows = 0
-	timer = threading.Timer(common.OUTPUT_INTERVAL, print_output)
-	timer.start()
-	
-print "%s: Init..." % (datetime.datetime.now())
+class Preprocessor:
+	def __init__(self, args, queue_key, stop=None):
+		"""
+		:Parameters:
+		 - `args`: The parsed command line arguments.
+		 - `queue_key`: The Redis list to take the flows from.
+		 - `stop`: An optional multiprocessing.Event. The preprocessor terminates
+		           as soon as it is set. Used by the supervisor in sharded mode.
+		"""
+		self.args = args
+		self.queue_key = queue_key
+		self.stop = stop
 
-# init redis connection
-try:
-	r = redis.Redis(host=args.src_host, port=args.src_port, db=args.src_database)
-except Exception, e:
-	print >> sys.stderr, "Could not connect to Redis database: %s" % (e)
-	sys.exit(1)
+		self.output_flows = 0
+		self.imported_flows = 0
+		# maximum event time (end of flow) seen so far
+		self.watermark = None
+		self.next_flush = None
+		self.timer = None
+		self.batch = []
+		# end of the latest flow taken from the queue
+		self.latest_flow = None
+		# number of flows per queue entry, see check_overload()
+		self.decoded_entries = 0
+		self.decoded_flows = 0
+		self.flows_per_entry = 1.0
+		self.shedder = None
+		if args.overload:
+			self.shedder = loadshedder.LoadShedder(args.overload_high, args.overload_low, args.overload_max_lag, args.overload_max_weight)
 
-dst_db = backend.flowbackend.getBackendObject(args.backend, args.dst_host, args.dst_port, args.dst_user, args.dst_password, args.dst_database)
-	
-if args.clear_database:
-	dst_db.clearDatabase()
+	def connect(self, prepare=True, r=None):
+		"""
+		:Parameters:
+		 - `prepare`: Whether to prepare the backend collections.
+		 - `r`: An existing Redis connection (or a stand-in, see 
+		        memoryredis) to use instead of connecting to --src-host.
+		"""
+		print "%s: Init %s..." % (datetime.datetime.now(), self.queue_key)
 
-dst_db.prepareCollections()
-	
-node_index_collection = dst_db.getCollection(common.DB_INDEX_NODES)
-port_index_collection = dst_db.getCollection(common.DB_INDEX_PORTS)
-	
-known_ports = common.getKnownPorts(config.flow_filter_unknown_ports)
-
-# create flow handlers
-handlers = []
-for s in config.flow_bucket_sizes:
-	handlers.append(FlowHandler(
-		s,
-		dst_db.getCollection(common.DB_FLOW_PREFIX + str(s)),
-		dst_db.getCollection(common.DB_INDEX_NODES + "_" + str(s)),
-		dst_db.getCollection(common.DB_INDEX_PORTS + "_" + str(s)),
-		config.flow_aggr_sums,
-		config.flow_aggr_values,
-		known_ports,
-		config.pre_cache_size
-	))
+		# init redis connection
+		if r != None:
+			self.r = r
+		else:
+			try:
+				self.r = redis.Redis(host=self.args.src_host, port=self.args.src_port, db=self.args.src_database)
+			except Exception, e:
+				print >> sys.stderr, "Could not connect to Redis database: %s" % (e)
+				sys.exit(1)
+
+		self.dst_db = backend.flowbackend.getBackendObject(self.args.backend, self.args.dst_host, self.args.dst_port, self.args.dst_user, self.args.dst_password, self.args.dst_database)
+		if prepare:
+			prepare_backend(self.args, self.dst_db)
 	
-for s in config.flow_bucket_sizes:
-	handlers.append(FlowHandler(
-		s,
-		dst_db.getCollection(common.DB_FLOW_AGGR_PREFIX + str(s)),
-		None,
-		None,
-		config.flow_aggr_sums,
-		[],
-		None,
-		config.pre_cache_size_aggr
-	))
-
-print "%s: Preprocessing started." % (datetime.datetime.now())
-print "%s: Use Ctrl-C to quit." % (datetime.datetime.now())
-
-timer = threading.Timer(common.OUTPUT_INTERVAL, print_output)
-timer.start()
-
-time_since_last_flush = None
-
-# Daemon loop
-while True:
-	try:
-		# this redis call blocks until there is a new entry in the queue
-		obj = r.blpop(common.REDIS_QUEUE_KEY, 0)
-		obj = obj[1]
-		
-		# Terminate if this object is the END flag
-		if obj == "END":
-			print "%s: Reached END. Terminating..." % (datetime.datetime.now())
-			print "%s: Flushing caches. Do not terminate this process or you will have data loss!" % (datetime.datetime.now())
-			break
-			
-		try:
-			obj = json.loads(obj)
-			obj[common.COL_FIRST_SWITCHED] = int(obj[common.COL_FIRST_SWITCHED])
-			obj[common.COL_LAST_SWITCHED] = int(obj[common.COL_LAST_SWITCHED])
-			for s in config.flow_aggr_sums:
-				obj[s] = int(obj[s])
-			if time_since_last_flush == None:
-				# store the current flow time stamp as beginning time
-				time_since_last_flush = obj[common.COL_LAST_SWITCHED]
-		except ValueError, e:
-			print >> sys.stderr, "Could not decode JSON object in queue: ", e
-			continue
+		self.known_ports = common.getKnownPorts(config.flow_filter_unknown_ports)
 
-		# only import flow if it is newer than config.max_flow_time
-		if config.max_flow_age != 0 and obj[common.COL_FIRST_SWITCHED] < (time.mktime(datetime.datetime.utcfromtimestamp(time.time()).timetuple()) - config.max_flow_age):
-			print "Flow is too old to be imported into mongodb. Skipping flow ..."
-			continue
+		# all backend writes go through the writer
+		if self.args.write_buffer > 0:
+			self.writer = pipeline.BackendWriter(self.args.write_buffer)
+		else:
+			self.writer = pipeline.SyncWriter()
+
+		# index over all flows
+		self.node_index = indexaggregator.NodeIndexAggregator(self.get_collection(common.DB_INDEX_NODES), config.flow_aggr_sums)
+		self.port_index = indexaggregator.PortIndexAggregator(self.get_collection(common.DB_INDEX_PORTS), config.flow_aggr_sums, self.known_ports)
+
+		# create flow handlers. smaller bucket sizes come first, so that 
+		# they are flushed before the bucket sizes they are rolled up into
+		bucket_sizes = sorted(config.flow_bucket_sizes)
+		flow_handlers = []
+		for s in bucket_sizes:
+			flow_handlers.append(FlowHandler(
+				s,
+				self.get_collection(common.DB_FLOW_PREFIX + str(s)),
+				self.get_collection(common.DB_INDEX_NODES + "_" + str(s)),
+				self.get_collection(common.DB_INDEX_PORTS + "_" + str(s)),
+				config.flow_aggr_sums,
+				config.flow_aggr_values,
+				self.known_ports,
+				config.pre_cache_size,
+				self.args.cache_policy
+			))
 	
+		sketch_size = getattr(config, "pre_sketch_size", 0)
+		if sketch_size > 0 and not self.args.backend in [ "mongo", "memory" ]:
+			print >> sys.stderr, "Heavy-hitter sketches are not supported by the %s backend. Disabling them." % (self.args.backend)
+			sketch_size = 0
+		if sketch_size > 0:
+			for handler in flow_handlers:
+				suffix = "_" + str(handler.bucket_interval)
+				nodes_collection = self.get_collection(common.DB_SKETCH_NODES + suffix)
+				ports_collection = self.get_collection(common.DB_SKETCH_PORTS + suffix)
+				nodes_collection.createIndex(common.COL_BUCKET)
+				ports_collection.createIndex(common.COL_BUCKET)
+				handler.addSketch(sketch.NodeSketchAggregator(nodes_collection, config.flow_aggr_sums, sketch_size))
+				handler.addSketch(sketch.PortSketchAggregator(ports_collection, config.flow_aggr_sums, sketch_size, self.known_ports))
+
+		fanout_precision = getattr(config, "pre_fanout_precision", 0)
+		fanout_fields = [ common.COL_SRC_IP, common.COL_DST_IP, common.COL_DST_PORT ]
+		if fanout_precision > 0 and not self.args.backend in [ "mongo", "memory" ]:
+			print >> sys.stderr, "Fan-out counters are not supported by the %s backend. Disabling them." % (self.args.backend)
+			fanout_precision = 0
+		if fanout_precision > 0 and not all([ f in config.flow_aggr_values for f in fanout_fields ]):
+			print >> sys.stderr, "Fan-out counters need %s in flow_aggr_values. Disabling them." % (", ".join(fanout_fields))
+			fanout_precision = 0
+		if fanout_precision > 0:
+			for handler in flow_handlers:
+				suffix = "_" + str(handler.bucket_interval)
+				fanout_collection = self.get_collection(common.DB_FANOUT + suffix)
+				fanin_collection = self.get_collection(common.DB_FANIN + suffix)
+				for collection in [ fanout_collection, fanin_collection ]:
+					collection.createIndex(common.COL_BUCKET)
+					collection.createIndex(common.COL_ID)
+				handler.addSketch(hyperloglog.FanoutAggregator(fanout_collection, common.COL_SRC_IP, [ common.COL_DST_IP, common.COL_DST_PORT ], fanout_precision))
+				handler.addSketch(hyperloglog.FanoutAggregator(fanin_collection, common.COL_DST_IP, [ common.COL_SRC_IP ], fanout_precision))
+
+		aggr_handlers = []
+		for s in bucket_sizes:
+			aggr_handlers.append(FlowHandler(
+				s,
+				self.get_collection(common.DB_FLOW_AGGR_PREFIX + str(s)),
+				None,
+				None,
+				config.flow_aggr_sums,
+				[],
+				None,
+				config.pre_cache_size_aggr,
+				self.args.cache_policy
+			))
+
+		# the catalog lists the buckets of the collections that the 
+		# probes of the backends read
+		if getattr(config, "bucket_catalog", False):
+			catalog_collection = self.get_collection(common.DB_BUCKET_CATALOG)
+			catalog_collection.createIndex(common.COL_BUCKET)
+			for handler in aggr_handlers:
+				handler.addSketch(bucketcatalog.CatalogAggregator(catalog_collection, handler.bucket_interval))
+		self.handlers = flow_handlers + aggr_handlers
+
+		# the handlers that slice the flows from the queue
+		self.slicers = list(self.handlers)
+		if self.args.rollup:
+			self.slicers = []
+			for family in [ flow_handlers, aggr_handlers ]:
+				for i, handler in enumerate(family):
+					# merge from the largest smaller bucket size that fits
+					sources = [ h for h in family[:i] if handler.bucket_interval % h.bucket_interval == 0 ]
+					if len(sources) > 0:
+						sources[-1].addRollup(handler)
+					else:
+						self.slicers.append(handler)
+
+	def get_collection(self, name):
+		return pipeline.WriterCollection(self.dst_db.getCollection(name), self.writer)
+
+	def print_output(self):
+		print "%s: %s: Processed %i flows within last %i seconds (%.2f flows/s)." % (
+			datetime.datetime.now(), self.queue_key, self.output_flows, common.OUTPUT_INTERVAL, self.output_flows / float(common.OUTPUT_INTERVAL))
+		self.output_flows = 0
+		self.timer = threading.Timer(common.OUTPUT_INTERVAL, self.print_output)
+		self.timer.start()
+
+	def handle_flows(self, flows):
+		"""Pass a block of decoded flows to the handlers and update the indexes.
+		"""
+		if len(flows) == 0:
+			return
+
 		# Bucket slicing
-		for handler in handlers:
-			handler.handleFlow(obj)
-			
-		common.update_node_index(obj, node_index_collection, config.flow_aggr_sums)
-		common.update_port_index(obj, port_index_collection, config.flow_aggr_sums, known_ports)
+		for handler in self.slicers:
+			handler.handleFlows(flows)
+
+		self.node_index.add_flows(flows)
+		self.port_index.add_flows(flows)
 			
-		output_flows += 1
+		self.output_flows += len(flows)
+
+	def handle_batch(self):
+		self.handle_flows(self.batch)
+		self.batch = []
+
+	def decode_entry(self, entry):
+		"""Decode a queue entry into a list of flows. JSON entries hold a 
+		single flow, binary entries (see flowrecord) hold many. Flows that 
+		should not be imported are removed.
+		"""
+		if flowrecord.is_binary(entry):
+			try:
+				flows = flowrecord.decode(entry)
+			except ValueError, e:
+				print >> sys.stderr, "Could not decode binary entry in queue: ", e
+				return []
+		else:
+			try:
+				obj = json.loads(entry)
+				obj[common.COL_FIRST_SWITCHED] = int(obj[common.COL_FIRST_SWITCHED])
+				obj[common.COL_LAST_SWITCHED] = int(obj[common.COL_LAST_SWITCHED])
+				for s in config.flow_aggr_sums:
+					obj[s] = int(obj[s])
+			except ValueError, e:
+				print >> sys.stderr, "Could not decode JSON object in queue: ", e
+				return []
+			flows = [ obj ]
+		self.decoded_entries += 1
+		self.decoded_flows += len(flows)
+
+		# only import flow if it is newer than config.max_flow_time
+		if config.max_flow_age != 0:
+			min_time = time.mktime(datetime.datetime.utcfromtimestamp(time.time()).timetuple()) - config.max_flow_age
+			for obj in flows:
+				if obj[common.COL_FIRST_SWITCHED] < min_time:
+					print "Flow is too old to be imported into mongodb. Skipping flow ..."
+			flows = [ obj for obj in flows if obj[common.COL_FIRST_SWITCHED] >= min_time ]
+
+		return flows
+
+	def shed_load(self, flows):
+		"""Sample the flows if the load shedder asks for it. The counters of
+		the remaining flows are scaled up by their weight.
+		"""
+		for obj in flows:
+			if obj[common.COL_LAST_SWITCHED] > self.latest_flow:
+				self.latest_flow = obj[common.COL_LAST_SWITCHED]
+		if self.shedder == None:
+			return flows
+
+		result = []
+		for obj in flows:
+			weight = self.shedder.sample(obj)
+			if weight == 0:
+				continue
+			if weight > 1:
+				for s in config.flow_aggr_sums:
+					obj[s] = obj.get(s, 0) * weight
+				obj[common.COL_FLOWS] = obj.get(common.COL_FLOWS, 1) * weight
+				obj[loadshedder.WEIGHT] = weight
+			result.append(obj)
+		return result
+
+	def check_overload(self):
+		"""Adapt the sampling rate to the queue length and the lag and 
+		export the state to the Redis hash <queue key>:overload.
+		"""
+		now = time.time()
+		if self.shedder == None or now - self.shedder.last_check < self.shedder.interval:
+			return
+		lag = 0
+		if self.latest_flow != None:
+			lag = max(0, now - self.latest_flow)
+		# the thresholds are in flows. estimate the flows in the queue
+		# from the entries decoded since the last check
+		if self.decoded_entries > 0:
+			self.flows_per_entry = self.decoded_flows / float(self.decoded_entries)
+			self.decoded_entries = 0
+			self.decoded_flows = 0
+		self.shedder.check(int(self.r.llen(self.queue_key) * self.flows_per_entry), lag, now)
+		try:
+			self.r.hmset(self.queue_key + ":overload", self.shedder.get_stats())
+		except Exception, e:
+			print >> sys.stderr, "Could not export the load shedding state: %s" % (e)
+
+	def add_flow(self, obj):
+		self.batch.append(obj)
+		self.imported_flows += 1
+		if len(self.batch) >= self.args.batch_size:
+			self.handle_batch()
 
 		if config.live_import:
-			# try to periodically flush the caches.
-			# do this every 100,000 flows or every five minutes based 
-			# on the timestamps we get in the flow data 
-			if output_flows % 100000 == 0 or obj[common.COL_LAST_SWITCHED] > (time_since_last_flush + 300):
-				time_since_last_flush = obj[common.COL_LAST_SWITCHED]
-				print "Live import. Flushing caches ..."
-				for handler in handlers:
-					handler.flushCache()
+			self.advance_watermark(obj[common.COL_LAST_SWITCHED])
+
+	def advance_watermark(self, timestamp):
+		"""Flush the buckets that have been closed by the flow timestamps.
+
+		A bucket is closed once the latest flow end we have seen is more
+		than the allowed lateness past the end of the bucket. The closed 
+		buckets are written whenever the watermark passes a boundary of 
+		the smallest bucket size.
+		"""
+		if self.watermark != None and timestamp <= self.watermark:
+			return
+		self.watermark = timestamp
+		horizon = self.watermark - self.args.allowed_lateness
+		interval = min(config.flow_bucket_sizes)
+		if self.next_flush != None and horizon < self.next_flush:
+			return
+
+		if self.next_flush != None:
+			# slice the pending flows before the buckets are closed
+			self.handle_batch()
+			print "Live import. Flushing buckets before %s ..." % (datetime.datetime.utcfromtimestamp(horizon))
+			self.node_index.flush()
+			self.port_index.flush()
+			for handler in self.handlers:
+				handler.flushClosed(horizon)
+		self.next_flush = (horizon / interval + 1) * interval
+
+	def flush_caches(self):
+		self.node_index.flush()
+		self.port_index.flush()
+		for handler in self.handlers:
+			handler.flushCache()
+
+	def stopped(self):
+		return self.stop != None and self.stop.is_set()
 
+	def run(self):
+		print "%s: Preprocessing of %s started." % (datetime.datetime.now(), self.queue_key)
+		print "%s: Use Ctrl-C to quit." % (datetime.datetime.now())
+
+		self.timer = threading.Timer(common.OUTPUT_INTERVAL, self.print_output)
+		self.timer.start()
+
+		# in sharded mode, do not block forever on an empty queue. we 
+		# have to check regularly whether the supervisor wants us to stop
+		wait_timeout = 0
+		if self.stop != None:
+			wait_timeout = 1
+
+		if self.args.read_buffer > 0:
+			reader = pipeline.QueueReader(self.r, self.queue_key, self.args.drain_size, self.args.read_buffer)
+		else:
+			reader = pipeline.SyncReader(self.r, self.queue_key, self.args.drain_size)
+
+		entries = []
+		next_entry = 0
+		# drained entries that have not been processed. they are 
+		# returned to the queue when we terminate
+		pending = []
+
+		# Daemon loop
+		while True:
+			try:
+				if self.stopped():
+					print "%s: %s: Stopped by supervisor. Terminating..." % (datetime.datetime.now(), self.queue_key)
+					break
+
+				# fetch up to drain_size entries with a single round trip
+				entries = reader.poll()
+				next_entry = 0
+				if len(entries) == 0:
+					# the queue is empty. slice the pending flows before 
+					# blocking until there are new entries
+					self.handle_batch()
+					entries = reader.wait(wait_timeout)
+					if len(entries) == 0:
+						continue
 		
-	except KeyboardInterrupt:
-		print "%s: Keyboard interrupt. Terminating..." % (datetime.datetime.now())
-		print "%s: Flusing caches. Do not terminate this process or you will have data loss!"
-		break
+				finished = False
+				while next_entry < len(entries):
+					obj = entries[next_entry]
+
+					# Terminate if this object is the END flag
+					if obj == "END":
+						# entries behind END belong to the next run
+						pending = entries[next_entry + 1:]
+						entries = []
+						finished = True
+						break
+			
+					flows = self.shed_load(self.decode_entry(obj))
+					next_entry += 1
+					for obj in flows:
+						self.add_flow(obj)
+				self.check_overload()
+
+				if finished:
+					print "%s: %s: Reached END. Terminating..." % (datetime.datetime.now(), self.queue_key)
+					print "%s: Flushing caches. Do not terminate this process or you will have data loss!" % (datetime.datetime.now())
+					break
+		
+			except KeyboardInterrupt:
+				print "%s: Keyboard interrupt. Terminating..." % (datetime.datetime.now())
+				print "%s: Flusing caches. Do not terminate this process or you will have data loss!" % (datetime.datetime.now())
+				# return drained entries that have not been looked at
+				pending = entries[next_entry:]
+				break
+
+		flowqueue.push_back(self.r, self.queue_key, pending + reader.close())
+
+		# slice the flows that are still pending
+		self.handle_batch()
 		
-timer.cancel()
-
-# clear cache
-for handler in handlers:
-	handler.flushCache()
-# print reports
-print ""
-for handler in handlers:
-	handler.printReport()
+		self.timer.cancel()
+
+		# clear cache and wait until everything has been written
+		self.flush_caches()
+		self.writer.close()
+		# print reports
+		print ""
+		for handler in self.handlers:
+			handler.printReport()
+		if self.shedder != None:
+			stats = self.shedder.get_stats()
+			print "Load shedding: kept %i flows, dropped %i flows, sampled for %i s" % (stats["kept_flows"], stats["dropped_flows"], stats["sampled_seconds"])
+
+
+def prepare_backend(args, dst_db):
+	if args.clear_database:
+		dst_db.clearDatabase()
+
+	dst_db.prepareCollections()
+
+	# complete the catalog of a database that was filled without it
+	if getattr(config, "bucket_catalog", False) and bucketcatalog.seed(dst_db, config.flow_bucket_sizes):
+		print "%s: Seeded the bucket catalog from the aggregated flows." % (datetime.datetime.now())
+
+def run_worker(args, queue_key, stop):
+	"""Entry point of the worker processes in sharded mode.
+	"""
+	try:
+		preprocessor = Preprocessor(args, queue_key, stop)
+		preprocessor.connect(False)
+		preprocessor.run()
+	except KeyboardInterrupt:
+		# Ctrl-C before the daemon loop started. nothing to flush
+		pass
+
+def supervise(args):
+	"""Start one preprocessor process per queue partition and wait
+	until all of them have terminated. If one worker dies, all other
+	workers are stopped after flushing their caches.
+	"""
+	dst_db = backend.flowbackend.getBackendObject(args.backend, args.dst_host, args.dst_port, args.dst_user, args.dst_password, args.dst_database)
+	prepare_backend(args, dst_db)
+
+	stop = multiprocessing.Event()
+	workers = []
+	for i in range(args.partitions):
+		queue_key = flowqueue.partition_key(common.REDIS_QUEUE_KEY, i)
+		worker = multiprocessing.Process(target=run_worker, args=(args, queue_key, stop), name=queue_key)
+		worker.start()
+		workers.append(worker)
+	print "%s: Started %i preprocessor processes." % (datetime.datetime.now(), len(workers))
+
+	while len(workers) > 0:
+		try:
+			for worker in list(workers):
+				worker.join(1)
+				if worker.is_alive():
+					continue
+				workers.remove(worker)
+				if worker.exitcode != 0 and not stop.is_set():
+					print >> sys.stderr, "%s: Worker %s terminated with exit code %i. Stopping all workers..." % (datetime.datetime.now(), worker.name, worker.exitcode)
+					stop.set()
+		except KeyboardInterrupt:
+			# the workers receive the interrupt as well. wait until they 
+			# have flushed their caches
+			print "%s: Keyboard interrupt. Waiting for workers to flush their caches..." % (datetime.datetime.now())
+			stop.set()
+
+	print "%s: All preprocessor processes terminated." % (datetime.datetime.now())
+
+
+if __name__ == "__main__":
+	args = parser.parse_args()
+
+	if args.partitions > 1:
+		supervise(args)
+	else:
+		preprocessor = Preprocessor(args, common.REDIS_QUEUE_KEY)
+		preprocessor.connect()
+		preprocessor.run()
@@ -0,0 +1,19 @@
+"""
+Import paths and configuration of the tests.
+
+The tests always run with the settings of config/config.default.py,
+independent of a local config.py. Import this module before any module
+of the application:
+
+	import context
+"""
+
+import sys
+import os.path
+import imp
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+for directory in [ 'config', 'lib', 'preprocess' ]:
+	sys.path.insert(0, os.path.join(ROOT, directory))
+
+config = imp.load_source('config', os.path.join(ROOT, 'config', 'config.default.py'))
@@ -0,0 +1,64 @@
+"""
+Flows and flow handlers shared by the tests.
+"""
+
+import context
+
+import common
+import backend.flowbackend
+import preprocess
+
+SUMS = [ common.COL_PKTS, common.COL_BYTES ]
+
+def make_flow(first, last, pkts=10, bytes=1000, **fields):
+	"""
+	Returns a TCP flow from 1:1024 to 2:80. fields overwrite any field
+	of the flow.
+	"""
+	flow = {
+		common.COL_FIRST_SWITCHED: first,
+		common.COL_LAST_SWITCHED: last,
+		common.COL_SRC_IP: 1,
+		common.COL_DST_IP: 2,
+		common.COL_SRC_PORT: 1024,
+		common.COL_DST_PORT: 80,
+		common.COL_PROTO: 6,
+		common.COL_PKTS: pkts,
+		common.COL_BYTES: bytes,
+	}
+	flow.update(fields)
+	return flow
+
+def memory_backend():
+	return backend.flowbackend.getBackendObject("memory", None, None, None, None, None)
+
+def slice_flows(flows, vectorized=True, aggr_values=[], db=None, name="flows_600", sketches=[]):
+	"""
+	Slices flows into 600 second buckets of the collection name like the
+	preprocessor does and returns the documents by bucket and
+	aggregation values.
+
+	:Parameters:
+	 - `vectorized`: Whether to use FlowHandler.handleFlows() or
+	                 handleFlow().
+	 - `db`: The memory backend. A new one if None.
+	 - `sketches`: Aggregators that are fed with the documents.
+	"""
+	if db == None:
+		db = memory_backend()
+	handler = preprocess.FlowHandler(600, db.getCollection(name), None, None, SUMS, aggr_values)
+	for aggregator in sketches:
+		handler.addSketch(aggregator)
+	if vectorized:
+		handler.handleFlows(flows)
+	else:
+		for flow in flows:
+			handler.handleFlow(flow)
+	handler.flushCache()
+	docs = dict()
+	for doc in db.collections.get(name, {}).itervalues():
+		docs[(doc[common.COL_BUCKET],) + tuple([ doc[v] for v in aggr_values ])] = doc
+	return docs
+
+def total(docs, field):
+	return sum([ doc[field] for doc in docs.itervalues() ])
@@ -0,0 +1,70 @@
+import context
+
+import unittest
+
+import common
+import sketch
+import hyperloglog
+from helpers import make_flow, memory_backend
+
+def make_doc(bucket, src, dst):
+	# a document of the flow handler as the aggregators see it
+	return make_flow(bucket, bucket, bytes=100, **{ common.COL_BUCKET: bucket, common.COL_SRC_IP: src, common.COL_DST_IP: dst, common.COL_FLOWS: 1 })
+
+class FlushTest(unittest.TestCase):
+	def setUp(self):
+		self.db = memory_backend()
+
+	def docs(self, name):
+		return self.db.collections.get(name, {}).values()
+
+	def test_sketch_open_buckets_are_kept(self):
+		aggregator = sketch.NodeSketchAggregator(self.db.getCollection("sketch"), [ common.COL_BYTES ], 10)
+		for i in range(3):
+			# flows of the open bucket 600 arrive between the flushes
+			aggregator.add_flow(make_doc(0, 1, 2))
+			aggregator.add_flow(make_doc(600, 1, 3))
+			aggregator.flush(600 if i < 2 else 1200)
+		docs = self.docs("sketch")
+		self.assertEqual(sorted([ doc[common.COL_BUCKET] for doc in docs ]), [ 0, 0, 0, 600 ])
+		buckets = [ doc for doc in docs if doc[common.COL_BUCKET] == 600 ]
+		self.assertEqual(sketch.merge_docs(buckets, common.COL_BYTES).counts[1], 300)
+		# late flows of bucket 0 are merged at query time
+		merged = sketch.merge_docs([ doc for doc in docs if doc[common.COL_BUCKET] == 0 ], common.COL_BYTES)
+		self.assertEqual(merged.counts[1], 300)
+
+	def test_sketch_one_document_per_bucket(self):
+		aggregator = sketch.NodeSketchAggregator(self.db.getCollection("sketch"), [ common.COL_BYTES ], 10)
+		for closed_before in [ 0, 600, 1200 ]:
+			aggregator.add_flow(make_doc(closed_before, 1, 2))
+			aggregator.add_flow(make_doc(closed_before, 1, 3))
+			aggregator.flush(closed_before)
+		aggregator.flush()
+		self.assertEqual(sorted([ doc[common.COL_BUCKET] for doc in self.docs("sketch") ]), [ 0, 600, 1200 ])
+
+	def test_fanout_one_document_per_bucket_and_host(self):
+		aggregator = hyperloglog.FanoutAggregator(self.db.getCollection("fanout"), common.COL_SRC_IP, [ common.COL_DST_IP ], 10)
+		for closed_before in [ 0, 600, 1200 ]:
+			for dst in range(20):
+				aggregator.add_flow(make_doc(600, 1, closed_before + dst))
+				aggregator.add_flow(make_doc(600, 2, dst))
+			aggregator.flush(closed_before)
+		aggregator.flush()
+		docs = self.docs("fanout")
+		self.assertEqual(sorted([ (doc[common.COL_BUCKET], doc[common.COL_ID]) for doc in docs ]), [ (600, 1), (600, 2) ])
+		counters = hyperloglog.merge_docs(docs, common.COL_DST_IP)
+		self.assertAlmostEqual(counters[1].count(), 60, delta=3)
+		self.assertAlmostEqual(counters[2].count(), 20, delta=1)
+
+	def test_document_ids(self):
+		aggregator = hyperloglog.FanoutAggregator(self.db.getCollection("fanout"), common.COL_SRC_IP, [ common.COL_DST_IP ], 10)
+		aggregator.add_flow(make_doc(0, 1, 2))
+		aggregator.flush(600)
+		# a late flow of bucket 0
+		aggregator.add_flow(make_doc(0, 1, 3))
+		aggregator.flush(600)
+		ids = sorted([ dict(key)["_id"] for key in self.db.collections["fanout"] ])
+		self.assertEqual(ids, [ "0:1:%s" % (aggregator.instance), "0:1:%s:2" % (aggregator.instance) ])
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,137 @@
+import context
+
+import os
+import sys
+import gzip
+import shutil
+import tempfile
+import unittest
+import StringIO
+
+import common
+import ipcodec
+import importer_modules
+import import_db_to_redis
+
+FIELDS = [ "ts", "uid", "id.orig_h", "id.orig_p", "id.resp_h", "id.resp_p", "proto", "duration", "orig_pkts", "orig_ip_bytes", "resp_pkts", "resp_ip_bytes" ]
+
+def conn_log(separator, escaped, fields, rows):
+	"""
+	Returns a connection log with the header of separator and fields.
+	rows are dicts by field.
+	"""
+	lines = [ "#separator " + escaped ]
+	lines.append(separator.join([ "#set_separator", "," ]))
+	lines.append(separator.join([ "#unset_field", "-" ]))
+	lines.append(separator.join([ "#empty_field", "(empty)" ]))
+	lines.append(separator.join([ "#fields" ] + fields))
+	for row in rows:
+		lines.append(separator.join([ row.get(f, "-") for f in fields ]))
+	lines.append("#close" + separator + "2014-01-01-00-00-00")
+	return "\n".join(lines) + "\n"
+
+def row(ts, orig_h, orig_p, resp_h, resp_p, proto="tcp", duration="10.5", orig_pkts="3", orig_bytes="300", resp_pkts="2", resp_bytes="200"):
+	return { "ts": ts, "uid": "C" + ts.replace(".", ""), "id.orig_h": orig_h, "id.orig_p": orig_p, "id.resp_h": resp_h, "id.resp_p": resp_p, "proto": proto, "duration": duration, "orig_pkts": orig_pkts, "orig_ip_bytes": orig_bytes, "resp_pkts": resp_pkts, "resp_ip_bytes": resp_bytes }
+
+def flow(first, last, src, sport, dst, dport, proto, pkts, bytes):
+	return {
+		common.COL_FIRST_SWITCHED: first,
+		common.COL_LAST_SWITCHED: last,
+		common.COL_SRC_IP: ipcodec.ip2int(src),
+		common.COL_SRC_PORT: sport,
+		common.COL_DST_IP: ipcodec.ip2int(dst),
+		common.COL_DST_PORT: dport,
+		common.COL_PROTO: proto,
+		common.COL_PKTS: pkts,
+		common.COL_BYTES: bytes,
+	}
+
+class BroImporterTest(unittest.TestCase):
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+
+	def tearDown(self):
+		shutil.rmtree(self.dir)
+
+	def write(self, name, data):
+		path = os.path.join(self.dir, name)
+		if name.endswith(".gz"):
+			f = gzip.open(path, "wb")
+		else:
+			f = open(path, "wb")
+		f.write(data)
+		f.close()
+		return path
+
+	def run_import(self, conn_file, chunk_size=None):
+		"""
+		Imports conn_file and returns the flows and the message about the
+		skipped connections.
+		"""
+		args = import_db_to_redis.parser.parse_args([ "--bro-conn-log", "--conn-file", conn_file ])
+		importer = importer_modules.BroImporter(args)
+		if chunk_size != None:
+			importer.CHUNK_SIZE = chunk_size
+		flows = []
+		stdout, stderr = sys.stdout, sys.stderr
+		sys.stdout, sys.stderr = StringIO.StringIO(), StringIO.StringIO()
+		try:
+			while True:
+				block = importer.get_next_flows()
+				if block == None:
+					break
+				flows += block
+			errors = sys.stderr.getvalue()
+		finally:
+			sys.stdout, sys.stderr = stdout, stderr
+			importer.close()
+		return flows, errors
+
+	def test_directory(self):
+		# the fields of the compressed log are reordered and separated
+		# by commas
+		reordered = list(reversed(FIELDS))
+		self.write("conn.log", conn_log("\t", "\\x09", FIELDS, [
+			row("100.0", "10.0.0.1", "1024", "10.0.0.2", "80"),
+			# unset and empty values
+			row("200.0", "10.0.0.3", "53", "10.0.0.4", "53", proto="udp", duration="-", orig_pkts="1", orig_bytes="(empty)", resp_pkts="-", resp_bytes="-"),
+			row("300.0", "::1", "1024", "::2", "80"),
+		]))
+		self.write("conn.1.log.gz", conn_log(",", "\\x2c", reordered, [
+			row("400.0", "10.0.0.5", "0", "10.0.0.6", "0", proto="icmp", duration="1.0"),
+		]) + "500.0,too,short\n")
+		# not a connection log
+		self.write("dns.log", conn_log("\t", "\\x09", FIELDS, [ row("600.0", "10.0.0.7", "1", "10.0.0.8", "2") ]))
+
+		# the files are imported in the order of their names
+		expected = [
+			flow(400.0, 401.0, "10.0.0.5", 0, "10.0.0.6", 0, 1, 3, 300),
+			flow(400.0, 401.0, "10.0.0.6", 0, "10.0.0.5", 0, 1, 2, 200),
+			flow(100.0, 110.5, "10.0.0.1", 1024, "10.0.0.2", 80, 6, 3, 300),
+			flow(100.0, 110.5, "10.0.0.2", 80, "10.0.0.1", 1024, 6, 2, 200),
+			flow(200.0, 200.0, "10.0.0.3", 53, "10.0.0.4", 53, 17, 1, 0),
+			flow(200.0, 200.0, "10.0.0.4", 53, "10.0.0.3", 53, 17, 0, 0),
+		]
+		for chunk_size in [ None, 16, 100 ]:
+			flows, errors = self.run_import(self.dir, chunk_size)
+			self.assertEqual(flows, expected)
+			# the IPv6 connection and the short line
+			self.assertTrue("Skipped 2 " in errors, errors)
+
+	def test_log_without_header(self):
+		fields = importer_modules.BroImporter.DEFAULT_FIELDS
+		values = row("100.0", "10.0.0.1", "1024", "10.0.0.2", "80")
+		path = self.write("conn.log", "\t".join([ values.get(f, "-") for f in fields ]) + "\r\n")
+		flows, errors = self.run_import(path)
+		self.assertEqual(flows, [
+			flow(100.0, 110.5, "10.0.0.1", 1024, "10.0.0.2", 80, 6, 3, 300),
+			flow(100.0, 110.5, "10.0.0.2", 80, "10.0.0.1", 1024, 6, 2, 200),
+		])
+		self.assertEqual(errors, "")
+
+	def test_empty_log(self):
+		path = self.write("conn.log", "")
+		self.assertEqual(self.run_import(path), ([], ""))
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,58 @@
+import context
+
+import unittest
+
+import common
+import bucketcatalog
+from helpers import make_flow, memory_backend, slice_flows
+
+def aggregate(db, buckets, catalog=False):
+	"""
+	Writes flows into the aggregated collection of 600s buckets like the
+	preprocessor does.
+	"""
+	sketches = []
+	if catalog:
+		sketches.append(bucketcatalog.CatalogAggregator(db.getCollection(common.DB_BUCKET_CATALOG), 600))
+	flows = [ make_flow(bucket + 10, bucket + 20) for bucket in buckets ]
+	slice_flows(flows, db=db, name=common.DB_FLOW_AGGR_PREFIX + "600", sketches=sketches)
+
+class BucketCatalogTest(unittest.TestCase):
+	def setUp(self):
+		self.db = memory_backend()
+
+	def catalog(self):
+		catalog = bucketcatalog.BucketCatalog(self.db, refresh_interval=0)
+		catalog.refresh(True)
+		return catalog
+
+	def test_partial_catalog_is_not_trusted(self):
+		aggregate(self.db, [ 0, 600 ])
+		# a flush after the catalog was enabled only knows the new buckets
+		aggregate(self.db, [ 1200 ], catalog=True)
+		self.assertFalse(self.catalog().is_complete())
+
+	def test_seed(self):
+		aggregate(self.db, [ 0, 600, 600 ])
+		aggregate(self.db, [ 1200 ], catalog=True)
+		self.assertTrue(bucketcatalog.seed(self.db, [ 600 ]))
+		catalog = self.catalog()
+		self.assertTrue(catalog.is_complete())
+		self.assertEqual(catalog.get_range(600, 0, 1200), [ 0, 600, 1200 ])
+		# the partial entry is replaced, not counted twice
+		self.assertEqual(catalog.get_counts(600, 1200, 1200), (1, 1))
+		self.assertEqual(catalog.get_counts(600, 600, 600), (1, 2))
+		# a complete catalog is not seeded again
+		self.assertFalse(bucketcatalog.seed(self.db, [ 600 ]))
+
+	def test_flush_after_seed(self):
+		bucketcatalog.seed(self.db, [ 600 ])
+		self.assertTrue(self.catalog().is_complete())
+		aggregate(self.db, [ 0, 1200 ], catalog=True)
+		catalog = self.catalog()
+		self.assertEqual(catalog.get_min_bucket(600), 0)
+		self.assertEqual(catalog.get_max_bucket(600), 1200)
+		self.assertEqual(catalog.get_range(600, 0, 1200), [ 0, 1200 ])
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,121 @@
+import context
+
+import os
+import json
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+import common
+import checkpoint
+import flowrecord
+import memoryredis
+import importer_modules
+import import_db_to_redis
+
+COLUMNS = [ "sourceIPv4Address", "destinationIPv4Address", "sourceTransportPort", "destinationTransportPort", "protocolIdentifier", "flowStartSeconds", "flowEndSeconds", "packetDeltaCount", "octetDeltaCount" ]
+
+class SQLiteVermontDB(importer_modules.VermontDB):
+	"""
+	Reads the Vermont tables of a SQLite file.
+	"""
+	def get_db_connection(self):
+		self.TYPE = "sqlite"
+		self.conn = sqlite3.connect(self.args.src_database)
+		self.c = self.conn.cursor()
+
+	def get_tables(self):
+		self.c.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE 'f\\_%' ESCAPE '\\' ORDER BY name")
+		self.tables = [ row[0] for row in self.c.fetchall() ]
+
+class CheckpointTest(unittest.TestCase):
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		self.path = os.path.join(self.dir, "flows.sqlite")
+		self.db = sqlite3.connect(self.path)
+		# the source address numbers the rows
+		self.rows = 0
+		self.r = memoryredis.MemoryRedis()
+
+	def tearDown(self):
+		self.db.close()
+		shutil.rmtree(self.dir)
+
+	def add_rows(self, table, n, start):
+		self.db.execute("CREATE TABLE IF NOT EXISTS %s (%s)" % (table, ", ".join(COLUMNS)))
+		for i in range(n):
+			self.rows += 1
+			# several rows end in the same second
+			end = start + i / 7
+			self.db.execute("INSERT INTO %s VALUES (%s)" % (table, ", ".join([ "?" ] * len(COLUMNS))), [ self.rows, 1, 1024, 80, 6, end, end, 3, 300 ])
+		self.db.commit()
+
+	def run_import(self, importer_class=SQLiteVermontDB):
+		"""
+		Imports the tables like import_db_to_redis.py --checkpoint and
+		returns the row numbers of the flows in the queue.
+		"""
+		args = import_db_to_redis.parser.parse_args([ "--src-database", self.path, "--checkpoint", "job", "--fetch-size", "100" ])
+		importer = importer_class(args)
+		store = checkpoint.CheckpointStore(self.r, args.checkpoint)
+		importer.set_checkpoints(store.load())
+		try:
+			import_db_to_redis.import_flows(args, importer, self.r, [ common.REDIS_QUEUE_KEY ], store)
+		finally:
+			importer.close()
+		return self.pop_rows()
+
+	def pop_rows(self):
+		rows = []
+		for entry in self.r.lrange(common.REDIS_QUEUE_KEY, 0, -1):
+			if flowrecord.is_binary(entry):
+				flows = flowrecord.decode(entry)
+			else:
+				flows = [ json.loads(entry) ]
+			rows += [ int(flow[common.COL_SRC_IP]) for flow in flows ]
+		self.r.delete(common.REDIS_QUEUE_KEY)
+		return rows
+
+	def test_resume(self):
+		for i, table in enumerate([ "f_0", "f_1", "f_2" ]):
+			self.add_rows(table, 500, 1000 * i)
+		self.assertEqual(sorted(self.run_import()), range(1, 1501))
+		states = checkpoint.CheckpointStore(self.r, "job").load()
+		self.assertEqual(states["f_0"], { "done": True })
+		self.assertEqual(states["f_2"], { "key": 1000 * 2 + 499 / 7, "count": 500 % 7 })
+		self.assertEqual(self.run_import(), [])
+
+		# the collector appends to the newest table, also to its last
+		# second, and creates a new one
+		self.add_rows("f_2", 50, 2000 + 499 / 7)
+		self.add_rows("f_3", 20, 4000)
+		self.assertEqual(sorted(self.run_import()), range(1501, 1571))
+
+	def test_interrupted_import(self):
+		for i, table in enumerate([ "f_0", "f_1" ]):
+			self.add_rows(table, 1000, 1000 * i)
+
+		class InterruptedImporter(SQLiteVermontDB):
+			blocks = 0
+			def get_next_flows(self):
+				InterruptedImporter.blocks += 1
+				if InterruptedImporter.blocks == 15:
+					raise KeyboardInterrupt()
+				return SQLiteVermontDB.get_next_flows(self)
+
+		self.assertRaises(KeyboardInterrupt, self.run_import, InterruptedImporter)
+		first = self.pop_rows()
+		self.assertTrue(0 < len(first) < 2000)
+		second = self.run_import()
+		# every row once
+		self.assertEqual(sorted(first + second), range(1, 2001))
+
+	def test_reset(self):
+		self.add_rows("f_0", 100, 0)
+		self.assertEqual(len(self.run_import()), 100)
+		checkpoint.CheckpointStore(self.r, "job").clear()
+		self.assertEqual(len(self.run_import()), 100)
+
+if __name__ == "__main__":
+	unittest.main()
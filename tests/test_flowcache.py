@@ -0,0 +1,79 @@
+import context
+
+import unittest
+
+import flowcache
+
+def drain(cache):
+	keys = []
+	while len(cache) > 0:
+		keys.append(cache.pop()[0])
+	return keys
+
+class FlowCacheTest(unittest.TestCase):
+	def fill(self, policy, size=10):
+		cache = flowcache.get_cache(policy, size)
+		for key in "abcd":
+			cache.put(key, { "key": key }, 0)
+		return cache
+
+	def test_fifo(self):
+		cache = self.fill("fifo")
+		cache.get("a")
+		self.assertEqual(drain(cache), [ "a", "b", "c", "d" ])
+
+	def test_lru(self):
+		cache = self.fill("lru")
+		self.assertEqual(cache.get("a"), { "key": "a" })
+		cache.get("c")
+		self.assertEqual(drain(cache), [ "b", "d", "a", "c" ])
+
+	def test_lfu(self):
+		cache = self.fill("lfu")
+		for key in "aaacc":
+			cache.get(key)
+		cache.get("d")
+		# ties in least recently used order
+		self.assertEqual(drain(cache), [ "b", "d", "c", "a" ])
+
+	def test_lfu_aging(self):
+		cache = self.fill("lfu", size=4)
+		for i in range(8):
+			cache.get("a")
+		cache.get("b")
+		# the fifth insertion halves the frequencies: a 9 -> 4, b 2 -> 1
+		cache.put("e", { "key": "e" }, 0)
+		self.assertEqual(cache.freq["a"], 4)
+		self.assertEqual(drain(cache), [ "c", "d", "b", "e", "a" ])
+
+	def test_lfu_remove(self):
+		cache = self.fill("lfu")
+		cache.get("a")
+		self.assertEqual(cache.remove("a"), { "key": "a" })
+		self.assertEqual(drain(cache), [ "b", "c", "d" ])
+
+	def test_bucket(self):
+		cache = flowcache.get_cache("bucket", 10)
+		for (key, bucket) in [ ("a", 600), ("b", 0), ("c", 600), ("d", 0), ("e", 1200) ]:
+			cache.put(key, { "key": key }, bucket)
+		cache.get("b")
+		# oldest bucket first, least recently used within a bucket
+		self.assertEqual(drain(cache), [ "d", "b", "a", "c", "e" ])
+
+	def test_bucket_pop_older(self):
+		cache = flowcache.get_cache("bucket", 10)
+		for (key, bucket) in [ ("a", 600), ("b", 0), ("c", 1200) ]:
+			cache.put(key, { "key": key }, bucket)
+		self.assertEqual(cache.remove("a"), { "key": "a" })
+		self.assertEqual([ key for (key, doc) in cache.pop_older(1200) ], [ "b" ])
+		self.assertEqual(drain(cache), [ "c" ])
+
+	def test_is_full(self):
+		for policy in flowcache.CACHE_POLICIES:
+			cache = self.fill(policy, size=3)
+			self.assertTrue(cache.is_full(), policy)
+			cache.pop()
+			self.assertFalse(cache.is_full(), policy)
+
+if __name__ == "__main__":
+	unittest.main()
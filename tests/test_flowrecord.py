@@ -0,0 +1,79 @@
+import context
+
+import json
+import unittest
+
+import common
+import flowrecord
+
+FLOW = {
+	common.COL_FIRST_SWITCHED: 1350000000,
+	common.COL_LAST_SWITCHED: 1350000042,
+	common.COL_SRC_IP: 0x0a000001,
+	common.COL_DST_IP: 0xc0a80101,
+	common.COL_SRC_PORT: 51234,
+	common.COL_DST_PORT: 443,
+	common.COL_PROTO: 6,
+	common.COL_PKTS: 12,
+	common.COL_BYTES: 2 ** 40,
+}
+
+class FlowRecordTest(unittest.TestCase):
+	def test_round_trip(self):
+		flows = []
+		for i in range(10):
+			flow = dict(FLOW)
+			flow[common.COL_SRC_PORT] = i
+			flow[common.COL_FLOWS] = i + 1
+			flows.append(flow)
+		entry = flowrecord.pack([ flowrecord.encode_flow(flow) for flow in flows ])
+		self.assertTrue(flowrecord.is_binary(entry))
+		self.assertEqual(flowrecord.decode(entry), flows)
+
+	def test_default_flows(self):
+		entry = flowrecord.pack([ flowrecord.encode_flow(FLOW) ])
+		self.assertEqual(flowrecord.decode(entry)[0][common.COL_FLOWS], 1)
+
+	def test_fields_outside_schema_are_dropped(self):
+		flow = dict(FLOW)
+		flow[common.COL_ID] = 17
+		decoded = flowrecord.decode(flowrecord.pack([ flowrecord.encode_flow(flow) ]))[0]
+		self.assertFalse(common.COL_ID in decoded)
+
+	def test_decode_version_1(self):
+		record = flowrecord.encode_flow(FLOW, 1)
+		self.assertEqual(flowrecord.decode(flowrecord.pack([ record ], 1)), [ FLOW ])
+
+	def test_unencodable_flows(self):
+		for (field, value) in [ (common.COL_SRC_IP, None), (common.COL_SRC_PORT, 70000), (common.COL_FLOWS, 2.5) ]:
+			flow = dict(FLOW)
+			flow[field] = value
+			self.assertRaises(ValueError, flowrecord.encode_flow, flow)
+		flow = dict(FLOW)
+		del flow[common.COL_BYTES]
+		self.assertRaises(ValueError, flowrecord.encode_flow, flow)
+
+	def test_encoder(self):
+		encoder = flowrecord.Encoder(3)
+		self.assertEqual(encoder.flush(), None)
+		for i in range(3):
+			self.assertTrue(encoder.add(FLOW))
+		self.assertTrue(encoder.is_full())
+		flow = dict(FLOW)
+		flow[common.COL_FLOWS] = 0.5
+		self.assertFalse(encoder.add(flow))
+		self.assertEqual(len(flowrecord.decode(encoder.flush())), 3)
+		self.assertEqual(encoder.flush(), None)
+
+	def test_invalid_entries(self):
+		entry = flowrecord.pack([ flowrecord.encode_flow(FLOW) ])
+		self.assertRaises(ValueError, flowrecord.decode, entry[:-1])
+		self.assertRaises(ValueError, flowrecord.decode, entry[:3])
+		self.assertRaises(ValueError, flowrecord.decode, flowrecord.HEADER.pack(flowrecord.MAGIC, 99, 0))
+
+	def test_json_is_not_binary(self):
+		self.assertFalse(flowrecord.is_binary(json.dumps(FLOW)))
+		self.assertFalse(flowrecord.is_binary("END"))
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,28 @@
+import context
+
+import unittest
+
+import ipcodec
+
+class IpCodecTest(unittest.TestCase):
+	def test_round_trip(self):
+		for address in [ "0.0.0.0", "10.0.0.1", "192.168.100.20", "255.255.255.255" ]:
+			self.assertEqual(ipcodec.int2ip(ipcodec.ip2int(address)), address)
+		values = ipcodec.ip2int_array([ "10.0.0.1", "0.0.0.0", "255.255.255.255" ])
+		self.assertEqual(values, [ 167772161, 0, 4294967295 ])
+		self.assertEqual(ipcodec.int2ip_array(values), [ "10.0.0.1", "0.0.0.0", "255.255.255.255" ])
+
+	def test_array_rejects_like_scalar(self):
+		for address in [ "010.0.0.1", "1.2.3.00", " 1.2.3.4", "1.2.3.4 ", "1.2.3.+4", "1..2.3", ".1.2.3", "1.2.3.", "1.2.3.256", "1.2.3.4444", "1.2.3.4294967297", "1.2.3", "", "::1" ]:
+			self.assertRaises(ValueError, ipcodec.ip2int, address)
+			self.assertRaises(ValueError, ipcodec.ip2int_array, [ address, "1.2.3.4" ])
+			self.assertRaises(ValueError, ipcodec.ip2int_array, [ "1.2.3.4", address ])
+			self.assertRaises(ValueError, ipcodec.ip2int_array, [ address ])
+
+	def test_netmask(self):
+		self.assertEqual(ipcodec.netmask2int("255.255.255.0"), 24)
+		self.assertEqual(ipcodec.int2netmask(24), "255.255.255.0")
+		self.assertEqual(ipcodec.ip_range(ipcodec.ip2int("10.1.2.3"), 16), (ipcodec.ip2int("10.1.0.0"), ipcodec.ip2int("10.1.255.255")))
+
+if __name__ == "__main__":
+	unittest.main()
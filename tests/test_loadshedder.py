@@ -0,0 +1,62 @@
+import context
+
+import unittest
+
+import common
+import loadshedder
+from helpers import make_flow, slice_flows, total
+
+def sampled_flow(i, **fields):
+	# one connection per i
+	return make_flow(1000 + i, 1100 + i, **dict({ common.COL_SRC_IP: i, common.COL_SRC_PORT: 1024 + i }, **fields))
+
+class LoadShedderTest(unittest.TestCase):
+	def test_adaption(self):
+		shedder = loadshedder.LoadShedder(1000, 100, max_weight=4, interval=0)
+		self.assertFalse(shedder.check(500, 0, 1))
+		self.assertTrue(shedder.check(2000, 0, 2))
+		self.assertTrue(shedder.check(2000, 0, 3))
+		self.assertEqual(shedder.weight, 4)
+		# at the maximum weight
+		self.assertFalse(shedder.check(2000, 0, 4))
+		self.assertFalse(shedder.check(500, 0, 5))
+		self.assertTrue(shedder.check(50, 0, 6))
+		self.assertEqual(shedder.weight, 2)
+
+	def test_sampling_is_deterministic(self):
+		shedder = loadshedder.LoadShedder(0, 0, max_weight=8, interval=0)
+		flows = [ sampled_flow(i) for i in range(2000) ]
+		weights = []
+		for weight in [ 2, 4 ]:
+			shedder.weight = weight
+			weights.append([ shedder.sample(flow) for flow in flows ])
+		# flows kept at weight 4 are also kept at weight 2
+		for (w2, w4) in zip(*weights):
+			self.assertTrue(w4 == 0 or w2 == 2)
+		kept = len([ w for w in weights[1] if w > 0 ])
+		self.assertTrue(400 < kept < 600, kept)
+
+	def test_flow_column_does_not_weight_slices(self):
+		# rows of legacy tables carry a flows column. only flows that the
+		# load shedder kept stand for more than one flow
+		flows = [ sampled_flow(i, flows=5) for i in range(10) ]
+		for vectorized in [ False, True ]:
+			self.assertAlmostEqual(total(slice_flows(flows, vectorized), common.COL_FLOWS), 10)
+		flows = [ sampled_flow(i, **{ loadshedder.WEIGHT: 4 }) for i in range(10) ]
+		for vectorized in [ False, True ]:
+			self.assertAlmostEqual(total(slice_flows(flows, vectorized), common.COL_FLOWS), 40)
+
+	def test_weighted_flow_over_several_buckets(self):
+		# shed_load() has scaled the sums by the weight already. only the
+		# number of flows is weighted while slicing
+		flow = make_flow(0, 2399, pkts=40, bytes=400, **{ loadshedder.WEIGHT: 4 })
+		for vectorized in [ False, True ]:
+			docs = slice_flows([ dict(flow) ], vectorized)
+			self.assertEqual(sorted(docs.keys()), [ (0,), (600,), (1200,), (1800,) ])
+			for doc in docs.itervalues():
+				self.assertEqual(doc[common.COL_PKTS], 10)
+				self.assertEqual(doc[common.COL_BYTES], 100)
+				self.assertAlmostEqual(doc[common.COL_FLOWS], 1.0)
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,118 @@
+import context
+
+import signal
+import socket
+import struct
+import argparse
+import unittest
+
+import common
+import flowgen
+import netflow
+import importer_modules
+
+def get_flows(count):
+	return flowgen.FlowGenerator(1).get_flows(count)
+
+class DecoderTest(unittest.TestCase):
+	def test_round_trip(self):
+		flows = get_flows(300)
+		for version in [ 5, 9, 10 ]:
+			decoder = netflow.Decoder()
+			decoded = []
+			for i in range(0, len(flows), 30):
+				if version == 5:
+					packet = netflow.encode_v5(flows[i:i + 30], sequence=i)
+				elif version == 9:
+					packet = netflow.encode_v9(flows[i:i + 30], sequence=i / 30, template=(i == 0))
+				else:
+					packet = netflow.encode_ipfix(flows[i:i + 30], sequence=i, template=(i == 0))
+				decoded.extend(decoder.decode(packet, "192.0.2.1"))
+			self.assertEqual(decoded, flows)
+			stats = decoder.get_stats()
+			self.assertEqual(stats["templates"], int(version != 5))
+			self.assertEqual(stats["lost_records"] + stats["lost_packets"] + stats["invalid_packets"], 0)
+
+	def test_data_before_template(self):
+		flows = get_flows(10)
+		decoder = netflow.Decoder()
+		self.assertEqual(decoder.decode(netflow.encode_ipfix(flows, template=False), "a"), [])
+		self.assertEqual(decoder.get_stats()["missed_records"], 1)
+		self.assertEqual(decoder.decode(netflow.encode_ipfix(flows), "a"), flows)
+
+	def test_templates_per_exporter(self):
+		flows = get_flows(10)
+		decoder = netflow.Decoder()
+		decoder.decode(netflow.encode_v9(flows), "a")
+		self.assertEqual(decoder.decode(netflow.encode_v9(flows, template=False), "b"), [])
+		self.assertEqual(decoder.decode(netflow.encode_v9(flows, template=False), "a"), flows)
+
+	def test_template_withdrawal(self):
+		flows = get_flows(10)
+		decoder = netflow.Decoder()
+		decoder.decode(netflow.encode_ipfix(flows), "a")
+		body = netflow.encode_set(netflow.IPFIX_TEMPLATE_SET, netflow.FIELD.pack(netflow.TEMPLATE_ID, 0))
+		decoder.decode(netflow.IPFIX_HEADER.pack(10, netflow.IPFIX_HEADER.size + len(body), 0, 10, 0) + body, "a")
+		self.assertEqual(decoder.get_stats()["templates"], 0)
+
+	def test_variable_length_and_enterprise_fields(self):
+		# addresses, an enterprise element, a 6 byte counter and an 
+		# interface name (variable length)
+		fields = netflow.FIELD.pack(300, 5) + netflow.FIELD.pack(8, 4) + netflow.FIELD.pack(12, 4)
+		fields += netflow.FIELD.pack(0x8000 | 5, netflow.VARIABLE_LENGTH) + struct.pack("!I", 9999)
+		fields += netflow.FIELD.pack(1, 6) + netflow.FIELD.pack(82, netflow.VARIABLE_LENGTH)
+		record = struct.pack("!II", 1, 2) + "\x03abc" + "\x00\x00\x00\x01\x00\x00" + "\xff\x00\x04eth0"
+		body = netflow.encode_set(netflow.IPFIX_TEMPLATE_SET, fields) + netflow.encode_set(300, record + "\x00")
+		packet = netflow.IPFIX_HEADER.pack(10, netflow.IPFIX_HEADER.size + len(body), 1000, 0, 7) + body
+		flows = netflow.Decoder().decode(packet, "a")
+		self.assertEqual(len(flows), 1)
+		self.assertEqual(flows[0][common.COL_SRC_IP], 1)
+		self.assertEqual(flows[0][common.COL_DST_IP], 2)
+		self.assertEqual(flows[0][common.COL_BYTES], 1 << 16)
+		self.assertEqual(flows[0][common.COL_FIRST_SWITCHED], 1000)
+
+	def test_invalid_packets(self):
+		decoder = netflow.Decoder()
+		for packet in [ "", "\x00\x05abc", netflow.encode_v5(get_flows(5))[:-10] ]:
+			self.assertEqual(decoder.decode(packet, "a"), [])
+		self.assertEqual(decoder.get_stats()["invalid_packets"], 3)
+
+	def test_lost_packets(self):
+		flows = get_flows(90)
+		decoder = netflow.Decoder()
+		# the second packet of every version does not arrive
+		for i in [ 0, 60 ]:
+			decoder.decode(netflow.encode_v5(flows[i:i + 30], sequence=i), "a")
+			decoder.decode(netflow.encode_v9(flows[i:i + 30], sequence=i / 30), "a")
+			decoder.decode(netflow.encode_ipfix(flows[i:i + 30], sequence=i), "a")
+		# a restarted exporter starts over
+		decoder.decode(netflow.encode_v5(flows[:30], sequence=0), "a")
+		stats = decoder.get_stats()
+		self.assertEqual(stats["lost_records"], 60)
+		self.assertEqual(stats["lost_packets"], 1)
+
+
+class CollectorTest(unittest.TestCase):
+	def setUp(self):
+		self.handlers = [ signal.getsignal(signal.SIGINT), signal.getsignal(signal.SIGTERM) ]
+		args = argparse.Namespace(listen_host="127.0.0.1", listen_port=0, idle_timeout=0, fetch_size=100)
+		self.collector = importer_modules.NetflowCollector(args)
+
+	def tearDown(self):
+		self.collector.close()
+		signal.signal(signal.SIGINT, self.handlers[0])
+		signal.signal(signal.SIGTERM, self.handlers[1])
+
+	def test_receive_and_stop(self):
+		self.assertFalse(self.collector.can_wait)
+		flows = get_flows(30)
+		sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+		sock.sendto(netflow.encode_v5(flows), self.collector.sock.getsockname())
+		sock.close()
+		self.assertEqual(self.collector.get_next_flows(), flows)
+		self.collector.stop()
+		self.assertEqual(self.collector.get_next_flows(), None)
+		self.assertEqual(self.collector.get_stats()["packets"], 1)
+
+if __name__ == "__main__":
+	unittest.main()
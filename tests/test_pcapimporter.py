@@ -0,0 +1,169 @@
+import context
+
+import os
+import sys
+import gzip
+import shutil
+import socket
+import struct
+import tempfile
+import unittest
+import StringIO
+
+import common
+import ipcodec
+import importer_modules
+import import_db_to_redis
+
+dpkt = importer_modules.import_dpkt()
+
+def ip_packet(src, dst, sport, dport, proto=6, payload=""):
+	"""
+	Returns an IPv4 packet from src:sport to dst:dport.
+	"""
+	if proto == 17:
+		data = dpkt.udp.UDP(sport=sport, dport=dport, data=payload)
+		data.ulen = len(data)
+	else:
+		data = dpkt.tcp.TCP(sport=sport, dport=dport, data=payload)
+	ip = dpkt.ip.IP(src=socket.inet_aton(src), dst=socket.inet_aton(dst), p=proto, data=data)
+	ip.len = len(ip)
+	return str(ip)
+
+def ethernet(packet, ethertype=0x0800, vlans=[]):
+	"""
+	Returns an Ethernet frame of packet with the VLAN tags vlans, a list
+	of (tag protocol, vlan id).
+	"""
+	frame = "\x00\x00\x00\x00\x00\x02" + "\x00\x00\x00\x00\x00\x01"
+	for (tpid, vid) in vlans:
+		frame += struct.pack(">HH", tpid, vid)
+	return frame + struct.pack(">H", ethertype) + packet
+
+def linux_sll(packet, protocol=0x0800):
+	return struct.pack(">HHH8sH", 0, 1, 6, "\x00" * 8, protocol) + packet
+
+def flow(first, last, src, sport, dst, dport, proto, pkts, bytes):
+	return {
+		common.COL_FIRST_SWITCHED: first,
+		common.COL_LAST_SWITCHED: last,
+		common.COL_SRC_IP: ipcodec.ip2int(src),
+		common.COL_SRC_PORT: sport,
+		common.COL_DST_IP: ipcodec.ip2int(dst),
+		common.COL_DST_PORT: dport,
+		common.COL_PROTO: proto,
+		common.COL_PKTS: pkts,
+		common.COL_BYTES: bytes,
+	}
+
+def flow_key(flow):
+	return (flow[common.COL_FIRST_SWITCHED], flow[common.COL_SRC_IP], flow[common.COL_SRC_PORT])
+
+class PcapImporterTest(unittest.TestCase):
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		self.tcp_len = len(ip_packet("10.0.0.1", "10.0.0.2", 1024, 80))
+
+	def tearDown(self):
+		shutil.rmtree(self.dir)
+
+	def write(self, name, frames, linktype=dpkt.pcap.DLT_EN10MB):
+		"""
+		Writes the frames, a list of (ts, frame), into the capture name.
+		"""
+		path = os.path.join(self.dir, name)
+		if name.endswith(".gz"):
+			f = gzip.open(path, "wb")
+		else:
+			f = open(path, "wb")
+		writer = dpkt.pcap.Writer(f, linktype=linktype)
+		for (ts, frame) in frames:
+			writer.writepkt(frame, ts)
+		writer.close()
+		return path
+
+	def run_import(self, pcap_file, *options):
+		"""
+		Imports pcap_file and returns the flows and the message about the
+		skipped packets.
+		"""
+		args = import_db_to_redis.parser.parse_args([ "--pcap-import", "--pcap-file", pcap_file ] + list(options))
+		importer = importer_modules.PcapImporter(args)
+		flows = []
+		stdout, stderr = sys.stdout, sys.stderr
+		sys.stdout, sys.stderr = StringIO.StringIO(), StringIO.StringIO()
+		try:
+			while True:
+				block = importer.get_next_flows()
+				if block == None:
+					break
+				flows += block
+			errors = sys.stderr.getvalue()
+		finally:
+			sys.stdout, sys.stderr = stdout, stderr
+			importer.close()
+		return flows, errors
+
+	def test_bidirectional_flows(self):
+		path = self.write("capture.pcap", [
+			(0, ethernet(ip_packet("10.0.0.1", "10.0.0.2", 1024, 80))),
+			(1, ethernet(ip_packet("10.0.0.2", "10.0.0.1", 80, 1024, payload="x" * 10))),
+			(2, ethernet(ip_packet("10.0.0.1", "10.0.0.2", 1024, 80))),
+			(3, ethernet(ip_packet("10.0.0.3", "10.0.0.4", 53, 53, proto=17, payload="x"))),
+			# ARP
+			(4, ethernet("\x00" * 28, ethertype=0x0806)),
+		])
+		flows, errors = self.run_import(path)
+		udp_len = len(ip_packet("10.0.0.3", "10.0.0.4", 53, 53, proto=17, payload="x"))
+		self.assertEqual(sorted(flows, key=flow_key), [
+			flow(0, 2, "10.0.0.1", 1024, "10.0.0.2", 80, 6, 2, 2 * self.tcp_len),
+			flow(0, 2, "10.0.0.2", 80, "10.0.0.1", 1024, 6, 1, self.tcp_len + 10),
+			flow(3, 3, "10.0.0.3", 53, "10.0.0.4", 53, 17, 1, udp_len),
+		])
+		self.assertTrue("Skipped 1 " in errors, errors)
+
+	def test_expiry(self):
+		frames = [ (0, ethernet(ip_packet("10.0.0.1", "10.0.0.2", 1024, 80))), (10, ethernet(ip_packet("10.0.0.1", "10.0.0.2", 1024, 80))) ]
+		# a long flow with a packet every 20 seconds
+		frames += [ (ts, ethernet(ip_packet("10.0.0.3", "10.0.0.4", 2048, 22))) for ts in range(0, 401, 20) ]
+		# idle for more than 30 seconds
+		frames.append((100, ethernet(ip_packet("10.0.0.1", "10.0.0.2", 1024, 80))))
+		frames.sort(key=lambda frame: frame[0])
+		path = self.write("capture.pcap", frames)
+		flows, errors = self.run_import(path, "--flow-idle-timeout", "30", "--flow-active-timeout", "300")
+		self.assertEqual(sorted(flows, key=flow_key), [
+			flow(0, 10, "10.0.0.1", 1024, "10.0.0.2", 80, 6, 2, 2 * self.tcp_len),
+			flow(0, 300, "10.0.0.3", 2048, "10.0.0.4", 22, 6, 16, 16 * self.tcp_len),
+			flow(100, 100, "10.0.0.1", 1024, "10.0.0.2", 80, 6, 1, self.tcp_len),
+			flow(320, 400, "10.0.0.3", 2048, "10.0.0.4", 22, 6, 5, 5 * self.tcp_len),
+		])
+		self.assertEqual(errors, "")
+
+	def test_max_flows(self):
+		frames = [ (ts, ethernet(ip_packet("10.0.1.%i" % (ts), "10.0.0.2", 1024, 80))) for ts in range(20) ]
+		frames.append((20, ethernet(ip_packet("10.0.1.0", "10.0.0.2", 1024, 80))))
+		path = self.write("capture.pcap", frames)
+		flows, errors = self.run_import(path, "--max-flows", "10", "--flow-idle-timeout", "1000", "--flow-active-timeout", "1000")
+		# the least recently seen flows expire first, one at a time
+		self.assertEqual([ f[common.COL_SRC_IP] for f in flows[:10] ], [ ipcodec.ip2int("10.0.1.%i" % (i)) for i in range(10) ])
+		self.assertEqual(len(flows), 21)
+		self.assertEqual(sorted(flows, key=flow_key)[-1], flow(20, 20, "10.0.1.0", 1024, "10.0.0.2", 80, 6, 1, self.tcp_len))
+
+	def test_link_layers(self):
+		packet = ip_packet("10.0.0.1", "10.0.0.2", 1024, 80)
+		self.write("1-ethernet.pcap.gz", [ (0, ethernet(packet)) ])
+		self.write("2-vlan.pcap", [ (1, ethernet(packet, vlans=[ (0x8100, 10) ])) ])
+		self.write("3-qinq.pcap", [ (2, ethernet(packet, vlans=[ (0x88a8, 10), (0x8100, 20) ])) ])
+		self.write("4-sll.cap", [ (3, linux_sll(packet)), (3, linux_sll("\x00" * 40, protocol=0x86dd)) ], linktype=importer_modules.PcapImporter.DLT_LINUX_SLL)
+		self.write("5-raw.pcap", [ (4, packet) ], linktype=101)
+		self.write("6-loop.pcap", [ (5, struct.pack("<I", 2) + packet) ], linktype=dpkt.pcap.DLT_NULL)
+		# not a capture
+		self.write("7-notes.txt", [ (6, ethernet(packet)) ])
+		flows, errors = self.run_import(self.dir)
+		# flows do not continue in the next capture
+		self.assertEqual(flows, [ flow(ts, ts, "10.0.0.1", 1024, "10.0.0.2", 80, 6, 1, self.tcp_len) for ts in range(6) ])
+		# the IPv6 packet
+		self.assertTrue("Skipped 1 " in errors, errors)
+
+if __name__ == "__main__":
+	unittest.main()
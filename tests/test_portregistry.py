@@ -0,0 +1,134 @@
+import context
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import unittest
+import subprocess
+
+import portregistry
+
+TOOL = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "tools", "compile_known_ports.py")
+
+PORTS_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<registry xmlns="http://www.iana.org/assignments" id="service-names-port-numbers">
+  <title>Service Name and Transport Protocol Port Number Registry</title>
+  <registry id="service-names-port-numbers-1">
+    <record>
+      <name>tcpmux</name>
+      <protocol>tcp</protocol>
+      <description>TCP Port Service Multiplexer</description>
+      <number>1</number>
+    </record>
+    <record>
+      <name>ssh</name>
+      <protocol>tcp</protocol>
+      <description>The Secure Shell (SSH) Protocol</description>
+      <number>22</number>
+    </record>
+    <record>
+      <name>domain</name>
+      <protocol>udp</protocol>
+      <description>Domain Name Server</description>
+      <number>53</number>
+    </record>
+    <record>
+      <name>domain</name>
+      <protocol>tcp</protocol>
+      <description>Domain Name Server</description>
+      <number>53</number>
+    </record>
+    <record>
+      <protocol>udp</protocol>
+      <description>Unassigned</description>
+      <number>54</number>
+    </record>
+    <record>
+      <name>x11</name>
+      <protocol>tcp</protocol>
+      <description>X Window System</description>
+      <number>6000-6063</number>
+    </record>
+    <record>
+      <name>m3ua</name>
+      <protocol>sctp</protocol>
+      <description>M3UA</description>
+      <number>2905</number>
+    </record>
+    <record>
+      <name>nvp-ii</name>
+      <description>without protocol</description>
+      <number>11</number>
+    </record>
+    <record>
+      <name>without-number</name>
+      <protocol>tcp</protocol>
+      <description>Reserved</description>
+    </record>
+    <record>
+      <protocol>udp</protocol>
+      <description>Reserved</description>
+      <number>65535</number>
+    </record>
+  </registry>
+</registry>
+"""
+
+class PortRegistryTest(unittest.TestCase):
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		self.xml_file = os.path.join(self.dir, "service-names-port-numbers.xml")
+		f = open(self.xml_file, "w")
+		f.write(PORTS_XML)
+		f.close()
+		self.registry_file = os.path.join(self.dir, "known_ports.bin")
+
+	def tearDown(self):
+		shutil.rmtree(self.dir)
+
+	def assertMatchesXml(self, registry):
+		known_ports = portregistry.parse_xml(self.xml_file)
+		for port in range(65536):
+			protocols = known_ports.get(port, [])
+			for proto in [ 6, 17, 0, 1 ]:
+				# ports of other protocols are stored under 0
+				self.assertEqual(registry.is_known(port, proto), proto in protocols, (port, proto))
+			self.assertEqual(registry.is_known(port), len(protocols) > 0, port)
+
+	def test_compile_tool(self):
+		subprocess.check_call([ sys.executable, TOOL, "--ports-file", self.xml_file, "--registry-file", self.registry_file ], stdout=open(os.devnull, "w"))
+		registry = portregistry.PortRegistry(self.registry_file)
+		self.assertMatchesXml(registry)
+		self.assertEqual(sorted(portregistry.parse_xml(self.xml_file)), [ 1, 11, 22, 53, 2905 ] + range(6000, 6064) + [ 65535 ])
+		for port in [ None, -1, 65536 ]:
+			self.assertFalse(registry.is_known(port))
+
+	def test_load_recompiles_outdated_registry(self):
+		registry = portregistry.load(self.xml_file, self.registry_file)
+		self.assertMatchesXml(registry)
+		self.assertFalse(registry.is_known(8080, 6))
+
+		f = open(self.xml_file, "w")
+		f.write(PORTS_XML.replace("<number>22</number>", "<number>8080</number>"))
+		f.close()
+		# the registry is older than the port list
+		past = time.time() - 10
+		os.utime(self.registry_file, (past, past))
+		registry = portregistry.load(self.xml_file, self.registry_file)
+		self.assertMatchesXml(registry)
+		self.assertTrue(registry.is_known(8080, 6))
+		self.assertFalse(registry.is_known(22, 6))
+
+	def test_invalid_registry(self):
+		portregistry.compile(self.xml_file, self.registry_file)
+		data = open(self.registry_file, "rb").read()
+		for invalid in [ data[:-1], data[:3], "NOTPORT" + data[7:] ]:
+			f = open(self.registry_file, "wb")
+			f.write(invalid)
+			f.close()
+			self.assertRaises(Exception, portregistry.PortRegistry, self.registry_file)
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,63 @@
+import context
+
+import random
+import unittest
+
+import common
+from helpers import SUMS, make_flow, slice_flows, total
+
+class SlicingTest(unittest.TestCase):
+	def assertEquivalent(self, flows, aggr_values=[], tolerance=1):
+		scalar = slice_flows(flows, False, aggr_values)
+		vector = slice_flows(flows, True, aggr_values)
+		self.assertEqual(sorted(scalar.keys()), sorted(vector.keys()))
+		for s in SUMS + [ common.COL_FLOWS ]:
+			self.assertAlmostEqual(total(scalar, s), total(vector, s), places=6)
+		for key, doc in scalar.iteritems():
+			self.assertAlmostEqual(doc[common.COL_FLOWS], vector[key][common.COL_FLOWS], places=6)
+			for s in SUMS:
+				# the scalar path carries floats, the vectorized one
+				# uses integers. a slice may differ by one
+				self.assertTrue(abs(doc[s] - vector[key][s]) <= tolerance, (key, s, doc[s], vector[key][s]))
+
+	def test_even_split(self):
+		flows = [ make_flow(0, 1199, 10, 1000), make_flow(300, 899, 7, 700), make_flow(610, 620, 3, 30) ]
+		self.assertEquivalent(flows, tolerance=0)
+		docs = slice_flows(flows, True)
+		self.assertEqual(docs[(0,)][common.COL_PKTS], 5 + 3)
+		self.assertEqual(docs[(600,)][common.COL_PKTS], 5 + 4 + 3)
+
+	def test_carry(self):
+		# one flow at a time, so that every document is a single slice
+		rng = random.Random(1)
+		for i in range(300):
+			first = rng.randint(0, 5000)
+			flow = make_flow(first, first + rng.randint(0, 4000), rng.randint(1, 1000), rng.randint(1, 10 ** 9))
+			self.assertEquivalent([ flow ])
+
+	def test_aggregation_values(self):
+		rng = random.Random(2)
+		flows = []
+		for i in range(500):
+			first = rng.randint(0, 3000)
+			flows.append(make_flow(first, first + rng.randint(0, 2000), rng.randint(1, 100), rng.randint(1, 10 ** 6), **{ common.COL_DST_PORT: rng.choice([ 22, 80, 443 ]) }))
+		# every slice of a document may differ by one
+		self.assertEquivalent(flows, [ common.COL_DST_PORT ], tolerance=len(flows))
+		docs = slice_flows(flows, True, [ common.COL_DST_PORT ])
+		self.assertEqual(total(docs, common.COL_PKTS), sum([ flow[common.COL_PKTS] for flow in flows ]))
+
+	def test_large_values(self):
+		# value * elapsed does not fit into int64
+		flow = make_flow(0, 5999, 2 ** 62, 2 ** 62 + 1)
+		docs = slice_flows([ flow ], True)
+		self.assertEqual(len(docs), 10)
+		self.assertEqual(total(docs, common.COL_PKTS), 2 ** 62)
+		self.assertEqual(total(docs, common.COL_BYTES), 2 ** 62 + 1)
+
+	def test_malformed_flows(self):
+		# flows that end before they start take the scalar path
+		flows = [ make_flow(700, 600, 10, 100), make_flow(0, 10, 1, 1) ]
+		self.assertEquivalent(flows, tolerance=0)
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Measure the throughput of the preprocessor without a collector, Redis
+or a database.
+
+Generates synthetic flows (see lib/flowgen.py), puts them into an
+in-memory queue and runs the complete preprocess loop against the
+in-memory backend for every combination of cache size and bucket
+sizes. Reports flows/s, slices/s, the cache hit ratio and the number
+of upserts that reached the backend.
+
+Example:
+	benchmark_preprocess.py --flows 500000 --cache-sizes 0,10000,100000 --bucket-sizes "600;60,600,3600"
+"""
+
+import sys
+import os.path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'config'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lib'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'preprocess'))
+
+import time
+import json
+import argparse
+
+import common
+import config
+import flowgen
+import flowrecord
+import memoryredis
+import preprocess
+
+def parse_protocols(value):
+	protocols = dict()
+	for part in value.split(","):
+		(proto, share) = part.split(":")
+		protocols[int(proto)] = float(share)
+	return protocols
+
+def make_entries(flows, queue_format):
+	if queue_format == "json":
+		return [ json.dumps(flow) for flow in flows ]
+	encoder = flowrecord.Encoder(100)
+	entries = []
+	for flow in flows:
+		if not encoder.add(flow):
+			raise Exception("Synthetic flow does not match the record schema: " + str(flow))
+		if encoder.is_full():
+			entries.append(encoder.flush())
+	entry = encoder.flush()
+	if entry != None:
+		entries.append(entry)
+	return entries
+
+def run(entries, cache_size, bucket_sizes, preprocess_args, verbose):
+	config.pre_cache_size = cache_size
+	config.flow_bucket_sizes = bucket_sizes
+
+	r = memoryredis.MemoryRedis()
+	r.rpush(common.REDIS_QUEUE_KEY, *(entries + [ "END" ]))
+	args = preprocess.parser.parse_args([ "--backend", "memory" ] + preprocess_args)
+	preprocessor = preprocess.Preprocessor(args, common.REDIS_QUEUE_KEY)
+
+	stdout = sys.stdout
+	if not verbose:
+		sys.stdout = open(os.devnull, "w")
+	try:
+		preprocessor.connect(True, r)
+		start = time.time()
+		preprocessor.run()
+		elapsed = time.time() - start
+	finally:
+		sys.stdout = stdout
+
+	handlers = preprocessor.handlers
+	# the hit ratio of the caches that use pre_cache_size. the handlers 
+	# of the completely aggregated flows have their own small caches
+	hits = sum([ h.cache_hits for h in handlers if len(h.aggr_values) > 0 ])
+	misses = sum([ h.cache_misses for h in handlers if len(h.aggr_values) > 0 ])
+	result = {
+		"flows": handlers[0].num_flows,
+		"slices": sum([ h.num_slices for h in handlers ]),
+		"elapsed": elapsed,
+		"hit_ratio": 0,
+		"upserts": sum(preprocessor.dst_db.upserts.values()),
+	}
+	if hits + misses > 0:
+		result["hit_ratio"] = hits / float(hits + misses) * 100
+	return result
+
+
+parser = argparse.ArgumentParser(description="Measure the preprocessor throughput with synthetic flows")
+parser.add_argument("--flows", nargs="?", default=200000, type=int, help="Number of flows per run.")
+parser.add_argument("--seed", nargs="?", default=0, type=int, help="Seed of the flow generator.")
+parser.add_argument("--rate", nargs="?", default=1000.0, type=float, help="Flows per second of flow time.")
+parser.add_argument("--hosts", nargs="?", default=10000, type=int, help="Number of distinct IP addresses.")
+parser.add_argument("--host-skew", nargs="?", default=1.0, type=float, help="Zipf exponent of the address popularity. 0 is uniform.")
+parser.add_argument("--ports", nargs="?", default=1000, type=int, help="Number of distinct server ports.")
+parser.add_argument("--port-skew", nargs="?", default=1.2, type=float, help="Zipf exponent of the port popularity. 0 is uniform.")
+parser.add_argument("--duration", nargs="?", default="exp", choices=[ "exp", "pareto" ], help="Flow duration distribution.")
+parser.add_argument("--duration-mean", nargs="?", default=10.0, type=float, help="Mean flow duration in seconds.")
+parser.add_argument("--protocols", nargs="?", default="6:0.8,17:0.15,1:0.05", help="Protocol mix as protocol:share,...")
+parser.add_argument("--queue-format", nargs="?", default="binary", choices=[ "json", "binary" ], help="Encoding of the queue entries.")
+parser.add_argument("--cache-sizes", nargs="?", default="0,10000,100000", help="Comma separated list of pre_cache_size values.")
+parser.add_argument("--bucket-sizes", nargs="?", default="600", help="flow_bucket_sizes settings to compare. Settings are separated by ';', sizes by ','.")
+parser.add_argument("--preprocess-args", nargs="?", default="", help="Further arguments for the preprocessor, e.g. \"--cache-policy lfu --batch-size 1000\".")
+parser.add_argument("--verbose", nargs="?", type=bool, default=False, const=True, help="Show the output of the preprocessor.")
+
+if __name__ == "__main__":
+	args = parser.parse_args()
+
+	generator = flowgen.FlowGenerator(args.seed, rate=args.rate, hosts=args.hosts, host_skew=args.host_skew, ports=args.ports, port_skew=args.port_skew, duration=args.duration, duration_mean=args.duration_mean, protocols=parse_protocols(args.protocols))
+	entries = make_entries(generator.get_flows(args.flows), args.queue_format)
+	cache_sizes = [ int(s) for s in args.cache_sizes.split(",") ]
+	bucket_settings = [ [ int(s) for s in setting.split(",") ] for setting in args.bucket_sizes.split(";") ]
+
+	print "%i flows, %i queue entries (%s)" % (args.flows, len(entries), args.queue_format)
+	print "%-12s %-20s %12s %12s %10s %14s" % ("cache size", "bucket sizes", "flows/s", "slices/s", "hit ratio", "backend calls")
+	for bucket_sizes in bucket_settings:
+		for cache_size in cache_sizes:
+			result = run(entries, cache_size, bucket_sizes, args.preprocess_args.split(), args.verbose)
+			print "%-12i %-20s %12.0f %12.0f %9.2f%% %14i" % (
+				cache_size, ",".join([ str(s) for s in bucket_sizes ]),
+				result["flows"] / result["elapsed"], result["slices"] / result["elapsed"],
+				result["hit_ratio"], result["upserts"])
@@ -0,0 +1,32 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Compile the IANA port list into the registry of known ports that the
+preprocessor memory-maps when flow_filter_unknown_ports is enabled.
+The preprocessor compiles the registry itself if it is missing or 
+older than the port list. Run this tool after updating the port list
+to avoid the compilation at the next start.
+"""
+
+import sys
+import os.path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'config'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lib'))
+
+import time
+import argparse
+
+import common
+import portregistry
+
+parser = argparse.ArgumentParser(description="Compile the IANA port list into the registry of known ports")
+parser.add_argument("--ports-file", nargs="?", default=common.PORTS_FILE, help="IANA service-names-port-numbers.xml")
+parser.add_argument("--registry-file", nargs="?", default=common.PORTS_REGISTRY_FILE, help="Output file")
+
+if __name__ == "__main__":
+	args = parser.parse_args()
+
+	start = time.time()
+	portregistry.compile(args.ports_file, args.registry_file)
+	print "Compiled %s to %s in %.2f s" % (args.ports_file, args.registry_file, time.time() - start)
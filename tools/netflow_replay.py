@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Send synthetic NetFlow v5/v9 or IPFIX packets to a collector.
+
+Generates flows (see lib/flowgen.py), encodes them with lib/netflow.py
+and sends them over UDP, e.g. to test the collector of
+import_db_to_redis.py. v9 and IPFIX packets repeat the template every
+--template-interval packets.
+
+Example:
+	import_db_to_redis.py --netflow-collector --listen-port 4739 --idle-timeout 5
+	netflow_replay.py --version 10 --flows 100000 --port 4739
+"""
+
+import sys
+import os.path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'config'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'lib'))
+
+import time
+import socket
+import argparse
+
+import flowgen
+import netflow
+
+parser = argparse.ArgumentParser(description="Send synthetic NetFlow v5/v9 or IPFIX packets to a collector")
+parser.add_argument("--host", nargs="?", default="127.0.0.1", help="Collector host")
+parser.add_argument("--port", nargs="?", default=4739, type=int, help="Collector UDP port")
+parser.add_argument("--version", nargs="?", default=10, type=int, choices=[ 5, 9, 10 ], help="Export protocol: NetFlow 5, NetFlow 9 or IPFIX (10).")
+parser.add_argument("--flows", nargs="?", default=100000, type=int, help="Number of flows.")
+parser.add_argument("--flows-per-packet", nargs="?", default=30, type=int, help="Number of flows per packet. NetFlow v5 packets hold at most 30 flows.")
+parser.add_argument("--template-interval", nargs="?", default=20, type=int, help="Number of packets after which the template is sent again (v9 and IPFIX).")
+parser.add_argument("--packet-rate", nargs="?", default=0, type=float, help="Packets per second. 0 sends as fast as possible.")
+parser.add_argument("--seed", nargs="?", default=0, type=int, help="Seed of the flow generator.")
+parser.add_argument("--rate", nargs="?", default=1000.0, type=float, help="Flows per second of flow time.")
+parser.add_argument("--hosts", nargs="?", default=10000, type=int, help="Number of distinct IP addresses.")
+
+if __name__ == "__main__":
+	args = parser.parse_args()
+
+	per_packet = args.flows_per_packet
+	if args.version == 5:
+		per_packet = min(per_packet, netflow.V5_MAX_RECORDS)
+	generator = flowgen.FlowGenerator(args.seed, rate=args.rate, hosts=args.hosts)
+	sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+	start = time.time()
+	sent = 0
+	packets = 0
+	while sent < args.flows:
+		flows = generator.get_flows(min(per_packet, args.flows - sent))
+		if args.version == 5:
+			data = netflow.encode_v5(flows, sequence=sent)
+		elif args.version == 9:
+			data = netflow.encode_v9(flows, sequence=packets, template=(packets % args.template_interval == 0))
+		else:
+			data = netflow.encode_ipfix(flows, sequence=sent, template=(packets % args.template_interval == 0))
+		sock.sendto(data, (args.host, args.port))
+		sent += len(flows)
+		packets += 1
+		if args.packet_rate > 0:
+			delay = start + packets / args.packet_rate - time.time()
+			if delay > 0:
+				time.sleep(delay)
+
+	elapsed = time.time() - start
+	print "Sent %i flows in %i packets in %.2f s (%.0f flows/s)" % (sent, packets, elapsed, sent / max(elapsed, 0.001))